@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class LoginLimit(Exception):
+    """Одновременно идёт max_pending входов; новый придётся повторить позже."""
+
+
+class _Login:
+    __slots__ = ("client", "key")
+
+    def __init__(self, key):
+        self.client = None  # появляется после create; до этого место уже занято
+        self.key = key  # (api_id, api_hash, phone)
+
+
+class PendingLogins:
+    """Незавершённые входы: подключенный клиент между send_code и sign_in.
+
+    Клиент входа живёт здесь, а не в пуле ClientManager, и переходит туда
+    только после успешного sign_in или check_password (finish). Повторный
+    ввод кода, повторная отправка и новый запрос кода на тот же номер идут
+    через то же соединение. Одновременно открыто не больше max_pending
+    входов; брошенный вход отключается через timeout секунд без действий,
+    а его неавторизованный файл сессии удаляется.
+    """
+
+    def __init__(self, create, session_path=None, timeout: float = 600, max_pending: int = 50):
+        self.create = create  # async (user_id, api_id, api_hash, phone) -> новый неподключенный клиент
+        self.session_path = session_path  # user_id -> путь файла сессии
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self._logins = OrderedDict()  # user_id -> _Login, от давних действий к свежим
+        self._last_used = {}
+        self._reaper = None
+        self.started = 0
+        self.reused = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.reaped = 0
+        self.refused = 0
+
+    def __len__(self):
+        return len(self._logins)
+
+    def __contains__(self, user_id):
+        return user_id in self._logins
+
+    def _touch(self, user_id):
+        self._logins.move_to_end(user_id)
+        self._last_used[user_id] = time.monotonic()
+
+    async def begin(self, user_id, api_id, api_hash, phone):
+        """Подключенный клиент для send_code.
+
+        Если вход на тот же номер с теми же API ID и Hash уже идёт,
+        возвращается его клиент без нового подключения.
+        """
+        key = (api_id, api_hash, phone)
+        login = self._logins.get(user_id)
+        if login is not None:
+            if login.key == key and login.client is not None and login.client.is_connected:
+                self.reused += 1
+                self._touch(user_id)
+                return login.client
+            await self.cancel(user_id)
+        if len(self._logins) >= self.max_pending:
+            await self.reap()
+            if len(self._logins) >= self.max_pending:
+                self.refused += 1
+                raise LoginLimit(f"одновременно идёт {len(self._logins)} входов")
+        # Место занимается до подключения: параллельные входы не превысят лимит
+        login = self._logins[user_id] = _Login(key)
+        self._touch(user_id)
+        try:
+            login.client = await self.create(user_id, api_id, api_hash, phone)
+            await login.client.connect()
+        except BaseException:
+            if self._logins.get(user_id) is login:
+                self._forget(user_id)
+            await self._shutdown(user_id, login.client)
+            raise
+        self.started += 1
+        return login.client
+
+    def get(self, user_id):
+        """Клиент идущего входа или None; каждое обращение продлевает вход."""
+        login = self._logins.get(user_id)
+        if login is None or login.client is None:
+            return None
+        self._touch(user_id)
+        return login.client
+
+    def finish(self, user_id):
+        """Забирает клиента вошедшего аккаунта без отключения — дальше им владеет пул."""
+        login = self._logins.get(user_id)
+        self._forget(user_id)
+        if login is None:
+            return None
+        self.completed += 1
+        return login.client
+
+    async def cancel(self, user_id):
+        """Отменяет вход: клиент отключается, файл сессии удаляется."""
+        login = self._logins.get(user_id)
+        if login is None:
+            return False
+        self._forget(user_id)
+        self.cancelled += 1
+        await self._shutdown(user_id, login.client)
+        return True
+
+    def _forget(self, user_id):
+        self._logins.pop(user_id, None)
+        self._last_used.pop(user_id, None)
+
+    async def _shutdown(self, user_id, client):
+        if client is not None and client.is_connected:
+            try:
+                await client.disconnect()
+            except Exception as e:
+                logger.warning("[User %s] Ошибка при отключении клиента входа: %s", user_id, e)
+        if self.session_path is not None:
+            # Вход не завершён: в файле только ключ без авторизации
+            try:
+                os.remove(self.session_path(user_id))
+            except FileNotFoundError:
+                pass
+
+    # --- Брошенные входы ---
+    def start(self):
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(max(1.0, self.timeout / 4))
+            await self.reap()
+
+    async def reap(self):
+        deadline = time.monotonic() - self.timeout
+        idle = []
+        for user_id, login in self._logins.items():
+            if self._last_used.get(user_id, 0) > deadline:
+                break
+            if login.client is not None:  # ещё подключается — не трогаем
+                idle.append(user_id)
+        for user_id in idle:
+            client = self._logins[user_id].client
+            self._forget(user_id)
+            self.reaped += 1
+            logger.info("[User %s] Незавершённый вход отменён после %s с простоя", user_id, self.timeout)
+            await self._shutdown(user_id, client)
+        return len(idle)
+
+    async def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            try:
+                await self._reaper
+            except asyncio.CancelledError:
+                pass
+            self._reaper = None
+        logins = list(self._logins.items())
+        for user_id, _ in logins:
+            self._forget(user_id)
+        await asyncio.gather(*(self._shutdown(user_id, login.client) for user_id, login in logins))
+
+    def stats(self):
+        return {
+            "pending": len(self._logins),
+            "max": self.max_pending,
+            "started": self.started,
+            "reused": self.reused,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "reaped": self.reaped,
+            "refused": self.refused,
+        }
@@ -0,0 +1,121 @@
+"""Шторм брошенных входов: соединения и память при незавершённых авторизациях.
+
+Каждый пользователь волны вводит номер, ошибается в коде, просит код
+повторно, половина ещё раз вводит тот же номер — и все уходят, не войдя.
+Между волнами проходит AUTH_TIMEOUT (5 с): брошенные входы отключаются.
+Замеряются подключения (connect), открытые соединения и память.
+
+    python benchmarks/bench_auth.py [пользователей в волне] [волн] [AUTH_PENDING_MAX]
+"""
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import common  # noqa: F401  (путь к модулям бота)
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+WAVES = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+PENDING_MAX = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+TIMEOUT = 5
+
+# Окружение задаётся до импорта main: конфигурация читается при импорте
+os.environ["WORK_DIR"] = tempfile.mkdtemp(prefix="bench-auth-")
+os.environ.setdefault("BOT_TOKEN", "123456:OFFLINE-BENCHMARK")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ["AUTH_TIMEOUT"] = str(TIMEOUT)
+os.environ["AUTH_PENDING_MAX"] = str(PENDING_MAX)
+
+from pyrogram import errors  # noqa: E402
+
+import fakes  # noqa: E402
+import main  # noqa: E402
+
+
+class StormClient(fakes.FakeClient):
+    """Считает подключения и открытые соединения; код 00000 неверный."""
+
+    connects = 0
+    connected = 0
+    peak = 0
+
+    async def connect(self):
+        result = await super().connect()
+        StormClient.connects += 1
+        StormClient.connected += 1
+        StormClient.peak = max(StormClient.peak, StormClient.connected)
+        return result
+
+    async def disconnect(self):
+        if self.is_connected:
+            StormClient.connected -= 1
+        await super().disconnect()
+
+    async def sign_in(self, phone_number, phone_code_hash, phone_code):
+        await self._rpc()
+        raise errors.PhoneCodeInvalid()
+
+
+main.user_clients.client_class = StormClient
+
+
+def rss_mb():
+    # Текущий, а не пиковый RSS: память должна вернуться после reap
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+
+
+def storm(bot, uid):
+    phone = f"+7{uid:010d}"
+    updates = [
+        fakes.callback_update(bot, uid, "start_auth"),
+        fakes.message_update(bot, uid, "12345678 0123456789abcdef0123456789abcdef"),
+        fakes.message_update(bot, uid, phone),
+        fakes.message_update(bot, uid, "00000"),
+        fakes.callback_update(bot, uid, "resend_code"),
+    ]
+    if uid % 2:
+        # Повторный запрос кода на тот же номер: то же соединение
+        updates += [fakes.callback_update(bot, uid, "start_auth"), fakes.message_update(bot, uid, phone)]
+    return updates
+
+
+async def amain():
+    main.init_db()
+    main.fsm_storage.start()
+    bot = fakes.make_bot()
+    print(f"волна: {USERS} пользователей, AUTH_PENDING_MAX={PENDING_MAX}, AUTH_TIMEOUT={TIMEOUT} с")
+    uid = 10 ** 6
+    for wave in range(WAVES):
+        StormClient.peak = StormClient.connected
+        connects = StormClient.connects
+        flows = [storm(bot, u) for u in range(uid, uid + USERS)]
+        uid += USERS
+
+        async def drive(updates):
+            for update in updates:
+                await main.dp.feed_update(bot, update)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(drive(updates) for updates in flows))
+        elapsed = time.perf_counter() - t0
+        during = len(main.auth_logins)
+        await asyncio.sleep(TIMEOUT + 0.1)
+        await main.auth_logins.reap()
+        stats = main.auth_logins.stats()
+        print(f"волна {wave + 1}: {len(flows) / elapsed:>6.0f} входов/с   подключений {StormClient.connects - connects:>5}   "
+              f"пик соединений {StormClient.peak:>5}   входов {during:>5} -> {len(main.auth_logins)}   "
+              f"открыто после reap {StormClient.connected:>3}   RSS {rss_mb():.0f} МБ   "
+              f"reused={stats['reused']} refused={stats['refused']}")
+    sessions = sum(1 for name in os.listdir(os.environ["WORK_DIR"]) if name.endswith(".session"))
+    print(f"итог: {main.auth_logins.stats()}, файлов сессий {sessions}")
+    await main.auth_logins.close()
+    await main.limiter.close()
+    await main.fsm_storage.close()
+    main.db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(amain())
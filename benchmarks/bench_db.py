@@ -0,0 +1,106 @@
+"""Соединение на каждый вызов против долгоживущего WAL-соединения.
+
+    python benchmarks/bench_db.py [ops] [concurrency]
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from common import report
+
+from db import Database
+
+
+# --- Старый вариант: connect/execute/close на каждый вызов прямо в event loop ---
+def legacy_get_ghost_mode(path, user_id):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT enabled FROM ghost_mode WHERE user_id = ?", (user_id,))
+    res = cursor.fetchone()
+    conn.close()
+    return res[0] if res else 0
+
+
+def legacy_set_ghost_mode(path, user_id, enabled):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute("INSERT OR REPLACE INTO ghost_mode (user_id, enabled) VALUES (?, ?)", (user_id, enabled))
+    conn.commit()
+    conn.close()
+
+
+async def run_handlers(handler, ops, concurrency):
+    """Возвращает (ops, elapsed, latencies) и задержку event loop для прочих обработчиков."""
+    latencies = []
+    lag = []
+    per_worker = ops // concurrency
+    done = asyncio.Event()
+
+    # Пробник: лёгкий обработчик, которому нужен event loop, пока идут запросы к БД
+    async def probe():
+        while not done.is_set():
+            t0 = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag.append(time.perf_counter() - t0 - 0.001)
+
+    async def worker(n):
+        for i in range(per_worker):
+            t0 = time.perf_counter()
+            await handler(n * per_worker + i)
+            latencies.append(time.perf_counter() - t0)
+
+    probe_task = asyncio.create_task(probe())
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    done.set()
+    await probe_task
+    return (per_worker * concurrency, elapsed, latencies), lag
+
+
+async def main():
+    ops = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bot_data.db")
+        db = Database(path)
+        db.open()
+
+        # Обработчик ghost_toggle: запись флага и чтение для перерисовки клавиатуры
+        async def legacy_handler(i):
+            uid = i % 500
+            legacy_set_ghost_mode(path, uid, (i // 500) & 1)
+            legacy_get_ghost_mode(path, uid)
+
+        async def pooled_handler(i):
+            uid = i % 500
+            # Кэш сбрасывается, чтобы измерить именно обращения к SQLite
+            db.invalidate(uid)
+            await db.set_ghost_mode(uid, (i // 500) & 1)
+            db.invalidate(uid)
+            await db.get_ghost_mode(uid)
+
+        for name, handler in (("per-call connect", legacy_handler), ("pooled WAL connection", pooled_handler)):
+            result, lag = await run_handlers(handler, ops, concurrency)
+            report(f"{name} (ghost_toggle)", *result)
+            report(f"{name} (event loop lag)", len(lag), result[1], lag)
+
+        # Установившийся режим: повторный рендер меню и повторное нажатие той же кнопки
+        async def cached_handler(i):
+            uid = i % 500
+            await db.set_ghost_mode(uid, 1)
+            await db.get_ghost_mode(uid)
+
+        await run_handlers(cached_handler, 500, 1)
+        result, lag = await run_handlers(cached_handler, ops, concurrency)
+        report("write-through cache (steady state)", *result)
+        print("cache:", db.cache_stats()["ghost_mode"])
+        db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,161 @@
+"""Экспорт истории чата: скорость, память и продолжение после обрыва.
+
+Фейковый клиент отдаёт messages.getHistory страницами по 100 сырых
+сообщений (текст, ответы, медиа, разметка, служебные). Потоковая выгрузка
+export_history сравнивается со сбором всей истории в памяти и сжатием в
+конце; затем выгрузка отменяется на 40%, в архив дописывается мусор
+(обрыв посреди записи) и выгрузка продолжается с контрольной точки.
+
+    python benchmarks/bench_export.py [сообщений] [--rpc-ms 0]
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import resource
+import tempfile
+import time
+from types import SimpleNamespace
+
+import common  # noqa: F401  (путь к модулям бота)
+import fakes
+from db import Database
+from export import PAGE, export_history, record
+from ratelimit import AccountRateLimiter
+
+from pyrogram import raw
+
+USER = 1
+TEXTS = ["ok", "Привет! Как дела?", "Ссылка на документацию: https://docs.example.com/export " * 2,
+         "Длинное сообщение с обсуждением. " * 12]
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+
+
+def message(i, peer):
+    """Сообщение номер i: состав стабилен между запусками."""
+    sender = raw.types.PeerUser(user_id=1000 + i % 37)
+    if i % 50 == 0:
+        return raw.types.MessageService(id=i, peer_id=peer, date=1_600_000_000 + i, from_id=sender,
+                                        action=raw.types.MessageActionChatAddUser(users=[i]))
+    return raw.types.Message(
+        id=i, peer_id=peer, date=1_600_000_000 + i, message=f"{TEXTS[i % len(TEXTS)]} #{i}", from_id=sender,
+        reply_to=raw.types.MessageReplyHeader(reply_to_msg_id=i - 3) if i % 10 == 0 else None,
+        media=raw.types.MessageMediaPhoto(photo=raw.types.PhotoEmpty(id=i)) if i % 7 == 0 else None,
+        entities=[raw.types.MessageEntityBold(offset=0, length=2)] if i % 5 == 0 else None,
+        views=i if i % 3 == 0 else None,
+    )
+
+
+class HistoryClient(fakes.FakeClient):
+    """messages.getHistory по чату из total сообщений с id 1..total, от новых к старым."""
+
+    total = 0
+
+    async def invoke(self, query):
+        await self._rpc()
+        offset = query.offset_id or self.total + 1
+        peer = raw.types.PeerChannel(channel_id=1)
+        ids = range(offset - 1, max(0, offset - 1 - query.limit), -1)
+        return SimpleNamespace(messages=[message(i, peer) for i in ids])
+
+
+async def in_memory(client, limiter, path):
+    """Как без потоковой записи: вся история в списке, архив пишется в конце."""
+    from export import _history_page
+
+    peer = await client.resolve_peer("@bench_chat")
+    lines, offset_id = [], 0
+    t0 = time.perf_counter()
+    while True:
+        messages = await limiter.call(USER, _history_page, client, peer, offset_id, PAGE)
+        if not messages:
+            break
+        offset_id = messages[-1].id
+        lines.extend(json.dumps(rec, ensure_ascii=False, separators=(",", ":"))
+                     for rec in map(record, messages) if rec is not None)
+    peak = rss_mb()
+    with gzip.open(path, "wt", compresslevel=6) as f:
+        f.write("\n".join(lines) + "\n")
+    return len(lines), time.perf_counter() - t0, peak
+
+
+def verify(path, total):
+    """Архив читается как один gzip, каждое сообщение ровно один раз, от новых к старым."""
+    ids = []
+    with gzip.open(path, "rt") as f:
+        for line in f:
+            ids.append(json.loads(line)["id"])
+    return len(ids) == total and ids == list(range(total, 0, -1))
+
+
+async def amain(args):
+    fakes.FakeClient.latency = args.rpc_ms / 1000
+    HistoryClient.total = args.messages
+    tmp = tempfile.mkdtemp(prefix="bench-export-")
+    db = Database(os.path.join(tmp, "bot_data.db"))
+    db.open()
+    limiter = AccountRateLimiter(rate=1_000_000, burst=1_000_000, concurrency=4)
+    client = HistoryClient(name="session_bench")
+    directory = os.path.join(tmp, "exports")
+    print(f"чат из {args.messages} сообщений, RPC {args.rpc_ms:.0f} мс, страница {PAGE}")
+
+    # Потоковая выгрузка: RSS на 10%, 50% и в конце
+    base = rss_mb()
+    samples = {}
+
+    async def sample(exported, rate):
+        for mark in (10, 50):
+            if mark not in samples and exported >= args.messages * mark / 100:
+                samples[mark] = rss_mb()
+
+    path, exported, _, elapsed = await export_history(client, USER, "@bench_chat", db, limiter, directory,
+                                                      on_progress=sample)
+    samples[100] = rss_mb()
+    size = os.path.getsize(path)
+    print(f"потоковая: {exported / elapsed:>9.0f} сообщ./с   {elapsed:6.1f} с   архив {size / 1024 / 1024:.1f} МБ "
+          f"({size / exported:.0f} байт/сообщ.)   RSS до {base:.0f} МБ, на 10/50/100%: "
+          + " / ".join(f"{samples[m]:.0f}" for m in (10, 50, 100)) + " МБ"
+          + ("   архив цел" if verify(path, args.messages) else "   АРХИВ ПОВРЕЖДЁН"))
+
+    # Отмена на 40%, мусор в конце архива, продолжение
+    task = None
+
+    async def stop(exported, rate):
+        if exported >= args.messages * 0.4:
+            task.cancel()
+
+    task = asyncio.create_task(export_history(client, USER, "@bench_resume", db, limiter, directory,
+                                              on_progress=stop))
+    t0 = time.perf_counter()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    first = time.perf_counter() - t0
+    resume_path, last_id, saved, checkpoint_size = await db.get_export_progress(USER, "@bench_resume")
+    with open(resume_path, "ab") as f:
+        f.write(os.urandom(4096))  # недописанный член после обрыва
+    calls = client.rpc_calls
+    path, exported, session, elapsed = await export_history(client, USER, "@bench_resume", db, limiter, directory)
+    print(f"продолжение: отменено на {saved} сообщениях за {first:.1f} с (id {last_id}, {checkpoint_size >> 10} КБ + 4 КБ мусора), "
+          f"дозагружено {session} за {elapsed:.1f} с, страниц {client.rpc_calls - calls}, всего {exported}"
+          + ("   архив цел" if verify(path, args.messages) else "   АРХИВ ПОВРЕЖДЁН")
+          + f"   контрольных точек осталось: {await db.get_export_progress(USER, '@bench_resume') or 0}")
+
+    count, elapsed, peak = await in_memory(client, limiter, os.path.join(tmp, "memory.jsonl.gz"))
+    print(f"в памяти:  {count / elapsed:>9.0f} сообщ./с   {elapsed:6.1f} с   RSS перед записью {peak:.0f} МБ")
+
+    await limiter.close()
+    db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("messages", nargs="?", type=int, default=1_000_000)
+    parser.add_argument("--rpc-ms", type=float, default=0.0, help="задержка каждого RPC фейкового клиента")
+    asyncio.run(amain(parser.parse_args()))
@@ -0,0 +1,62 @@
+"""Горячий путь FSM: MemoryStorage против SQLiteStorage.
+
+    python benchmarks/bench_fsm.py [users] [rounds]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from common import report
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from db import Database
+from fsm_storage import SQLiteStorage
+
+
+async def drive(storage, users, rounds):
+    """Типичный шаг мастера: get_state, update_data, set_state, get_data."""
+    keys = [StorageKey(bot_id=1, chat_id=u, user_id=u) for u in range(users)]
+    latencies = []
+    t0 = time.perf_counter()
+    for r in range(rounds):
+        for key in keys:
+            s = time.perf_counter()
+            await storage.get_state(key)
+            await storage.update_data(key, {"target": f"@chat{r}"})
+            await storage.set_state(key, f"ActionStates:step{r % 3}")
+            await storage.get_data(key)
+            latencies.append(time.perf_counter() - s)
+    return users * rounds, time.perf_counter() - t0, latencies
+
+
+async def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    report("MemoryStorage", *await drive(MemoryStorage(), users, rounds))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bot_data.db"))
+        db.open()
+        storage = SQLiteStorage(db, flush_interval=0.2)
+        storage.start()
+        await drive(storage, users, 1)  # прогрев: первое обращение читает БД
+        report("SQLiteStorage (hot)", *await drive(storage, users, rounds))
+        await storage.close()
+        print("storage:", storage.stats())
+
+        # Холодный старт: состояния восстанавливаются из БД
+        restored = SQLiteStorage(db)
+        t0 = time.perf_counter()
+        states = [await restored.get_state(StorageKey(bot_id=1, chat_id=u, user_id=u)) for u in range(users)]
+        report("SQLiteStorage (cold load)", users, time.perf_counter() - t0)
+        print(f"restored {sum(1 for s in states if s)}/{users} states")
+        db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
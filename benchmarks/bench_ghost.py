@@ -0,0 +1,117 @@
+"""Призрачный режим: один таймер на все аккаунты против задачи на каждый аккаунт.
+
+Фейковые клиенты отвечают на account.updateStatus мгновенно; замеряются
+процессорное время, пробуждения event loop и число обновлений статуса.
+
+    python benchmarks/bench_ghost.py [аккаунтов через запятую] [интервал, с] [длительность, с]
+"""
+import asyncio
+import sys
+import time
+
+import common  # noqa: F401  (путь к модулям бота)
+
+from ghost import GhostEngine
+
+
+class FakeDB:
+    async def get_ghost_mode(self, user_id):
+        return 1
+
+    async def set_ghost_mode(self, user_id, enabled):
+        pass
+
+
+class FakeClient:
+    def __init__(self):
+        self.calls = 0
+
+    async def invoke(self, query):
+        self.calls += 1
+        return True
+
+
+class LoopCounter:
+    """Считает итерации event loop, в которых были готовые колбэки (пробуждения)."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.count = 0
+        self._run_once = loop._run_once
+
+        def run_once():
+            if loop._ready or loop._scheduled:
+                self.count += 1
+            self._run_once()
+
+        loop._run_once = run_once
+
+    def restore(self):
+        self.loop._run_once = self._run_once
+
+
+async def measure(name, n, interval, duration, attach, teardown):
+    loop = asyncio.get_running_loop()
+    clients = {uid: FakeClient() for uid in range(n)}
+    # Аккаунты входят в течение одного интервала, как при обычной работе
+    slices = 1000
+    for i in range(slices):
+        for uid in range(i * n // slices, (i + 1) * n // slices):
+            await attach(uid, clients[uid])
+        await asyncio.sleep(interval / slices)
+    for client in clients.values():
+        client.calls = 0
+    counter = LoopCounter(loop)
+    cpu = time.process_time()
+    await asyncio.sleep(duration)
+    cpu = time.process_time() - cpu
+    counter.restore()
+    await teardown()
+    calls = sum(c.calls for c in clients.values())
+    print(f"{name:<22} accounts={n:<7} cpu={cpu / duration * 100:5.1f}%   "
+          f"loop iterations/s={counter.count / duration:8.0f}   updateStatus/s={calls / duration:8.0f}")
+
+
+async def engine_run(n, interval, duration):
+    live = {}
+    engine = GhostEngine(FakeDB(), live.get, interval=interval)
+    engine.start()
+
+    async def attach(uid, client):
+        live[uid] = client
+        await engine.attach(uid, client)
+
+    await measure("engine (one timer)", n, interval, duration, attach, engine.stop)
+    print(f"{'':<22} {engine.stats()}")
+
+
+async def tasks_run(n, interval, duration):
+    tasks = []
+
+    async def per_account(client):
+        while True:
+            await client.invoke(None)
+            await asyncio.sleep(interval)
+
+    async def attach(uid, client):
+        tasks.append(asyncio.create_task(per_account(client)))
+
+    async def teardown():
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    await measure("task per account", n, interval, duration, attach, teardown)
+
+
+async def main():
+    counts = [int(x) for x in (sys.argv[1] if len(sys.argv) > 1 else "1000,10000").split(",")]
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+    for n in counts:
+        await tasks_run(n, interval, duration)
+        await engine_run(n, interval, duration)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
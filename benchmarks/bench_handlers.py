@@ -0,0 +1,143 @@
+"""Офлайн-бенчмарк обработчиков: dp.feed_update с подменёнными Bot API и Pyrogram.
+
+    python benchmarks/bench_handlers.py [сценарий ...] [--users 1,100,10000] [--rpc-ms 0]
+
+Сценарии: send (handle_all), auth (полный FSM авторизации), clear (clear_process),
+broadcast (две рассылки на одних и тех же 100 получателей), dialogs (индекс
+«📢 Каналы» на --dialogs чатов и листание).
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from common import percentile
+
+# Окружение задаётся до импорта main: конфигурация читается при импорте
+os.environ["WORK_DIR"] = tempfile.mkdtemp(prefix="bench-bot-")
+os.environ.setdefault("BOT_TOKEN", "123456:OFFLINE-BENCHMARK")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("MAX_LIVE_CLIENTS", "1000000")
+os.environ.setdefault("AUTH_PENDING_MAX", "1000000")
+os.environ.setdefault("JOB_CONCURRENCY", "1000000")
+os.environ.setdefault("ACCOUNT_RATE", "1000000")
+os.environ.setdefault("ACCOUNT_BURST", "1000000")
+
+import fakes  # noqa: E402
+import main  # noqa: E402
+
+main.user_clients.client_class = fakes.FakeClient
+
+
+async def send_flow(bot, uid):
+    return [
+        fakes.message_update(bot, uid, "✉️ Сообщение"),
+        fakes.message_update(bot, uid, "@bench_target"),
+        fakes.message_update(bot, uid, "hello from benchmark"),
+    ]
+
+
+async def auth_flow(bot, uid):
+    return [
+        fakes.callback_update(bot, uid, "start_auth"),
+        fakes.message_update(bot, uid, "12345678 0123456789abcdef0123456789abcdef"),
+        fakes.message_update(bot, uid, "+70000000000"),
+        fakes.message_update(bot, uid, "12345"),
+    ]
+
+
+async def clear_flow(bot, uid):
+    return [
+        fakes.message_update(bot, uid, "🧹 Очистка"),
+        fakes.callback_update(bot, uid, "clear_recent"),
+        fakes.message_update(bot, uid, "@bench_target"),
+    ]
+
+
+async def broadcast_flow(bot, uid):
+    # Дважды одним и тем же получателям: второй проход не должен делать resolve
+    targets = " ".join(f"@bench_{i}" for i in range(100))
+    return [
+        fakes.message_update(bot, uid, text)
+        for _ in range(2)
+        for text in ("✉️ Сообщение", targets, "hello from benchmark")
+    ]
+
+
+async def dialogs_flow(bot, uid):
+    # Первое открытие строит индекс, дальше страницы читаются из SQLite
+    return [
+        fakes.message_update(bot, uid, "📢 Каналы"),
+        fakes.callback_update(bot, uid, "dlg:all"),
+        fakes.callback_update(bot, uid, "dlg:group"),
+        fakes.callback_update(bot, uid, "dlg:private"),
+        fakes.message_update(bot, uid, "📢 Каналы"),
+    ]
+
+
+SCENARIOS = {"send": send_flow, "auth": auth_flow, "clear": clear_flow, "broadcast": broadcast_flow,
+             "dialogs": dialogs_flow}
+# Сценариям с уже авторизованным аккаунтом клиент выдаётся заранее
+NEEDS_CLIENT = {"send", "clear", "broadcast", "dialogs"}
+
+
+async def run(scenario, users, base_uid):
+    bot = fakes.make_bot()
+    uids = range(base_uid, base_uid + users)
+    if scenario in NEEDS_CLIENT:
+        for uid in uids:
+            client = fakes.FakeClient(name=f"session_{uid}")
+            client.is_connected = True
+            await main.user_clients.set(uid, client)
+    flows = [await SCENARIOS[scenario](bot, uid) for uid in uids]
+    resolves = main.peer_cache.resolves
+    latencies = []
+
+    async def drive(updates):
+        for update in updates:
+            t0 = time.perf_counter()
+            await main.dp.feed_update(bot, update)
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(drive(updates) for updates in flows))
+    # Очистка, рассылка и сбор диалогов идут фоновыми задачами после ответа обработчика
+    await main.jobs.join()
+    elapsed = time.perf_counter() - t0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    count = len(latencies)
+    print(f"{scenario:<6} users={users:<6} {count / elapsed:>9.0f} upd/s   "
+          f"p50={percentile(latencies, 50) * 1000:.2f}ms   p99={percentile(latencies, 99) * 1000:.2f}ms   "
+          f"peak RSS={rss:.0f}MB   bot API calls={bot.session.calls}   "
+          f"resolves={main.peer_cache.resolves - resolves}")
+    await main.user_clients.close()
+
+
+async def amain(args):
+    fakes.FakeClient.latency = args.rpc_ms / 1000
+    fakes.FakeClient.dialogs = args.dialogs
+    main.init_db()
+    main.fsm_storage.start()
+    base_uid = 10 ** 6
+    for scenario in args.scenarios or list(SCENARIOS):
+        for users in args.users:
+            await run(scenario, users, base_uid)
+            base_uid += users
+    await main.limiter.close()
+    await main.fsm_storage.close()
+    if "-v" in sys.argv:
+        print(main.metrics.render_text())
+    main.db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scenarios", nargs="*", choices=[[]] + list(SCENARIOS), default=[])
+    parser.add_argument("--users", type=lambda s: [int(x) for x in s.split(",")], default=[1, 100, 10000])
+    parser.add_argument("--rpc-ms", type=float, default=0.0, help="задержка каждого RPC фейкового клиента")
+    parser.add_argument("--dialogs", type=int, default=1000, help="диалогов у фейкового аккаунта")
+    parser.add_argument("-v", action="store_true", help="вывести гистограммы обработчиков")
+    asyncio.run(amain(parser.parse_args()))
@@ -0,0 +1,142 @@
+"""Тяжёлые задачи в очереди против выполнения прямо в обработчике.
+
+Одни пользователи запускают полную очистку длинной истории, другие в это
+время пишут сообщения. Апдейты проходят через max_concurrency слотов, как
+в WebhookServer. Замеряются задержка интерактивных апдейтов, число
+одновременных очисток и время от /cancel до остановки задачи.
+
+    python benchmarks/bench_jobs.py [очисток] [интерактивных пользователей] [--rpc-ms 20]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+from common import percentile
+
+# Окружение задаётся до импорта main: конфигурация читается при импорте
+os.environ["WORK_DIR"] = tempfile.mkdtemp(prefix="bench-jobs-")
+os.environ.setdefault("BOT_TOKEN", "123456:OFFLINE-BENCHMARK")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ.setdefault("MAX_LIVE_CLIENTS", "1000000")
+os.environ.setdefault("ACCOUNT_RATE", "1000000")
+os.environ.setdefault("ACCOUNT_BURST", "1000000")
+
+import fakes  # noqa: E402
+import main  # noqa: E402
+
+HISTORY = 3000  # своих сообщений в очищаемом чате: 30 страниц поиска и удаления
+
+
+class HistoryClient(fakes.FakeClient):
+    """messages.Search отдаёт свои сообщения страницами по 100, от новых к старым."""
+
+    async def invoke(self, query):
+        await self._rpc()
+        offset = getattr(query, "offset_id", 0) or HISTORY + 1
+        ids = list(range(offset - 1, max(0, offset - 1 - getattr(query, "limit", 100)), -1))
+        return SimpleNamespace(messages=[SimpleNamespace(id=i) for i in ids])
+
+
+async def inline_job(message, name, job, *args, user_id=None):
+    # Как до очереди: задача выполняется прямо в обработчике апдейта
+    await job(message, await main.user_clients.get(user_id or message.from_user.id), *args)
+
+
+async def run(mode, heavy, interactive, slots_count):
+    bot = fakes.make_bot()
+    base = 10 ** 6 if mode == "inline" else 2 * 10 ** 6
+    heavy_ids = range(base, base + heavy)
+    light_ids = range(base + heavy, base + heavy + interactive)
+    for uid in (*heavy_ids, *light_ids):
+        client = HistoryClient(name=f"session_{uid}")
+        client.is_connected = True
+        await main.user_clients.set(uid, client)
+    main.start_job = inline_job if mode == "inline" else original_start_job
+
+    running = peak = 0
+    clear = main.clear_full_history
+
+    async def counted(*args):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        try:
+            return await clear(*args)
+        finally:
+            running -= 1
+
+    main.clear_full_history = counted
+    slots = asyncio.Semaphore(slots_count)
+    latencies = []
+
+    async def feed(update, record=False):
+        t0 = time.perf_counter()
+        async with slots:
+            await main.dp.feed_update(bot, update)
+        if record:
+            latencies.append(time.perf_counter() - t0)
+
+    async def heavy_user(uid):
+        for text in ("🧹 Очистка", "clear_all", "@bench_chat"):
+            update = (fakes.callback_update(bot, uid, text) if text == "clear_all"
+                      else fakes.message_update(bot, uid, text))
+            await feed(update)
+
+    async def light_user(uid):
+        await asyncio.sleep(0.2)  # очистки уже идут
+        for _ in range(5):
+            for text in ("✉️ Сообщение", "@bench_target", "hello"):
+                await feed(fakes.message_update(bot, uid, text), record=True)
+
+    t0 = time.perf_counter()
+    heavy_tasks = [asyncio.create_task(heavy_user(uid)) for uid in heavy_ids]
+    await asyncio.gather(*(light_user(uid) for uid in light_ids))
+    light_done = time.perf_counter() - t0
+
+    cancel_latency = None
+    if mode == "queue":
+        # Отмена трёх ещё идущих или ждущих очисток
+        cancel_latency = []
+        for uid in list(heavy_ids)[-3:]:
+            t1 = time.perf_counter()
+            await feed(fakes.message_update(bot, uid, "/cancel"))
+            cancel_latency.append(time.perf_counter() - t1)
+    await asyncio.gather(*heavy_tasks)
+    await main.jobs.join()
+    elapsed = time.perf_counter() - t0
+    main.clear_full_history = clear
+
+    print(f"{mode:<7} интерактивные: p50={percentile(latencies, 50) * 1000:7.1f}ms  "
+          f"p99={percentile(latencies, 99) * 1000:7.1f}ms  (готовы за {light_done:.1f} с)   "
+          f"очисток одновременно: {peak:>3}   все очистки: {elapsed:.1f} с"
+          + (f"   /cancel: {max(cancel_latency) * 1000:.1f}ms" if cancel_latency else ""))
+    await main.user_clients.close()
+
+
+original_start_job = main.start_job
+
+
+async def amain(args):
+    fakes.FakeClient.latency = args.rpc_ms / 1000
+    main.init_db()
+    main.fsm_storage.start()
+    print(f"{args.heavy} очисток по {HISTORY} сообщений, {args.interactive} интерактивных пользователей, "
+          f"{args.slots} слотов апдейтов, JOB_CONCURRENCY={main.JOB_CONCURRENCY}, RPC {args.rpc_ms:.0f} мс")
+    for mode in ("inline", "queue"):
+        await run(mode, args.heavy, args.interactive, args.slots)
+    print(f"задачи: {main.jobs.stats()}")
+    await main.limiter.close()
+    await main.fsm_storage.close()
+    main.db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("heavy", nargs="?", type=int, default=150)
+    parser.add_argument("interactive", nargs="?", type=int, default=50)
+    parser.add_argument("--slots", type=int, default=100, help="одновременно обрабатываемых апдейтов (WEBHOOK_CONCURRENCY)")
+    parser.add_argument("--rpc-ms", type=float, default=20.0, help="задержка каждого RPC фейкового клиента")
+    asyncio.run(amain(parser.parse_args()))
@@ -0,0 +1,76 @@
+"""Время потока event loop на логирование одной попытки авторизации.
+
+    python benchmarks/bench_logging.py [attempts]
+"""
+import logging
+import os
+import sys
+import time
+
+import common  # noqa: F401  (путь к модулям бота)
+
+import logging_setup
+
+
+class SentCode:
+    def __init__(self):
+        self.type = "APP"
+        self.phone_code_hash = "7f3c9a1b2d4e5f60718293a4b5c6d7e8"
+        self.next_type = "SMS"
+        self.timeout = 60
+
+
+def old_trace(logger, phone, sent_code):
+    # Прежний вариант из process_phone/process_code: f-строки на INFO
+    logger.info(f"[{phone}] Подключение к Telegram...")
+    logger.info(f"[{phone}] ✅ Подключено. Отправляю код...")
+    logger.info(f"[{phone}] Вызов send_code()...")
+    logger.info(f"[{phone}] ✅ send_code() успешен!")
+    logger.info(f"[{phone}] sent_code тип: {type(sent_code).__name__}")
+    logger.info(f"[{phone}] sent_code атрибуты: {dir(sent_code)}")
+    logger.info(f"[{phone}] sent_code.__dict__: {sent_code.__dict__}")
+    h = sent_code.phone_code_hash
+    logger.info(f"[{phone}] 📦 Hash тип: {type(h).__name__}")
+    logger.info(f"[{phone}] 📦 Hash значение: {h}")
+    logger.info(f"[{phone}] 📦 Hash len: {len(h)}")
+    logger.info(f"[{phone}] 📦 Hash repr: {repr(h)}")
+    logger.info(f"[{phone}] 📦 Hash is string - декодируем...")
+    logger.info(f"[{phone}] 📦 Decoded bytes len: {len(bytes.fromhex(h))}")
+    logger.info(f"[{phone}] Тип кода: {sent_code.type}")
+    logger.info(f"[1] Сохранены данные: phone={phone}, hash_len={len(h)}")
+
+
+def new_trace(logger, user_id, sent_code):
+    logger.info("[%s] Подключение к Telegram...", user_id)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[%s] send_code(): %s %s", user_id, type(sent_code).__name__,
+                     {k: v for k, v in sent_code.__dict__.items() if k != 'phone_code_hash'})
+    logger.debug("[%s] phone_code_hash=%s (len=%s)", user_id,
+                 logging_setup.mask(sent_code.phone_code_hash), len(sent_code.phone_code_hash))
+    logger.info("[%s] ✅ Код отправлен, тип: %s", user_id, sent_code.type)
+
+
+def measure(name, fn, logger, attempts):
+    sent_code = SentCode()
+    t0 = time.thread_time()
+    for i in range(attempts):
+        fn(logger, i, sent_code)
+    spent = time.thread_time() - t0
+    print(f"{name:<45} {spent / attempts * 1e6:>8.1f} µs CPU в потоке loop на попытку")
+
+
+def main():
+    attempts = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    devnull = open(os.devnull, "w")
+
+    logging.basicConfig(level=logging.INFO, format=logging_setup.LOG_FORMAT, stream=devnull, force=True)
+    measure("basicConfig + f-строки (было)", old_trace, logging.getLogger("old"), attempts)
+
+    listener = logging_setup.setup_logging(logging.INFO)
+    listener.handlers[0].setStream(devnull)
+    measure("QueueHandler + %-формат, INFO (стало)", new_trace, logging.getLogger("new"), attempts)
+    listener.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Накладные расходы метрик на один вызов.
+
+    python benchmarks/bench_metrics.py [calls]
+"""
+import asyncio
+import sys
+import time
+
+import common  # noqa: F401  (путь к модулям бота)
+
+from metrics import HandlerTimingMiddleware, Metrics
+
+
+class _Handler:
+    async def callback(self):
+        pass
+
+
+async def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    metrics = Metrics()
+
+    t0 = time.perf_counter()
+    for i in range(calls):
+        metrics.observe("db", "fetchone", (i % 100) / 10000)
+    print(f"Metrics.observe: {(time.perf_counter() - t0) / calls * 1e9:.0f} ns/вызов")
+
+    async def handler(event, data):
+        return None
+
+    middleware = HandlerTimingMiddleware(metrics)
+    data = {"handler": _Handler()}
+    t0 = time.perf_counter()
+    for _ in range(calls):
+        await handler(None, data)
+    bare = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(calls):
+        await middleware(handler, None, data)
+    timed = time.perf_counter() - t0
+    print(f"HandlerTimingMiddleware: +{(timed - bare) / calls * 1e9:.0f} ns/апдейт")
+    print(metrics.render_text())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""Заметки: поиск FTS5 и листание страниц на 100k заметок одного пользователя.
+
+    python benchmarks/bench_notes.py [notes_per_user] [users]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from common import report
+
+from db import Database
+
+WORDS = ("купить молоко встреча звонок отчёт идея проект книга фильм рецепт "
+         "пароль адрес подарок поездка врач оплата ремонт список задача план").split()
+QUERIES = ("молоко", "встреча отчёт", "рец", "проект план задача", "несуществующее")
+
+
+def note_text(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+
+
+async def timed(n, fn):
+    latencies = []
+    t0 = time.perf_counter()
+    for i in range(n):
+        s = time.perf_counter()
+        await fn(i)
+        latencies.append(time.perf_counter() - s)
+    return time.perf_counter() - t0, latencies
+
+
+async def main():
+    per_user = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    rng = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bot_data.db"))
+        db.open()
+        t0 = time.perf_counter()
+        # Заметки пользователей вперемешку, как при реальной работе
+        rows = [(uid, note_text(rng)) for _ in range(per_user) for uid in range(1, users + 1)]
+        await db.executemany("INSERT INTO notes (user_id, text) VALUES (?, ?)", rows)
+        print(f"insert {len(rows)} notes (with FTS triggers): {time.perf_counter() - t0:.2f}s")
+        uid = 1
+
+        elapsed, lat = await timed(2000, lambda i: db.list_notes(uid, limit=9))
+        report("first page", 2000, elapsed, lat)
+
+        # Глубокие страницы: по ключу против OFFSET на той же выборке
+        ids = [r[0] for r in await db.fetchall("SELECT id FROM notes WHERE user_id = ? ORDER BY id DESC", (uid,))]
+        depths = [rng.randrange(len(ids)) for _ in range(500)]
+        elapsed, lat = await timed(500, lambda i: db.list_notes(uid, before=ids[depths[i]], limit=9))
+        report("deep page (keyset)", 500, elapsed, lat)
+        elapsed, lat = await timed(500, lambda i: db.fetchall(
+            "SELECT id, text FROM notes WHERE user_id = ? ORDER BY id DESC LIMIT 9 OFFSET ?", (uid, depths[i])))
+        report("deep page (OFFSET)", 500, elapsed, lat)
+
+        for query in QUERIES:
+            elapsed, lat = await timed(200, lambda i: db.search_notes(uid, query, limit=9))
+            report(f"search {query!r}", 200, elapsed, lat)
+            elapsed, lat = await timed(200, lambda i: db.search_notes(uid, query, limit=9, prefix=True))
+            report(f"search {query!r} (prefix)", 200, elapsed, lat)
+        # Следующие страницы поиска тоже по ключу
+        page = await db.search_notes(uid, "молоко", limit=9)
+        async def next_page(i):
+            nonlocal page
+            page = await db.search_notes(uid, "молоко", before=page[-1][0], limit=9) or page
+        elapsed, lat = await timed(200, next_page)
+        report("search 'молоко' next pages", 200, elapsed, lat)
+        db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
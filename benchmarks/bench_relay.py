@@ -0,0 +1,76 @@
+"""Пересылка файлов: поток из Bot API сразу в загрузку Pyrogram, без файла и буфера.
+
+Источник — фейковый поток кусков по 64 КБ, медиасессия — фейковая с
+задержкой на каждую часть. Печатает пропускную способность и пик памяти
+Python (tracemalloc) для файлов разного размера.
+
+    python benchmarks/bench_relay.py [размеры в МБ через запятую] [мс на часть]
+"""
+import asyncio
+import itertools
+import sys
+import time
+import tracemalloc
+
+import common  # noqa: F401  (путь к модулям бота)
+
+from relay import PART_SIZE, format_throughput, upload
+
+CHUNK = 65536
+
+
+class FakeSession:
+    def __init__(self, latency):
+        self.latency = latency
+        self.parts = 0
+        self.received = 0
+
+    async def invoke(self, rpc):
+        await asyncio.sleep(self.latency)
+        assert len(rpc.bytes) == PART_SIZE or rpc.file_part == self.last_part
+        self.parts += 1
+        self.received += len(rpc.bytes)
+
+
+class FakeClient:
+    _ids = itertools.count(1)
+
+    def rnd_id(self):
+        return next(self._ids)
+
+
+async def stream(size):
+    # Куски неровные, как у aiohttp iter_chunked на медленной сети
+    chunk = bytes(CHUNK)
+    sent = 0
+    while sent < size:
+        n = min(size - sent, CHUNK - (sent // CHUNK) % 7 * 1000)
+        yield chunk[:n]
+        sent += n
+        await asyncio.sleep(0)
+
+
+async def run(size_mb, latency):
+    size = size_mb * 1024 * 1024 + 12345
+    session = FakeSession(latency)
+    session.last_part = (size - 1) // PART_SIZE
+    tracemalloc.start()
+    started = time.perf_counter()
+    await upload(FakeClient(), stream(size), size, "file.bin", session=session)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert session.received == size, (session.received, size)
+    print(f"{size_mb:>6} MB   {format_throughput(size, elapsed):<32} parts={session.parts:<6} "
+          f"peak memory={peak / 1024 / 1024:.1f} MB")
+
+
+async def main():
+    sizes = [int(x) for x in (sys.argv[1] if len(sys.argv) > 1 else "5,50,500").split(",")]
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.005
+    for size in sizes:
+        await run(size, latency)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+"""Диспетчер отложенных сообщений на десятках тысяч строк.
+
+    python benchmarks/bench_scheduler.py [rows] [deadlines]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from common import percentile
+
+from db import Database
+from scheduler import MessageScheduler
+
+
+class FakeClient:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((text, time.time()))
+
+
+async def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    deadlines = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bot_data.db"))
+        db.open()
+        client = FakeClient()
+        start = time.time() + 2
+        # Общие дедлайны в пределах трёх секунд + столько же строк на далёкое будущее
+        due = [(i % 100, str(i), f"msg {i}", start + (i % deadlines) * 3 / deadlines) for i in range(rows)]
+        far = [(i % 100, str(i), f"later {i}", start + 86400 + i) for i in range(rows)]
+        await db.executemany(
+            "INSERT INTO scheduled_messages (user_id, chat_id, text, send_at, status) VALUES (?, ?, ?, ?, 0)",
+            due + far)
+
+        sched = MessageScheduler(db, lambda uid: client)
+        t0, c0 = time.perf_counter(), time.process_time()
+        await sched.start()
+        print(f"load {len(sched)} rows: {time.perf_counter() - t0:.3f}s")
+
+        # Простой до первого дедлайна: CPU не должен зависеть от числа строк
+        c_idle = time.process_time()
+        await asyncio.sleep(max(0, start - time.time() - 0.2))
+        print(f"idle cpu: {time.process_time() - c_idle:.4f}s, wakeups: {sched.wakeups}")
+
+        while sched.sent < rows:
+            await asyncio.sleep(0.05)
+        await sched.stop()
+        lateness = [sent_at - (start + (int(text.split()[1]) % deadlines) * 3 / deadlines)
+                    for text, sent_at in client.sent]
+        print(f"sent {sched.sent} in {sched.batches} batches, wakeups {sched.wakeups}, "
+              f"cpu {time.process_time() - c0:.3f}s")
+        print(f"lateness p50={percentile(lateness, 50) * 1000:.1f}ms p99={percentile(lateness, 99) * 1000:.1f}ms")
+
+        # Перезапуск: новый диспетчер не должен повторно отправить уже ушедшие строки
+        client.sent.clear()
+        sched = MessageScheduler(db, lambda uid: client)
+        await sched.start()
+        await asyncio.sleep(0.2)
+        await sched.stop()
+        print(f"after restart: pending {len(sched)}, resent {len(client.sent)}")
+        db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,151 @@
+"""Схема bot_data.db до и после миграций на 1M строк.
+
+«До» — таблицы notes и scheduled_messages без индексов, как их создавали
+одни CREATE TABLE; «после» — та же база после Database.open(): миграции,
+индексы, инкрементальная очистка. Замеряются запросы по пользователю и по
+сроку, очистка завершённых отложенных и размер файла.
+
+    python benchmarks/bench_schema.py [строк] [пользователей]
+"""
+import asyncio
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from common import percentile
+
+import db as dbmod
+from db import Database
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+USERS = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+REPEAT = 50
+LEGACY = (
+    'CREATE TABLE notes (id INTEGER PRIMARY KEY, user_id INTEGER, text TEXT)',
+    'CREATE TABLE scheduled_messages (id INTEGER PRIMARY KEY, user_id INTEGER, chat_id TEXT, text TEXT, '
+    'send_at DATETIME, status INTEGER DEFAULT 0)',
+)
+
+
+def build(path, rows, users):
+    """Старая база: 10% отложенных ждут отправки, остальные завершены за последние 30 дней."""
+    rng = random.Random(1)
+    now = time.time()
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    for stmt in LEGACY:
+        conn.execute(stmt)
+    conn.executemany("INSERT INTO notes (user_id, text) VALUES (?, ?)",
+                     ((rng.randrange(users), f"заметка {i}") for i in range(rows)))
+    scheduled = []
+    for i in range(rows):
+        if i % 10 == 0:
+            scheduled.append((rng.randrange(users), "@chat", f"текст {i}", now + rng.uniform(60, 30 * 86400), 0))
+        else:
+            status = dbmod.SCHEDULED_SENT if i % 50 else dbmod.SCHEDULED_FAILED
+            scheduled.append((rng.randrange(users), "@chat", f"текст {i}", now - rng.uniform(0, 30 * 86400), status))
+    conn.executemany("INSERT INTO scheduled_messages (user_id, chat_id, text, send_at, status) VALUES (?, ?, ?, ?, ?)",
+                     scheduled)
+    conn.commit()
+    conn.close()
+
+
+QUERIES = (
+    ("заметки: страница пользователя", dbmod.SQL_NOTES_BEFORE, lambda rng: (rng.randrange(USERS), dbmod.MAX_ID, 10)),
+    ("отложенные: ближайшие 1000", dbmod.SQL_LOAD_SCHEDULED, lambda rng: (1000,)),
+    ("отложенные: восстановление", dbmod.SQL_RECOVER_SCHEDULED, lambda rng: ()),
+)
+
+
+def measure(conn):
+    rng = random.Random(2)
+    result = {}
+    for name, sql, params in QUERIES:
+        latencies = []
+        for _ in range(REPEAT):
+            t0 = time.perf_counter()
+            conn.execute(sql, params(rng)).fetchall()
+            latencies.append(time.perf_counter() - t0)
+        conn.commit()
+        result[name] = latencies
+    return result
+
+
+def legacy_purge(conn, before, batch=5000):
+    total = 0
+    while True:
+        with conn:
+            deleted = conn.execute(dbmod.SQL_PURGE_SCHEDULED, (before, batch)).rowcount
+        total += deleted
+        if deleted < batch:
+            return total
+
+
+def size_mb(path):
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p)) / 1024 / 1024
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        before_path = os.path.join(tmp, "before.db")
+        after_path = os.path.join(tmp, "bot_data.db")
+        t0 = time.perf_counter()
+        build(before_path, ROWS, USERS)
+        shutil.copy(before_path, after_path)
+        print(f"{ROWS} заметок и {ROWS} отложенных, {USERS} пользователей: {time.perf_counter() - t0:.1f} с на создание")
+
+        # Обычная ежечасная очистка находит строки, устаревшие за последний час;
+        # первая после включения — весь накопленный хвост старше недели
+        hourly = time.time() - 30 * 86400 + 3600
+        cutoff = time.time() - 7 * 86400
+        conn = sqlite3.connect(before_path)
+        before = measure(conn)
+        sizes = [size_mb(before_path)]
+        t0 = time.perf_counter()
+        hourly_purged = legacy_purge(conn, hourly)
+        before_hourly = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        purged = legacy_purge(conn, cutoff)
+        before_purge = time.perf_counter() - t0
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+        sizes.append(size_mb(before_path))
+
+        db = Database(after_path)
+        t0 = time.perf_counter()
+        db.open()
+        print(f"миграции до версии {dbmod.SCHEMA_VERSION}: {time.perf_counter() - t0:.1f} с (FTS заметок, индексы, VACUUM)")
+        after = measure(db._conn)
+        db._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        size = size_mb(after_path)
+        t0 = time.perf_counter()
+        await db.purge_scheduled(hourly)
+        after_hourly = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        await db.purge_scheduled(cutoff)
+        after_purge = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        pages = await db.reclaim()
+        reclaim = time.perf_counter() - t0
+        db._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        print()
+        print(f"{'запрос':<34} {'до p50':>10} {'до p99':>10} {'после p50':>10} {'после p99':>10}")
+        for name in before:
+            b, a = before[name], after[name]
+            print(f"{name:<34} {percentile(b, 50) * 1000:>8.2f}ms {percentile(b, 99) * 1000:>8.2f}ms "
+                  f"{percentile(a, 50) * 1000:>8.3f}ms {percentile(a, 99) * 1000:>8.3f}ms")
+        print(f"{'очистка за час: ' + str(hourly_purged) + ' строк':<34} {before_hourly * 1000:>8.1f}ms {'':>10} "
+              f"{after_hourly * 1000:>8.1f}ms")
+        print(f"{'первая очистка: ' + str(purged) + ' строк':<34} {before_purge:>9.2f}с {'':>10} {after_purge:>9.2f}с")
+        print(f"\nфайл до очистки и после: до миграций {sizes[0]:.0f} -> {sizes[1]:.0f} МБ (место не возвращается), "
+              f"после {size:.0f} -> {size_mb(after_path):.0f} МБ ({pages} страниц за {reclaim:.2f} с; "
+              f"включает FTS заметок)")
+        db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
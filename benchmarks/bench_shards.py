@@ -0,0 +1,99 @@
+"""Шардирование: фронт раздаёт апдейты N процессам с фейковыми Bot API и Pyrogram.
+
+Каждый пользователь проходит «✉️ Сообщение → получатель → текст» (как send
+в bench_handlers); апдейты идут раундами, чтобы состояния FSM одного
+пользователя не обгоняли друг друга. Шарды — этот же скрипт с переменной
+SHARD, все пишут в один bot_data.db.
+
+    python benchmarks/bench_shards.py [шардов через запятую] [пользователей] [--rpc-ms 0]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import common  # noqa: F401  (путь к модулям бота)
+
+os.environ.setdefault("WORK_DIR", tempfile.mkdtemp(prefix="bench-shards-"))
+os.environ.setdefault("BOT_TOKEN", "123456:OFFLINE-BENCHMARK")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("MAX_LIVE_CLIENTS", "1000000")
+os.environ.setdefault("ACCOUNT_RATE", "1000000")
+os.environ.setdefault("ACCOUNT_BURST", "1000000")
+
+from aiogram.types import User  # noqa: E402
+
+import fakes  # noqa: E402
+from shards import ShardRouter  # noqa: E402
+
+FLOW = ("✉️ Сообщение", "@bench_target", "hello from benchmark")
+
+
+async def worker():
+    import main
+    main.user_clients.client_class = fakes.FakeClient
+    fakes.FakeClient.latency = float(os.getenv("BENCH_RPC_MS", "0")) / 1000
+
+    async def rehydrate(user_id):
+        client = fakes.FakeClient(name=f"session_{user_id}")
+        client.is_connected = True
+        return client
+
+    main.user_clients._rehydrate = rehydrate
+    main.init_db()
+    main.fsm_storage.start()
+    await main.shard.serve(main.dp, fakes.make_bot())
+    await main.user_clients.close()
+    await main.limiter.close()
+    await main.fsm_storage.close()
+    main.db.close()
+    await main.shard.close([])
+
+
+async def front(shards, users):
+    bot = fakes.make_bot()
+    router = ShardRouter(shards, argv=[sys.executable, os.path.abspath(__file__)])
+    started = time.perf_counter()
+    await router.start()
+    # Первый апдейт каждому шарду — дождаться импорта main в процессах
+    await asyncio.gather(*(router(None, fakes.message_update(bot, uid, "/start"), {"event_from_user": _user(uid)})
+                           for uid in range(shards)))
+    await router.drain(120)
+    spawn = time.perf_counter() - started
+
+    uids = range(10 ** 6, 10 ** 6 + users)
+    t0 = time.perf_counter()
+    for text in FLOW:
+        for uid in uids:
+            await router(None, fakes.message_update(bot, uid, text), {"event_from_user": _user(uid)})
+        await router.drain(600)
+    elapsed = time.perf_counter() - t0
+    await router.stop()
+    count = users * len(FLOW)
+    print(f"shards={shards:<3} users={users:<6} {count / elapsed:>8.0f} upd/s   "
+          f"elapsed={elapsed:.2f}s   start={spawn:.1f}s   routed={[s['routed'] for s in router.stats()]}")
+
+
+def _user(uid):
+    return User(id=uid, is_bot=False, first_name="Bench")
+
+
+async def amain(args):
+    print(f"CPU cores: {os.cpu_count()}")
+    for shards in args.shards:
+        await front(shards, args.users)
+
+
+if __name__ == "__main__":
+    if os.getenv("SHARD"):
+        asyncio.run(worker())
+    else:
+        parser = argparse.ArgumentParser()
+        parser.add_argument("shards", nargs="?", type=lambda s: [int(x) for x in s.split(",")], default=[1, 2, 4])
+        parser.add_argument("users", nargs="?", type=int, default=2000)
+        parser.add_argument("--rpc-ms", type=float, default=0.0)
+        args = parser.parse_args()
+        os.environ["BENCH_RPC_MS"] = str(args.rpc_ms)
+        asyncio.run(amain(args))
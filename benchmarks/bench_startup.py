@@ -0,0 +1,81 @@
+"""Холодный старт: импорт main, схема БД и первый ответ в отдельном процессе.
+
+Каждый прогон — новый интерпретатор с пустым WORK_DIR. Первый ответ —
+/start через фейковый Bot API; отдельно замеряется отложенный импорт
+Pyrogram, который платит первая авторизация или действие с аккаунтом.
+
+    python benchmarks/bench_startup.py [прогонов]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import ROOT
+
+CHILD = r"""
+import time
+t0 = time.perf_counter()
+import asyncio, json, sys
+sys.path[:0] = [ROOT, ROOT + "/benchmarks"]
+import main
+t_import = time.perf_counter()
+pyrogram_at_import = "pyrogram" in sys.modules
+main.init_db()
+t_db = time.perf_counter()
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Message, Update
+
+class Session(BaseSession):
+    async def make_request(self, bot, method, timeout=None):
+        return Message.model_validate({"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}})
+    async def stream_content(self, *a, **k):
+        yield b""
+    async def close(self):
+        pass
+
+async def first_response():
+    bot = main.Bot(token="123456:OFFLINE-BENCHMARK", session=Session())
+    update = Update.model_validate({"update_id": 1, "message": {
+        "message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"},
+        "from": {"id": 1, "is_bot": False, "first_name": "Bench"}, "text": "/start"}}, context={"bot": bot})
+    await main.dp.feed_update(bot, update)
+    global t_first, t_pyrogram
+    t_first = time.perf_counter()
+    # Pyrogram импортируется внутри работающего loop, как при первой авторизации
+    import pyrogram  # noqa: F401
+    t_pyrogram = time.perf_counter()
+    await main.fsm_storage.close()
+
+asyncio.run(first_response())
+print(json.dumps({"import": t_import - t0, "init_db": t_db - t_import, "first_response": t_first - t0,
+                  "pyrogram": t_pyrogram - t_first, "pyrogram_at_import": pyrogram_at_import}))
+""".replace("ROOT", repr(ROOT))
+
+
+def run_once():
+    env = {**os.environ, "WORK_DIR": tempfile.mkdtemp(prefix="bench-startup-"), "LOG_LEVEL": "WARNING"}
+    started = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", CHILD], env=env, capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["process"] = time.perf_counter() - started
+    return result
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    results = [run_once() for _ in range(runs)]
+    for key, label in (("import", "import main"), ("init_db", "init_db() in main()"),
+                       ("first_response", "first response (/start)"), ("process", "process wall time"),
+                       ("pyrogram", "deferred pyrogram import")):
+        samples = [r[key] for r in results]
+        print(f"{label:<28} median={statistics.median(samples) * 1000:8.1f}ms   "
+              f"min={min(samples) * 1000:8.1f}ms   max={max(samples) * 1000:8.1f}ms")
+    print(f"pyrogram loaded by import main: {any(r['pyrogram_at_import'] for r in results)}")
+
+
+if __name__ == "__main__":
+    main()
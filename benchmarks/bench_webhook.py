@@ -0,0 +1,74 @@
+"""Нагрузочный тест локального webhook-эндпоинта синтетическими апдейтами.
+
+    python benchmarks/bench_webhook.py [updates] [clients] [handler_ms]
+"""
+import asyncio
+import sys
+import time
+
+from aiohttp import ClientSession
+from aiogram import Bot, Dispatcher, types
+
+from common import report
+
+from webhook import WebhookServer, SECRET_HEADER
+
+SECRET = "bench-secret"
+
+
+def make_update(i):
+    return {
+        "update_id": i,
+        "message": {
+            "message_id": i,
+            "date": int(time.time()),
+            "chat": {"id": 1000 + i % 100, "type": "private"},
+            "from": {"id": 1000 + i % 100, "is_bot": False, "first_name": "Bench"},
+            "text": f"hello {i}",
+        },
+    }
+
+
+async def main():
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    handler_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    bot = Bot(token="123456:BENCHMARK")
+    dp = Dispatcher()
+    handled = 0
+
+    @dp.message()
+    async def on_message(message: types.Message):
+        nonlocal handled
+        # Имитация ожидания сети внутри обработчика
+        await asyncio.sleep(handler_ms / 1000)
+        handled += 1
+
+    server = WebhookServer(dp, bot, path="/webhook", secret=SECRET, port=8765, max_concurrency=200)
+    await server.start()
+    url = f"http://127.0.0.1:{server.port}/webhook"
+    latencies = []
+    queue = iter(range(updates))
+
+    async def sender(session):
+        for i in queue:
+            t0 = time.perf_counter()
+            async with session.post(url, json=make_update(i), headers={SECRET_HEADER: SECRET}) as resp:
+                assert resp.status == 200, resp.status
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(sender(session) for _ in range(clients)))
+        async with session.post(url, json=make_update(0), headers={SECRET_HEADER: "wrong"}) as resp:
+            assert resp.status == 401
+    await server.stop()
+    elapsed = time.perf_counter() - t0
+    report(f"webhook ({clients} senders, {handler_ms:g}ms handler)", updates, elapsed, latencies)
+    print(f"handled {handled}/{updates}, rejected {server.rejected}")
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
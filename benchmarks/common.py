@@ -0,0 +1,32 @@
+import os
+import sys
+import time
+
+# Бенчмарки запускаются как скрипты: python benchmarks/bench_xxx.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def report(name, count, elapsed, latencies=None):
+    line = f"{name:<40} {count / elapsed if elapsed else 0:>12.0f} ops/s"
+    if latencies:
+        line += f"   p50={percentile(latencies, 50) * 1000:.3f}ms   p99={percentile(latencies, 99) * 1000:.3f}ms"
+    print(line)
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
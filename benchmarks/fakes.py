@@ -0,0 +1,219 @@
+"""Подмены Telegram для офлайн-бенчмарков: сессия Bot API и pyrogram.Client."""
+import asyncio
+import itertools
+import time
+from types import SimpleNamespace
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, Message, Update
+from pyrogram import enums, raw
+
+_ids = itertools.count(1)
+
+
+class FakeSession(BaseSession):
+    """Сессия Bot API без сети: send*-методы возвращают Message, остальные — True."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if type(method).__name__.startswith("Send"):
+            chat_id = getattr(method, "chat_id", 0)
+            return Message(
+                message_id=next(_ids),
+                date=int(time.time()),
+                chat=Chat(id=chat_id if isinstance(chat_id, int) else 0, type="private"),
+                text=getattr(method, "text", None),
+            ).as_(bot)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def make_bot(latency: float = 0.0) -> Bot:
+    return Bot(token="123456:OFFLINE-BENCHMARK", session=FakeSession(latency))
+
+
+class FakeStorage:
+    """Хранилище peers сессии Pyrogram в памяти."""
+
+    def __init__(self):
+        self.peers = {}
+
+    async def get_peer_by_id(self, peer_id):
+        if peer_id not in self.peers:
+            raise KeyError(peer_id)
+        return self.peers[peer_id]
+
+    async def update_peers(self, peers):
+        for peer_id, access_hash, peer_type, username, phone in peers:
+            self.peers[peer_id] = raw.types.InputPeerUser(user_id=peer_id, access_hash=access_hash)
+
+
+class FakeClient:
+    """pyrogram.Client с настраиваемой задержкой каждого RPC."""
+
+    latency = 0.0
+    history_size = 100
+    dialogs = 100
+    _types = (enums.ChatType.PRIVATE, enums.ChatType.SUPERGROUP, enums.ChatType.CHANNEL)
+
+    def __init__(self, name=None, api_id=None, api_hash=None, phone_number=None, workdir=None, **kwargs):
+        self.name = name
+        self.is_connected = False
+        self.is_initialized = False
+        self.rpc_calls = 0
+        self.resolve_calls = 0
+        self.storage = FakeStorage()
+        self._me = SimpleNamespace(id=abs(hash(name)) % 10 ** 9, first_name="Bench", last_name=None)
+
+    async def _rpc(self):
+        self.rpc_calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def connect(self):
+        await self._rpc()
+        self.is_connected = True
+        return False
+
+    async def initialize(self):
+        self.is_initialized = True
+
+    def add_handler(self, handler, group=0):
+        pass
+
+    async def invoke(self, query):
+        await self._rpc()
+        if isinstance(query, raw.functions.messages.GetDialogs):
+            return self._dialogs_page(query)
+        return True
+
+    def _dialogs_page(self, query):
+        """messages.getDialogs: диалог i — личный, группа или канал, верхнее сообщение с id dialogs - i."""
+        now = int(time.time())
+        start = self.dialogs - query.offset_id + 1 if query.offset_id else 0
+        dialogs, messages, chats, users = [], [], [], []
+        for i in range(start, min(start + query.limit, self.dialogs)):
+            kind = self._types[i % 3]
+            username = f"dialog_{i}" if i % 2 else None
+            if kind == enums.ChatType.PRIVATE:
+                peer = raw.types.PeerUser(user_id=i + 1)
+                users.append(raw.types.User(id=i + 1, access_hash=(i + 1) * 7, first_name=f"User {i}", username=username,
+                                            restriction_reason=[]))
+                self.storage.peers[i + 1] = raw.types.InputPeerUser(user_id=i + 1, access_hash=(i + 1) * 7)
+            else:
+                peer = raw.types.PeerChannel(channel_id=i + 1)
+                chats.append(raw.types.Channel(id=i + 1, title=f"Chat {i}", photo=raw.types.ChatPhotoEmpty(), date=0,
+                                               access_hash=(i + 1) * 7, username=username,
+                                               megagroup=kind == enums.ChatType.SUPERGROUP,
+                                               broadcast=kind == enums.ChatType.CHANNEL, restriction_reason=[]))
+                # Как Client.invoke: peers ответа складываются в хранилище сессии
+                self.storage.peers[-1000000000000 - (i + 1)] = raw.types.InputPeerChannel(
+                    channel_id=i + 1, access_hash=(i + 1) * 7)
+            messages.append(raw.types.Message(id=self.dialogs - i, peer_id=peer, date=now - i * 60, message=""))
+            dialogs.append(raw.types.Dialog(peer=peer, top_message=self.dialogs - i, read_inbox_max_id=0,
+                                            read_outbox_max_id=0, unread_count=0, unread_mentions_count=0,
+                                            unread_reactions_count=0, notify_settings=raw.types.PeerNotifySettings()))
+        if start == 0 and self.dialogs <= query.limit:
+            return raw.types.messages.Dialogs(dialogs=dialogs, messages=messages, chats=chats, users=users)
+        return raw.types.messages.DialogsSlice(count=self.dialogs, dialogs=dialogs, messages=messages,
+                                               chats=chats, users=users)
+
+    async def disconnect(self):
+        self.is_connected = False
+
+    async def stop(self):
+        self.is_initialized = False
+        self.is_connected = False
+
+    async def resolve_peer(self, peer_id):
+        # Username превращается в стабильный id, как после contacts.ResolveUsername
+        self.resolve_calls += 1
+        await self._rpc()
+        user_id = peer_id if isinstance(peer_id, int) else abs(hash(peer_id)) % 10 ** 9 + 1
+        return raw.types.InputPeerUser(user_id=user_id, access_hash=user_id * 7)
+
+    async def send_code(self, phone_number):
+        await self._rpc()
+        return SimpleNamespace(phone_code_hash="0123456789abcdef", type=SimpleNamespace(name="APP"))
+
+    async def resend_code(self, phone_number, phone_code_hash):
+        await self._rpc()
+        return SimpleNamespace(phone_code_hash="fedcba9876543210", type=SimpleNamespace(name="SMS"))
+
+    async def sign_in(self, phone_number, phone_code_hash, phone_code):
+        await self._rpc()
+        return self._me
+
+    async def get_me(self):
+        await self._rpc()
+        return self._me
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._rpc()
+        return SimpleNamespace(id=next(_ids), chat=chat_id, text=text)
+
+    async def send_sticker(self, chat_id, sticker, **kwargs):
+        await self._rpc()
+        return SimpleNamespace(id=next(_ids), chat=chat_id)
+
+    async def get_chat_history(self, chat_id, limit=0, **kwargs):
+        # Одна страница истории — один RPC, каждое второе сообщение своё
+        await self._rpc()
+        for i in range(min(limit or self.history_size, self.history_size)):
+            yield SimpleNamespace(id=i + 1, from_user=SimpleNamespace(is_self=i % 2 == 0))
+
+    async def delete_messages(self, chat_id, message_ids, **kwargs):
+        await self._rpc()
+        return len(message_ids)
+
+
+# --- Синтетические апдейты ---
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+
+def message_update(bot, user_id, text):
+    uid = next(_ids)
+    return Update.model_validate({
+        "update_id": uid,
+        "message": {
+            "message_id": uid,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": _user(user_id),
+            "text": text,
+        },
+    }, context={"bot": bot})
+
+
+def callback_update(bot, user_id, data):
+    uid = next(_ids)
+    return Update.model_validate({
+        "update_id": uid,
+        "callback_query": {
+            "id": str(uid),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": uid,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": 123456, "is_bot": True, "first_name": "Bot"},
+                "text": "menu",
+            },
+        },
+    }, context={"bot": bot})
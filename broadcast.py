@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import re
+from collections import deque
+
+from ratelimit import BULK
+from scheduler import normalize_chat
+
+logger = logging.getLogger(__name__)
+
+_SPLIT_RE = re.compile(r"[\s,;]+")
+
+
+def parse_targets(text):
+    """Получатели через пробел, запятую или с новой строки, без повторов.
+
+    '@Name', 'name' и 'NAME' — один получатель; порядок первого упоминания сохраняется.
+    """
+    targets, seen = [], set()
+    for token in _SPLIT_RE.split(text.strip()):
+        if not token:
+            continue
+        chat = normalize_chat(token)
+        key = chat if isinstance(chat, int) else chat.lstrip("@").lower()
+        if key in seen:
+            continue
+        seen.add(key)
+        targets.append(chat)
+    return targets
+
+
+async def broadcast(client, user_id, targets, text, limiter, concurrency: int = 10,
+                    max_slowmode: float = 60, on_progress=None, peers=None):
+    """Отправляет text каждому получателю; возвращает {получатель: None или текст ошибки}.
+
+    Одновременно обрабатывается не больше concurrency получателей. Вызовы
+    идут через очередь аккаунта с приоритетом BULK: FloodWait ставит на
+    паузу аккаунт и повторяется там же, а медленный режим (SlowmodeWait)
+    касается одного чата — его получатель ждёт и повторяет отправку, пока
+    остальные продолжают. on_progress(done, failed) вызывается после
+    каждого получателя. С peers (PeerCache) цели берутся из кэша без
+    resolve-запросов.
+    """
+    from pyrogram import errors
+
+    results = {}
+    pending = deque(targets)
+    failed = 0
+
+    async def send(target):
+        while True:
+            try:
+                chat = target if peers is None else await peers.resolve(client, user_id, target)
+                await limiter.call(user_id, client.send_message, chat, text, priority=BULK)
+                return None
+            except errors.SlowmodeWait as e:
+                if e.value > max_slowmode:
+                    return f"медленный режим, ждать {e.value} с"
+                await asyncio.sleep(e.value)
+            except Exception as e:
+                return f"{type(e).__name__}: {e}"
+
+    async def worker():
+        nonlocal failed
+        while pending:
+            target = pending.popleft()
+            error = await send(target)
+            results[target] = error
+            if error is not None:
+                failed += 1
+                logger.warning("[User %s] Рассылка: %s не доставлено: %s", user_id, target, error)
+            if on_progress is not None:
+                await on_progress(len(results), failed)
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(pending)))))
+    return {target: results[target] for target in targets}
+
+
+def format_report(results, elapsed, limit: int = 4000):
+    """Итог рассылки: сводка, затем ошибки и доставленные, в пределах limit символов."""
+    failed = [(t, e) for t, e in results.items() if e is not None]
+    header = f"📤 Рассылка завершена за {elapsed:.1f} с: доставлено {len(results) - len(failed)} из {len(results)}"
+    lines = [f"❌ {t}: {e}" for t, e in failed] + [f"✅ {t}" for t, e in results.items() if e is None]
+    text = header
+    for i, line in enumerate(lines):
+        if len(text) + len(line) + 40 > limit:
+            return text + f"\n… и ещё {len(lines) - i}"
+        text += "\n" + line
+    return text
+
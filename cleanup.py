@@ -0,0 +1,79 @@
+import asyncio
+import logging
+
+from ratelimit import BULK
+from scheduler import normalize_chat
+
+logger = logging.getLogger(__name__)
+
+
+async def _search_own(client, peer, offset_id, limit):
+    """Id собственных сообщений старше offset_id (0 — с самого нового)."""
+    from pyrogram import raw
+
+    r = await client.invoke(
+        raw.functions.messages.Search(
+            peer=peer,
+            q="",
+            filter=raw.types.InputMessagesFilterEmpty(),
+            min_date=0,
+            max_date=0,
+            offset_id=offset_id,
+            add_offset=0,
+            limit=limit,
+            min_id=0,
+            max_id=0,
+            from_id=raw.types.InputPeerSelf(),
+            hash=0
+        )
+    )
+    return [m.id for m in r.messages if not isinstance(m, raw.types.MessageEmpty)]
+
+
+async def recent_own(client, chat, limit: int = 100):
+    """Id своих сообщений среди последних limit сообщений чата; один вызов для лимитера."""
+    return [msg.id async for msg in client.get_chat_history(chat, limit=limit)
+            if msg.from_user and msg.from_user.is_self]
+
+
+async def clear_history(client, user_id, chat, db, limiter, on_progress=None, batch: int = 100):
+    """Удаляет все свои сообщения в чате, от новых к старым.
+
+    Поиск идёт на стороне сервера с фильтром «от меня», поэтому чужие
+    сообщения не загружаются. Следующая страница ищется, пока удаляется
+    предыдущая. После каждой удалённой пачки в cleanup_progress
+    сохраняется id последнего обработанного сообщения, и прерванная
+    очистка продолжается с него. Возвращает число удалённых сообщений.
+    """
+    chat = normalize_chat(chat)
+    key = str(chat)
+    checkpoint = await db.get_cleanup_progress(user_id, key)
+    offset_id, deleted = checkpoint if checkpoint else (0, 0)
+    if checkpoint:
+        logger.info("[User %s] Очистка %s: продолжение с id %s, уже удалено %s", user_id, key, offset_id, deleted)
+    peer = await limiter.call(user_id, client.resolve_peer, chat, priority=BULK)
+
+    async def delete(ids, last_id):
+        await limiter.call(user_id, client.delete_messages, chat, ids, priority=BULK)
+        return len(ids), last_id
+
+    pending = None
+    try:
+        while True:
+            ids = await limiter.call(user_id, _search_own, client, peer, offset_id, batch, priority=BULK)
+            if pending is not None:
+                count, last_id = await pending
+                pending = None
+                deleted += count
+                await db.save_cleanup_progress(user_id, key, last_id, deleted)
+                if on_progress:
+                    await on_progress(deleted)
+            if not ids:
+                break
+            offset_id = min(ids)
+            pending = asyncio.create_task(delete(ids, offset_id))
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+    await db.delete_cleanup_progress(user_id, key)
+    return deleted
@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class ClientManager:
+    """Живые Pyrogram-клиенты аккаунтов.
+
+    Клиент поднимается из session_<id>.session при первом обращении,
+    отключается после idle_timeout секунд простоя, а при превышении
+    max_clients вытесняется самый давно использованный. Клиент, взятый
+    через use() на время долгой операции, закреплён: он не отключается по
+    простою и не вытесняется, даже если get() долго не вызывается.
+    Pyrogram импортируется при создании первого клиента, а не при старте бота.
+    """
+
+    client_class = None  # pyrogram.Client; подменяется в офлайн-бенчмарках
+
+    def __init__(self, workdir, db, idle_timeout: float = 900, max_clients: int = 100):
+        self.workdir = workdir
+        self.db = db
+        self.idle_timeout = idle_timeout
+        self.max_clients = max_clients
+        self._clients = OrderedDict()  # user_id -> Client, от старых к свежим
+        self._last_used = {}
+        self._pinned = {}  # user_id -> число идущих операций через use()
+        self._loading = {}  # user_id -> задача подъёма сессии
+        self._reaper = None
+        # async (user_id, client): вызывается для каждого нового клиента в пуле
+        self.on_client = None
+        # Аккаунты с идущим входом: их файл сессии занят клиентом входа и ещё не авторизован
+        self.pending = ()
+        self.rehydrated = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __contains__(self, user_id):
+        return user_id in self._clients
+
+    def peek(self, user_id):
+        """Живой клиент без подъёма сессии и без продления простоя; None, если не подключен."""
+        return self._clients.get(user_id)
+
+    def create(self, user_id, api_id, api_hash, **kwargs):
+        """Новый клиент с файлом сессии session_<id> в workdir, ещё не подключенный."""
+        if self.client_class is None:
+            from pyrogram import Client
+            ClientManager.client_class = Client
+        return self.client_class(name=f"session_{user_id}", api_id=api_id, api_hash=api_hash,
+                                 workdir=self.workdir, **kwargs)
+
+    def session_path(self, user_id):
+        return os.path.join(self.workdir, f"session_{user_id}.session")
+
+    def _touch(self, user_id):
+        self._clients.move_to_end(user_id)
+        self._last_used[user_id] = time.monotonic()
+
+    async def get(self, user_id):
+        """Живой клиент аккаунта; при необходимости поднимается из файла сессии."""
+        client = self._clients.get(user_id)
+        if client is not None:
+            self._touch(user_id)
+            return client
+        # Параллельные обращения к одному аккаунту ждут одну и ту же загрузку
+        task = self._loading.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load(user_id))
+            self._loading[user_id] = task
+            task.add_done_callback(lambda _: self._loading.pop(user_id, None))
+        return await asyncio.shield(task)
+
+    @asynccontextmanager
+    async def use(self, user_id):
+        """Клиент на время долгой операции (очистка, экспорт, рассылка); None — аккаунт не авторизован.
+
+        Вызовы через лимитер не продлевают простой, поэтому клиент закрепляется
+        до выхода из блока; после выхода отсчёт простоя начинается заново.
+        """
+        client = await self.get(user_id)
+        if client is None:
+            yield None
+            return
+        self._pinned[user_id] = self._pinned.get(user_id, 0) + 1
+        try:
+            yield client
+        finally:
+            left = self._pinned[user_id] - 1
+            if left:
+                self._pinned[user_id] = left
+            else:
+                del self._pinned[user_id]
+            if self._clients.get(user_id) is client:
+                self._touch(user_id)
+
+    async def _load(self, user_id):
+        client = await self._rehydrate(user_id)
+        if client is not None:
+            await self.set(user_id, client)
+        return client
+
+    async def set(self, user_id, client):
+        old = self._clients.get(user_id)
+        if old is not None and old is not client:
+            await self._shutdown(user_id, old)
+        self._clients[user_id] = client
+        self._touch(user_id)
+        if old is not client and self.on_client is not None:
+            await self.on_client(user_id, client)
+        while len(self._clients) > self.max_clients:
+            lru_id = next((uid for uid in self._clients if uid != user_id and uid not in self._pinned), None)
+            if lru_id is None:
+                break  # остальные заняты долгими операциями: лимит превышен до их окончания
+            lru_client = self._clients[lru_id]
+            self._forget(lru_id)
+            self.evicted += 1
+            logger.info("[User %s] Клиент вытеснен (лимит %s)", lru_id, self.max_clients)
+            await self._shutdown(lru_id, lru_client)
+
+    def pop(self, user_id):
+        """Убирает клиента из пула без отключения (например, перед log_out)."""
+        client = self._clients.get(user_id)
+        self._forget(user_id)
+        return client
+
+    async def drop(self, user_id):
+        client = self.pop(user_id)
+        if client is not None:
+            await self._shutdown(user_id, client)
+
+    def _forget(self, user_id):
+        self._clients.pop(user_id, None)
+        self._last_used.pop(user_id, None)
+
+    async def _rehydrate(self, user_id):
+        if user_id in self.pending or not os.path.exists(self.session_path(user_id)):
+            return None
+        api_id, api_hash = await self.db.get_user_api(user_id)
+        if not api_id or not api_hash:
+            return None
+        client = self.create(user_id, api_id, api_hash)
+        try:
+            authorized = await client.connect()
+            if not authorized:
+                await client.disconnect()
+                return None
+            await client.initialize()
+        except Exception as e:
+            logger.error("[User %s] Не удалось поднять сессию: %s: %s", user_id, type(e).__name__, e)
+            try:
+                await client.disconnect()
+            except Exception:
+                pass
+            return None
+        self.rehydrated += 1
+        logger.info("[User %s] Сессия поднята из файла", user_id)
+        return client
+
+    async def _shutdown(self, user_id, client):
+        try:
+            if client.is_initialized:
+                await client.stop()
+            elif client.is_connected:
+                await client.disconnect()
+        except Exception as e:
+            logger.warning("[User %s] Ошибка при отключении клиента: %s", user_id, e)
+
+    # --- Простой ---
+    def start(self):
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(max(1.0, self.idle_timeout / 4))
+            await self.reap_idle()
+
+    async def reap_idle(self):
+        deadline = time.monotonic() - self.idle_timeout
+        # OrderedDict упорядочен по последнему использованию: простаивающие в начале
+        idle = []
+        for user_id, client in self._clients.items():
+            if self._last_used.get(user_id, 0) > deadline:
+                break
+            if user_id not in self._pinned:
+                idle.append((user_id, client))
+        # Все убираются из пула до первого await: пока отключается один,
+        # use() может взять другого, и тот должен подняться заново, а не остаться остановленным
+        for user_id, _ in idle:
+            self._forget(user_id)
+        for user_id, client in idle:
+            logger.info("[User %s] Клиент отключен после простоя", user_id)
+            await self._shutdown(user_id, client)
+        return len(idle)
+
+    # --- Перезапуск ---
+    def live_ids(self):
+        """Аккаунты с живыми клиентами, от давно использованных к свежим."""
+        return list(self._clients)
+
+    async def warm(self, user_ids, concurrency: int = 8):
+        """Заранее поднимает сессии после перезапуска; возвращает число поднятых."""
+        slots = asyncio.Semaphore(concurrency)
+
+        async def load(user_id):
+            async with slots:
+                return await self.get(user_id) is not None
+
+        # Не больше max_clients, свежие аккаунты первыми
+        user_ids = list(reversed(user_ids[-self.max_clients:]))
+        return sum(await asyncio.gather(*(load(uid) for uid in user_ids)))
+
+    async def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            try:
+                await self._reaper
+            except asyncio.CancelledError:
+                pass
+            self._reaper = None
+        clients = list(self._clients.items())
+        for user_id, _ in clients:
+            self._forget(user_id)
+        await asyncio.gather(*(self._shutdown(user_id, client) for user_id, client in clients))
+
+    def stats(self):
+        return {
+            "live": len(self._clients),
+            "max": self.max_clients,
+            "pinned": len(self._pinned),
+            "rehydrated": self.rehydrated,
+            "evicted": self.evicted,
+        }
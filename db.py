@@ -0,0 +1,567 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# --- Схема ---
+# Схема версии 1 — всё, что появилось до версионирования; дальнейшие
+# изменения вносятся только новыми миграциями (см. MIGRATIONS ниже).
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS notes (id INTEGER PRIMARY KEY, user_id INTEGER, text TEXT)',
+    'CREATE TABLE IF NOT EXISTS scheduled_messages (id INTEGER PRIMARY KEY, user_id INTEGER, chat_id TEXT, text TEXT, send_at DATETIME)',
+    'CREATE TABLE IF NOT EXISTS ghost_mode (user_id INTEGER PRIMARY KEY, enabled INTEGER DEFAULT 0)',
+    'CREATE TABLE IF NOT EXISTS user_api (user_id INTEGER PRIMARY KEY, api_id INTEGER, api_hash TEXT)',
+    'CREATE TABLE IF NOT EXISTS fsm_state (key TEXT PRIMARY KEY, state TEXT, data TEXT, updated_at REAL)',
+    'CREATE TABLE IF NOT EXISTS cleanup_progress (user_id INTEGER, chat_id TEXT, last_id INTEGER, deleted INTEGER DEFAULT 0, PRIMARY KEY (user_id, chat_id))',
+    'CREATE TABLE IF NOT EXISTS target_groups (user_id INTEGER, name TEXT, targets TEXT, PRIMARY KEY (user_id, name))',
+    'CREATE TABLE IF NOT EXISTS peer_cache (user_id INTEGER, key TEXT, peer_id INTEGER, access_hash INTEGER, type TEXT, updated_at REAL, PRIMARY KEY (user_id, key))',
+    'CREATE TABLE IF NOT EXISTS dialogs (user_id INTEGER, chat_id INTEGER, kind TEXT, title TEXT, username TEXT, top_date INTEGER, PRIMARY KEY (user_id, chat_id))',
+    'CREATE TABLE IF NOT EXISTS dialog_index (user_id INTEGER PRIMARY KEY, built_at REAL)',
+    # Полнотекстовый индекс заметок поверх самой таблицы notes (external content):
+    # текст не дублируется, а user_id индексируется как токен для фильтра внутри MATCH
+    "CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(text, user_id, content='notes', content_rowid='id')",
+    'CREATE TRIGGER IF NOT EXISTS notes_ai AFTER INSERT ON notes BEGIN '
+    'INSERT INTO notes_fts (rowid, text, user_id) VALUES (new.id, new.text, new.user_id); END',
+    'CREATE TRIGGER IF NOT EXISTS notes_ad AFTER DELETE ON notes BEGIN '
+    "INSERT INTO notes_fts (notes_fts, rowid, text, user_id) VALUES ('delete', old.id, old.text, old.user_id); END",
+    'CREATE TRIGGER IF NOT EXISTS notes_au AFTER UPDATE ON notes BEGIN '
+    "INSERT INTO notes_fts (notes_fts, rowid, text, user_id) VALUES ('delete', old.id, old.text, old.user_id); "
+    'INSERT INTO notes_fts (rowid, text, user_id) VALUES (new.id, new.text, new.user_id); END',
+)
+
+# Колонки, появившиеся после первой версии схемы: (таблица, колонка, объявление)
+COLUMNS = (
+    ('scheduled_messages', 'status', 'INTEGER DEFAULT 0'),
+)
+
+INDEXES = (
+    # Частичный индекс: диспетчер читает только ожидающие строки по возрастанию send_at
+    'CREATE INDEX IF NOT EXISTS idx_scheduled_pending ON scheduled_messages (send_at) WHERE status = 0',
+    'CREATE INDEX IF NOT EXISTS idx_fsm_updated ON fsm_state (updated_at)',
+    # Страницы заметок листаются по ключу (user_id, id), без OFFSET
+    'CREATE INDEX IF NOT EXISTS idx_notes_user ON notes (user_id, id)',
+    # Список диалогов от недавних: весь и с фильтром по виду
+    'CREATE INDEX IF NOT EXISTS idx_dialogs_recent ON dialogs (user_id, top_date, chat_id)',
+    'CREATE INDEX IF NOT EXISTS idx_dialogs_kind ON dialogs (user_id, kind, top_date, chat_id)',
+)
+
+# Статусы scheduled_messages
+SCHEDULED_PENDING = 0
+SCHEDULED_SENDING = 1
+SCHEDULED_SENT = 2
+SCHEDULED_FAILED = 3
+
+# --- Запросы ---
+# Тексты запросов неизменны, поэтому sqlite3 берёт уже подготовленные
+# выражения из кэша соединения (cached_statements) вместо повторного разбора.
+SQL_GET_USER_API = "SELECT api_id, api_hash FROM user_api WHERE user_id = ?"
+SQL_SAVE_USER_API = "INSERT OR REPLACE INTO user_api (user_id, api_id, api_hash) VALUES (?, ?, ?)"
+SQL_GET_GHOST_MODE = "SELECT enabled FROM ghost_mode WHERE user_id = ?"
+SQL_SET_GHOST_MODE = "INSERT OR REPLACE INTO ghost_mode (user_id, enabled) VALUES (?, ?)"
+SQL_ADD_SCHEDULED = "INSERT INTO scheduled_messages (user_id, chat_id, text, send_at, status) VALUES (?, ?, ?, ?, 0)"
+SQL_LOAD_SCHEDULED = "SELECT send_at, id, user_id, chat_id, text FROM scheduled_messages WHERE status = 0 ORDER BY send_at LIMIT ?"
+SQL_CLAIM_SCHEDULED = "UPDATE scheduled_messages SET status = 1 WHERE id = ? AND status = 0"
+SQL_FINISH_SCHEDULED = "UPDATE scheduled_messages SET status = ? WHERE id = ?"
+SQL_RECOVER_SCHEDULED = "UPDATE scheduled_messages SET status = 3 WHERE status = 1"
+# Для процесса-шарда: только аккаунты с user_id % count = index
+SQL_LOAD_SCHEDULED_SHARD = ("SELECT send_at, id, user_id, chat_id, text FROM scheduled_messages "
+                            "WHERE status = 0 AND user_id % ? = ? ORDER BY send_at LIMIT ?")
+SQL_RECOVER_SCHEDULED_SHARD = "UPDATE scheduled_messages SET status = 3 WHERE status = 1 AND user_id % ? = ?"
+# Условие status >= 2 совпадает с условием частичного индекса idx_scheduled_done
+SQL_PURGE_SCHEDULED = ("DELETE FROM scheduled_messages WHERE id IN (SELECT id FROM scheduled_messages "
+                       "WHERE status >= 2 AND send_at < ? LIMIT ?)")
+SQL_LOAD_FSM = "SELECT state, data, updated_at FROM fsm_state WHERE key = ?"
+SQL_SAVE_FSM = "INSERT OR REPLACE INTO fsm_state (key, state, data, updated_at) VALUES (?, ?, ?, ?)"
+SQL_DELETE_FSM = "DELETE FROM fsm_state WHERE key = ?"
+SQL_EXPIRE_FSM = "DELETE FROM fsm_state WHERE updated_at < ?"
+SQL_GET_CLEANUP = "SELECT last_id, deleted FROM cleanup_progress WHERE user_id = ? AND chat_id = ?"
+SQL_SAVE_CLEANUP = "INSERT OR REPLACE INTO cleanup_progress (user_id, chat_id, last_id, deleted) VALUES (?, ?, ?, ?)"
+SQL_DELETE_CLEANUP = "DELETE FROM cleanup_progress WHERE user_id = ? AND chat_id = ?"
+SQL_GET_EXPORT = "SELECT path, last_id, exported, size FROM export_progress WHERE user_id = ? AND chat_id = ?"
+SQL_SAVE_EXPORT = ("INSERT OR REPLACE INTO export_progress (user_id, chat_id, path, last_id, exported, size) "
+                   "VALUES (?, ?, ?, ?, ?, ?)")
+SQL_DELETE_EXPORT = "DELETE FROM export_progress WHERE user_id = ? AND chat_id = ?"
+SQL_ADD_NOTE = "INSERT INTO notes (user_id, text) VALUES (?, ?)"
+SQL_GET_NOTE = "SELECT text FROM notes WHERE id = ? AND user_id = ?"
+SQL_DELETE_NOTE = "DELETE FROM notes WHERE id = ? AND user_id = ?"
+SQL_NOTES_BEFORE = "SELECT id, text FROM notes WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?"
+SQL_NOTES_AFTER = "SELECT id, text FROM notes WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?"
+SQL_SEARCH_NOTES = "SELECT rowid, text FROM notes_fts WHERE notes_fts MATCH ? AND rowid < ? ORDER BY rowid DESC LIMIT ?"
+SQL_GET_GROUP = "SELECT targets FROM target_groups WHERE user_id = ? AND name = ?"
+SQL_SAVE_GROUP = "INSERT OR REPLACE INTO target_groups (user_id, name, targets) VALUES (?, ?, ?)"
+SQL_LIST_GROUPS = "SELECT name FROM target_groups WHERE user_id = ? ORDER BY name"
+SQL_GET_PEER = "SELECT peer_id, access_hash, type, updated_at FROM peer_cache WHERE user_id = ? AND key = ?"
+SQL_DELETE_PEERS = "DELETE FROM peer_cache WHERE user_id = ?"
+SQL_SAVE_PEER = "INSERT OR REPLACE INTO peer_cache (user_id, key, peer_id, access_hash, type, updated_at) VALUES (?, ?, ?, ?, ?, ?)"
+SQL_SAVE_DIALOG = "INSERT OR REPLACE INTO dialogs (user_id, chat_id, kind, title, username, top_date) VALUES (?, ?, ?, ?, ?, ?)"
+SQL_RENAME_DIALOG = "UPDATE dialogs SET kind = ?, title = ?, username = ? WHERE user_id = ? AND chat_id = ?"
+SQL_DELETE_DIALOG = "DELETE FROM dialogs WHERE user_id = ? AND chat_id = ?"
+SQL_LIST_DIALOGS = ("SELECT chat_id, kind, title, username, top_date FROM dialogs WHERE user_id = ? "
+                    "AND (top_date, chat_id) < (?, ?) ORDER BY top_date DESC, chat_id DESC LIMIT ?")
+SQL_LIST_DIALOGS_KIND = ("SELECT chat_id, kind, title, username, top_date FROM dialogs WHERE user_id = ? AND kind = ? "
+                         "AND (top_date, chat_id) < (?, ?) ORDER BY top_date DESC, chat_id DESC LIMIT ?")
+SQL_COUNT_DIALOGS = "SELECT kind, COUNT(*) FROM dialogs WHERE user_id = ? GROUP BY kind"
+SQL_NEWEST_DIALOG = "SELECT MAX(top_date) FROM dialogs WHERE user_id = ?"
+SQL_GET_DIALOGS_BUILT = "SELECT built_at FROM dialog_index WHERE user_id = ?"
+SQL_MARK_DIALOGS_BUILT = "INSERT OR REPLACE INTO dialog_index (user_id, built_at) VALUES (?, ?)"
+
+# Больше любого id: начальное значение ключа страницы
+MAX_ID = 2 ** 63 - 1
+
+
+# --- Миграции ---
+def _migrate_base(conn):
+    """1: таблицы, FTS заметок, колонки и индексы, появившиеся до версионирования.
+
+    База без версии может содержать любую часть этой схемы, поэтому все
+    выражения идемпотентны.
+    """
+    had_fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'notes_fts'").fetchone()
+    for stmt in SCHEMA:
+        conn.execute(stmt)
+    if not had_fts:
+        # Заметки, созданные до появления индекса
+        conn.execute("INSERT INTO notes_fts (notes_fts) VALUES ('rebuild')")
+    for table, column, decl in COLUMNS:
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    for stmt in INDEXES:
+        conn.execute(stmt)
+
+
+def _migrate_scheduled_done(conn):
+    """2: индексы завершённых и захваченных отложенных: очистка и восстановление без полного прохода."""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_scheduled_done ON scheduled_messages (send_at) WHERE status >= 2')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_scheduled_claimed ON scheduled_messages (id) WHERE status = 1')
+
+
+def _migrate_export_progress(conn):
+    """3: контрольные точки выгрузки истории чатов: id последнего сохранённого сообщения и размер архива."""
+    conn.execute('CREATE TABLE IF NOT EXISTS export_progress (user_id INTEGER, chat_id TEXT, path TEXT, '
+                 'last_id INTEGER, exported INTEGER DEFAULT 0, size INTEGER DEFAULT 0, PRIMARY KEY (user_id, chat_id))')
+
+
+# Версия схемы хранится в PRAGMA user_version: MIGRATIONS[n - 1] переводит базу с n - 1 на n.
+# Новая миграция добавляется в конец; уже выпущенные не меняются.
+MIGRATIONS = (
+    _migrate_base,
+    _migrate_scheduled_done,
+    _migrate_export_progress,
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(conn):
+    """Применяет недостающие миграции, каждую в своей транзакции; возвращает исходную версию.
+
+    Базу могут открывать несколько процессов сразу (шарды): версия
+    перечитывается под блокировкой записи, и миграцию, уже применённую
+    другим процессом, этот пропускает.
+    """
+    initial = version = conn.execute("PRAGMA user_version").fetchone()[0]
+    while version < SCHEMA_VERSION:
+        started = time.perf_counter()
+        # DDL в sqlite3 не открывает транзакцию сам: прерванная миграция откатывается целиком.
+        # IMMEDIATE берёт запись сразу: второй процесс ждёт busy_timeout, а не получает
+        # «database is locked» при повышении блокировки после чтения схемы
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                conn.commit()
+                break
+            target = version + 1
+            MIGRATIONS[target - 1](conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        version = target
+        logger.info("База: миграция %s (%s) за %.2f с", target, MIGRATIONS[target - 1].__name__.lstrip("_"),
+                    time.perf_counter() - started)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Схема базы версии {version} новее поддерживаемой ({SCHEMA_VERSION})")
+    return initial
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def fts_query(user_id, text, prefix=False):
+    """Запрос FTS5 из пользовательского ввода: все слова (или их префиксы), только свои заметки.
+
+    Синтаксис FTS5 во вводе не интерпретируется; None, если слов нет.
+    """
+    words = _WORD_RE.findall(text)
+    if not words:
+        return None
+    star = "*" if prefix else ""
+    return f'user_id:"{int(user_id)}" ' + " ".join(f'text:"{w}"{star}' for w in words)
+
+
+class Database:
+    """Долгоживущее WAL-соединение с bot_data.db.
+
+    Все обращения выполняются в одном фоновом потоке, поэтому соединение
+    используется последовательно, а event loop не блокируется на диске.
+    Строки ghost_mode и user_api кэшируются с записью насквозь.
+    """
+
+    def __init__(self, path: str, cache_size: int = 4096, metrics=None):
+        self.path = path
+        self.metrics = metrics
+        self._conn = None
+        self._executor = None
+        self.ghost_cache = LRUCache(cache_size)
+        self.api_cache = LRUCache(cache_size)
+
+    @property
+    def is_open(self) -> bool:
+        return self._conn is not None
+
+    def open(self):
+        if self._conn is not None:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256)
+        # Для новой базы режим действует сразу: освобождённые страницы возвращаются reclaim()
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        migrate(conn)
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # База создана до режима: он включается только перестройкой файла, один раз
+            started = time.perf_counter()
+            conn.execute("VACUUM")
+            logger.info("База: включена инкрементальная очистка (VACUUM за %.2f с)", time.perf_counter() - started)
+        self._conn = conn
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bot-db")
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # --- Низкоуровневый доступ ---
+    async def run(self, fn, *args):
+        """Выполняет fn(conn, *args) в потоке БД."""
+        loop = asyncio.get_running_loop()
+        if self.metrics is None:
+            return await loop.run_in_executor(self._executor, fn, self._conn, *args)
+        # Время включает ожидание в очереди потока БД — его и видит обработчик
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, fn, self._conn, *args)
+        finally:
+            self.metrics.observe("db", fn.__name__.lstrip("_"), time.perf_counter() - start)
+
+    @staticmethod
+    def _fetchone(conn, sql, params):
+        return conn.execute(sql, params).fetchone()
+
+    @staticmethod
+    def _fetchall(conn, sql, params):
+        return conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _execute(conn, sql, params):
+        with conn:
+            return conn.execute(sql, params).rowcount
+
+    @staticmethod
+    def _insert(conn, sql, params):
+        with conn:
+            return conn.execute(sql, params).lastrowid
+
+    @staticmethod
+    def _executemany(conn, sql, seq):
+        with conn:
+            return conn.executemany(sql, seq).rowcount
+
+    async def fetchone(self, sql, params=()):
+        return await self.run(self._fetchone, sql, params)
+
+    async def fetchall(self, sql, params=()):
+        return await self.run(self._fetchall, sql, params)
+
+    async def execute(self, sql, params=()):
+        return await self.run(self._execute, sql, params)
+
+    async def insert(self, sql, params=()):
+        return await self.run(self._insert, sql, params)
+
+    async def executemany(self, sql, seq):
+        return await self.run(self._executemany, sql, list(seq))
+
+    def invalidate(self, user_id=None):
+        """Сбрасывает кэш строк пользователя (или весь кэш, если user_id не задан)."""
+        if user_id is None:
+            self.ghost_cache.invalidate()
+            self.api_cache.invalidate()
+        else:
+            self.ghost_cache.invalidate(user_id)
+            self.api_cache.invalidate(user_id)
+
+    def cache_stats(self):
+        return {"ghost_mode": self.ghost_cache.stats(), "user_api": self.api_cache.stats()}
+
+    # --- user_api ---
+    async def get_user_api(self, user_id):
+        cached = self.api_cache.get(user_id)
+        if cached is not None:
+            return cached
+        res = await self.fetchone(SQL_GET_USER_API, (user_id,))
+        # Отсутствие строки тоже кэшируется, чтобы не ходить в БД повторно
+        res = tuple(res) if res else (None, None)
+        self.api_cache.set(user_id, res)
+        return res
+
+    async def save_user_api(self, user_id, api_id, api_hash):
+        if self.api_cache.get(user_id) == (api_id, api_hash):
+            return
+        await self.execute(SQL_SAVE_USER_API, (user_id, api_id, api_hash))
+        self.api_cache.set(user_id, (api_id, api_hash))
+
+    # --- ghost_mode ---
+    async def get_ghost_mode(self, user_id):
+        cached = self.ghost_cache.get(user_id)
+        if cached is not None:
+            return cached
+        res = await self.fetchone(SQL_GET_GHOST_MODE, (user_id,))
+        enabled = res[0] if res else 0
+        self.ghost_cache.set(user_id, enabled)
+        return enabled
+
+    async def set_ghost_mode(self, user_id, enabled):
+        if self.ghost_cache.get(user_id) == enabled:
+            return
+        await self.execute(SQL_SET_GHOST_MODE, (user_id, enabled))
+        self.ghost_cache.set(user_id, enabled)
+
+    # --- scheduled_messages ---
+    async def add_scheduled(self, user_id, chat_id, text, send_at):
+        return await self.insert(SQL_ADD_SCHEDULED, (user_id, chat_id, text, send_at))
+
+    async def load_scheduled(self, limit, shard=None):
+        """Ближайшие ожидающие строки: (send_at, id, user_id, chat_id, text).
+
+        shard — (index, count): только аккаунты этого процесса-шарда.
+        """
+        if shard is not None:
+            index, count = shard
+            return await self.fetchall(SQL_LOAD_SCHEDULED_SHARD, (count, index, limit))
+        return await self.fetchall(SQL_LOAD_SCHEDULED, (limit,))
+
+    @staticmethod
+    def _claim(conn, ids):
+        with conn:
+            return {i for i in ids if conn.execute(SQL_CLAIM_SCHEDULED, (i,)).rowcount}
+
+    async def claim_scheduled(self, ids):
+        """Помечает строки как отправляемые до самой отправки и возвращает id,
+        которые удалось захватить: каждая строка уходит не более одного раза."""
+        return await self.run(self._claim, list(ids))
+
+    async def finish_scheduled(self, results):
+        """results: пары (id, статус)."""
+        return await self.executemany(SQL_FINISH_SCHEDULED, ((status, i) for i, status in results))
+
+    @staticmethod
+    def _purge_scheduled(conn, before, batch):
+        with conn:
+            return conn.execute(SQL_PURGE_SCHEDULED, (before, batch)).rowcount
+
+    async def purge_scheduled(self, before, batch: int = 5000):
+        """Удаляет завершённые строки (отправленные и неудачные) со сроком раньше before.
+
+        Каждые batch строк — отдельная транзакция: поток БД не занят надолго.
+        """
+        total = 0
+        while True:
+            deleted = await self.run(self._purge_scheduled, before, batch)
+            total += deleted
+            if deleted < batch:
+                return total
+
+    @staticmethod
+    def _reclaim(conn, pages):
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        # execute() выполняет один шаг прагмы и освобождает одну страницу; executescript — все
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+        return free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    async def reclaim(self, pages: int = 0):
+        """Возвращает файловой системе до pages свободных страниц (0 — все); число возвращённых."""
+        return await self.run(self._reclaim, pages)
+
+    async def recover_scheduled(self, shard=None):
+        """Строки, захваченные до перезапуска, могли уже уйти — повторно не отправляем."""
+        if shard is not None:
+            index, count = shard
+            return await self.execute(SQL_RECOVER_SCHEDULED_SHARD, (count, index))
+        return await self.execute(SQL_RECOVER_SCHEDULED)
+
+    # --- fsm_state ---
+    async def load_fsm(self, key):
+        """(state, data_json, updated_at) или None."""
+        return await self.fetchone(SQL_LOAD_FSM, (key,))
+
+    @staticmethod
+    def _flush_fsm(conn, upserts, deletes):
+        with conn:
+            if upserts:
+                conn.executemany(SQL_SAVE_FSM, upserts)
+            if deletes:
+                conn.executemany(SQL_DELETE_FSM, [(k,) for k in deletes])
+
+    async def flush_fsm(self, upserts, deletes):
+        """Одна транзакция: upserts — (key, state, data_json, updated_at), deletes — ключи."""
+        await self.run(self._flush_fsm, upserts, deletes)
+
+    async def expire_fsm(self, before):
+        return await self.execute(SQL_EXPIRE_FSM, (before,))
+
+    # --- cleanup_progress ---
+    async def get_cleanup_progress(self, user_id, chat_id):
+        """(last_id, deleted) прерванной очистки или None."""
+        return await self.fetchone(SQL_GET_CLEANUP, (user_id, chat_id))
+
+    async def save_cleanup_progress(self, user_id, chat_id, last_id, deleted):
+        await self.execute(SQL_SAVE_CLEANUP, (user_id, chat_id, last_id, deleted))
+
+    async def delete_cleanup_progress(self, user_id, chat_id):
+        await self.execute(SQL_DELETE_CLEANUP, (user_id, chat_id))
+
+    # --- export_progress ---
+    async def get_export_progress(self, user_id, chat_id):
+        """(path, last_id, exported, size) прерванной выгрузки или None."""
+        return await self.fetchone(SQL_GET_EXPORT, (user_id, chat_id))
+
+    async def save_export_progress(self, user_id, chat_id, path, last_id, exported, size):
+        await self.execute(SQL_SAVE_EXPORT, (user_id, chat_id, path, last_id, exported, size))
+
+    async def delete_export_progress(self, user_id, chat_id):
+        await self.execute(SQL_DELETE_EXPORT, (user_id, chat_id))
+
+    # --- notes ---
+    async def add_note(self, user_id, text):
+        return await self.insert(SQL_ADD_NOTE, (user_id, text))
+
+    async def get_note(self, user_id, note_id):
+        res = await self.fetchone(SQL_GET_NOTE, (note_id, user_id))
+        return res[0] if res else None
+
+    async def delete_note(self, user_id, note_id):
+        return await self.execute(SQL_DELETE_NOTE, (note_id, user_id))
+
+    async def list_notes(self, user_id, before=None, after=None, limit=10):
+        """Страница заметок от новых к старым: с id < before или, назад, с id > after.
+
+        Ключ страницы — id, поэтому цена не зависит от её номера.
+        """
+        if after is not None:
+            rows = await self.fetchall(SQL_NOTES_AFTER, (user_id, after, limit))
+            return rows[::-1]
+        return await self.fetchall(SQL_NOTES_BEFORE, (user_id, MAX_ID if before is None else before, limit))
+
+    async def search_notes(self, user_id, text, before=None, limit=10, prefix=False):
+        """Заметки со всеми словами запроса, от новых к старым.
+
+        Поиск по префиксам собирает в памяти списки всех подходящих слов и на
+        больших объёмах на порядок медленнее поиска целых слов.
+        """
+        query = fts_query(user_id, text, prefix)
+        if query is None:
+            return []
+        return await self.fetchall(SQL_SEARCH_NOTES, (query, MAX_ID if before is None else before, limit))
+
+    # --- target_groups ---
+    async def get_target_group(self, user_id, name):
+        """Сохранённый список получателей рассылки или None."""
+        res = await self.fetchone(SQL_GET_GROUP, (user_id, name))
+        return json.loads(res[0]) if res else None
+
+    async def save_target_group(self, user_id, name, targets):
+        await self.execute(SQL_SAVE_GROUP, (user_id, name, json.dumps(targets)))
+
+    async def list_target_groups(self, user_id):
+        return [row[0] for row in await self.fetchall(SQL_LIST_GROUPS, (user_id,))]
+
+    # --- peer_cache ---
+    async def get_peer(self, user_id, key):
+        """(peer_id, access_hash, type, updated_at); peer_id None — цель не найдена."""
+        return await self.fetchone(SQL_GET_PEER, (user_id, key))
+
+    async def save_peers(self, user_id, rows):
+        """rows: (key, peer_id, access_hash, type, updated_at)."""
+        await self.executemany(SQL_SAVE_PEER, ((user_id, *row) for row in rows))
+
+    async def delete_peers(self, user_id):
+        await self.execute(SQL_DELETE_PEERS, (user_id,))
+
+    # --- dialogs ---
+    async def save_dialogs(self, user_id, rows):
+        """rows: (chat_id, kind, title, username, top_date)."""
+        if rows:
+            await self.executemany(SQL_SAVE_DIALOG, ((user_id, *row) for row in rows))
+
+    @staticmethod
+    def _flush_dialogs(conn, upserts, deletes):
+        now = int(time.time())
+        with conn:
+            for user_id, chat_id, kind, title, username, top_date in upserts:
+                # top_date None: чат изменился без нового сообщения, место в списке прежнее
+                if top_date is None:
+                    if conn.execute(SQL_RENAME_DIALOG, (kind, title, username, user_id, chat_id)).rowcount:
+                        continue
+                    top_date = now
+                conn.execute(SQL_SAVE_DIALOG, (user_id, chat_id, kind, title, username, top_date))
+            if deletes:
+                conn.executemany(SQL_DELETE_DIALOG, deletes)
+
+    async def flush_dialogs(self, upserts, deletes):
+        """Одна транзакция: upserts — (user_id, chat_id, kind, title, username, top_date или None),
+        deletes — (user_id, chat_id)."""
+        await self.run(self._flush_dialogs, upserts, deletes)
+
+    @staticmethod
+    def _clear_dialogs(conn, user_id):
+        with conn:
+            conn.execute("DELETE FROM dialogs WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM dialog_index WHERE user_id = ?", (user_id,))
+
+    async def clear_dialogs(self, user_id):
+        await self.run(self._clear_dialogs, user_id)
+
+    async def list_dialogs(self, user_id, kind=None, before=None, limit=10):
+        """(chat_id, kind, title, username, top_date) от недавних; before — (top_date, chat_id)."""
+        top_date, chat_id = before if before is not None else (MAX_ID, MAX_ID)
+        if kind is None:
+            return await self.fetchall(SQL_LIST_DIALOGS, (user_id, top_date, chat_id, limit))
+        return await self.fetchall(SQL_LIST_DIALOGS_KIND, (user_id, kind, top_date, chat_id, limit))
+
+    async def count_dialogs(self, user_id):
+        return dict(await self.fetchall(SQL_COUNT_DIALOGS, (user_id,)))
+
+    async def newest_dialog(self, user_id):
+        return (await self.fetchone(SQL_NEWEST_DIALOG, (user_id,)))[0]
+
+    async def get_dialogs_built(self, user_id):
+        res = await self.fetchone(SQL_GET_DIALOGS_BUILT, (user_id,))
+        return res[0] if res else None
+
+    async def mark_dialogs_built(self, user_id, built_at):
+        await self.execute(SQL_MARK_DIALOGS_BUILT, (user_id, built_at))
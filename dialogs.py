@@ -0,0 +1,301 @@
+import asyncio
+import logging
+import time
+
+from ratelimit import BULK
+
+logger = logging.getLogger(__name__)
+
+# Вид диалога в индексе и подпись фильтра
+KINDS = {"channel": "📢 Каналы", "group": "👥 Группы", "private": "👤 Личные"}
+# Значения pyrogram.enums.ChatType
+_KIND_BY_TYPE = {"channel": "channel", "supergroup": "group", "group": "group", "private": "private", "bot": "private"}
+# Группа обработчиков Pyrogram: не мешает обработчикам в группе 0
+HANDLER_GROUP = 10
+
+
+def _input_peer(peer, users, chats):
+    from pyrogram import raw
+
+    if isinstance(peer, raw.types.PeerUser):
+        user = users[peer.user_id]
+        return raw.types.InputPeerUser(user_id=user.id, access_hash=user.access_hash)
+    if isinstance(peer, raw.types.PeerChat):
+        return raw.types.InputPeerChat(chat_id=peer.chat_id)
+    channel = chats[peer.channel_id]
+    return raw.types.InputPeerChannel(channel_id=channel.id, access_hash=channel.access_hash)
+
+
+async def _dialogs_page(client, offset, limit):
+    """Одна страница messages.getDialogs: ([(Chat, дата верхнего сообщения, закреплён)], смещение следующей или None)."""
+    from pyrogram import raw, types, utils
+
+    offset_date, offset_id, offset_peer = offset
+    r = await client.invoke(
+        raw.functions.messages.GetDialogs(
+            offset_date=offset_date,
+            offset_id=offset_id,
+            offset_peer=offset_peer or raw.types.InputPeerEmpty(),
+            limit=limit,
+            hash=0
+        )
+    )
+    users = {u.id: u for u in r.users}
+    chats = {c.id: c for c in r.chats}
+    dates = {utils.get_peer_id(m.peer_id): m.date for m in r.messages if not isinstance(m, raw.types.MessageEmpty)}
+    page = []
+    last = None
+    for dialog in r.dialogs:
+        if not isinstance(dialog, raw.types.Dialog):
+            continue
+        chat = types.Chat._parse_dialog(client, dialog.peer, users, chats)
+        page.append((chat, dates.get(chat.id, 0), bool(dialog.pinned)))
+        # Смещение — от последнего диалога, чьё верхнее сообщение пришло в ответе:
+        # с нулевой датой проход начался бы с начала списка
+        if chat.id in dates:
+            last = (dates[chat.id], dialog)
+    # messages.Dialogs вместо DialogsSlice — весь список уместился в ответ
+    if last is None or isinstance(r, raw.types.messages.Dialogs):
+        return page, None
+    date, dialog = last
+    return page, (date, dialog.top_message, _input_peer(dialog.peer, users, chats))
+
+
+async def dialog_pages(client, user_id, limiter, limit: int = 0, priority=BULK):
+    """Диалоги аккаунта от новых к старым, страницами по 100: (Chat, дата верхнего сообщения, закреплён).
+
+    Каждая страница — отдельный вызов лимитера, поэтому длинный список
+    расходует токены аккаунта постранично, а FloodWait повторяет только
+    прерванную страницу с её смещения. limit 0 — все диалоги.
+    """
+    offset = (0, 0, None)
+    left = limit or float("inf")
+    while left > 0:
+        page, offset = await limiter.call(user_id, _dialogs_page, client, offset, int(min(100, left)),
+                                          priority=priority)
+        if not page:
+            return
+        page = page[:int(min(len(page), left))]
+        left -= len(page)
+        yield page
+        if offset is None:
+            return
+
+
+def _title(chat):
+    if chat.title:
+        return chat.title
+    return " ".join(filter(None, (chat.first_name, chat.last_name))) or str(chat.id)
+
+
+def _row(chat, top_date):
+    """(chat_id, kind, title, username, top_date) из pyrogram.types.Chat."""
+    kind = _KIND_BY_TYPE.get(getattr(chat.type, "value", None), "private")
+    return chat.id, kind, _title(chat), chat.username, int(top_date)
+
+
+class DialogIndex:
+    """Индекс диалогов аккаунтов в таблице dialogs.
+
+    Строится один раз полным проходом messages.getDialogs, дальше поддерживается
+    обработчиками Pyrogram: новое сообщение поднимает чат наверх (или
+    добавляет новый), вступление и выход из каналов приходят как
+    UpdateChannel. Изменения копятся в памяти и пишутся пачкой раз в
+    flush_interval секунд. Пока клиента не было в сети, индекс мог отстать:
+    при следующем открытии списка дочитываются только диалоги новее
+    последнего известного.
+    """
+
+    def __init__(self, db, limiter, peers=None, flush_interval: float = 5.0):
+        self.db = db
+        self.limiter = limiter
+        self.peers = peers
+        self.flush_interval = flush_interval
+        self._built = set()
+        self._stale = set()  # аккаунты, чей клиент поднят заново и мог пропустить апдейты
+        self._building = {}  # user_id -> задача полного прохода
+        self._upserts = {}  # (user_id, chat_id) -> строка
+        self._deletes = set()
+        self._task = None
+        self.updates = 0
+
+    # --- Построение ---
+    async def is_built(self, user_id):
+        if user_id in self._built:
+            return True
+        if await self.db.get_dialogs_built(user_id):
+            self._built.add(user_id)
+            return True
+        return False
+
+    async def build(self, client, user_id, on_progress=None):
+        """Полный проход по диалогам аккаунта; старый индекс аккаунта заменяется.
+
+        Повторный вызов во время построения ждёт уже идущий проход.
+        """
+        task = self._building.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._stream(client, user_id, full=True, on_progress=on_progress))
+            self._building[user_id] = task
+            task.add_done_callback(lambda _: self._building.pop(user_id, None))
+        count = await asyncio.shield(task)
+        if user_id not in self._built:
+            self._built.add(user_id)
+            self._stale.discard(user_id)
+            logger.info("[User %s] Индекс диалогов построен: %s чатов", user_id, count)
+        return count
+
+    def cancel(self, user_id):
+        """Прерывает идущее построение: индекс остаётся непостроенным и соберётся заново."""
+        task = self._building.get(user_id)
+        if task is not None:
+            task.cancel()
+
+    async def refresh(self, client, user_id):
+        """Дочитывает диалоги новее последнего известного, если клиент мог пропустить апдейты."""
+        if user_id not in self._stale:
+            return 0
+        self._stale.discard(user_id)
+        return await self._stream(client, user_id, full=False)
+
+    async def _stream(self, client, user_id, full, on_progress=None, batch: int = 200):
+        await self.flush()
+        newest = None if full else await self.db.newest_dialog(user_id)
+        if full:
+            await self.db.clear_dialogs(user_id)
+        rows, peers, seen = [], [], 0
+        # Страница — отдельный вызов лимитера: FloodWait повторяет её, а не весь проход
+        pages = dialog_pages(client, user_id, self.limiter)
+        try:
+            async for page in pages:
+                caught_up = False
+                for chat, top_date, pinned in page:
+                    if newest is not None and top_date <= newest:
+                        # Закреплённые идут первыми при любой дате, у диалога без верхнего
+                        # сообщения даты нет; остальные — от новых к старым, и дальше всё уже есть
+                        if pinned or not top_date:
+                            continue
+                        caught_up = True
+                        break
+                    rows.append(_row(chat, top_date))
+                    if self.peers is not None:
+                        peers.extend(await self.peers.dialog_peers(client, chat))
+                if len(rows) >= batch:
+                    seen += len(rows)
+                    await self.db.save_dialogs(user_id, rows)
+                    rows = []
+                    if on_progress is not None:
+                        await on_progress(seen)
+                if caught_up:
+                    break
+        finally:
+            await pages.aclose()
+        seen += len(rows)
+        await self.db.save_dialogs(user_id, rows)
+        if self.peers is not None and full:
+            await self.peers.remember(user_id, peers)
+        if full:
+            await self.db.mark_dialogs_built(user_id, time.time())
+        return seen
+
+    # --- Выборка ---
+    async def page(self, user_id, kind=None, before=None, limit=10):
+        """Страница от недавних к старым; before — ключ (top_date, chat_id) последней строки."""
+        await self.flush()
+        return await self.db.list_dialogs(user_id, kind, before, limit)
+
+    async def counts(self, user_id):
+        return await self.db.count_dialogs(user_id)
+
+    # --- Апдейты Pyrogram ---
+    async def attach(self, user_id, client):
+        """Подключает обработчики к новому клиенту аккаунта."""
+        from pyrogram import raw, utils
+        from pyrogram.handlers import MessageHandler, RawUpdateHandler
+
+        self._stale.add(user_id)
+
+        async def on_message(_, message):
+            if user_id not in self._built or message.chat is None:
+                return
+            left = message.left_chat_member
+            if left is not None and left.is_self:
+                return self._delete(user_id, message.chat.id)
+            date = message.date.timestamp() if message.date else time.time()
+            self._upsert(user_id, _row(message.chat, date))
+
+        async def on_raw(_, update, users, chats):
+            if user_id not in self._built or not isinstance(update, raw.types.UpdateChannel):
+                return
+            channel = chats.get(update.channel_id)
+            chat_id = utils.MAX_CHANNEL_ID - update.channel_id
+            if channel is None or isinstance(channel, raw.types.ChannelForbidden) or getattr(channel, "left", False):
+                return self._delete(user_id, chat_id)
+            kind = "group" if channel.megagroup else "channel"
+            self._upsert(user_id, (chat_id, kind, channel.title, channel.username, None))
+
+        client.add_handler(MessageHandler(on_message), group=HANDLER_GROUP)
+        client.add_handler(RawUpdateHandler(on_raw), group=HANDLER_GROUP)
+
+    def _upsert(self, user_id, row):
+        key = (user_id, row[0])
+        self._deletes.discard(key)
+        pending = self._upserts.get(key)
+        if row[4] is None and pending is not None:
+            # Новое сообщение в той же пачке важнее: его дата остаётся
+            row = (*row[:4], pending[4])
+        self._upserts[key] = row
+        self.updates += 1
+
+    def _delete(self, user_id, chat_id):
+        key = (user_id, chat_id)
+        self._upserts.pop(key, None)
+        self._deletes.add(key)
+        self.updates += 1
+
+    # --- Запись ---
+    async def flush(self):
+        if not self._upserts and not self._deletes:
+            return
+        upserts, self._upserts = self._upserts, {}
+        deletes, self._deletes = self._deletes, set()
+        await self.db.flush_dialogs([(uid, *row) for (uid, _), row in upserts.items()], list(deletes))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Индекс диалогов: ошибка записи: %s: %s", type(e).__name__, e)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def forget(self, user_id):
+        """Удаляет индекс аккаунта (после выхода или входа в другой аккаунт)."""
+        # Идущий проход иначе допишет строки уже после очистки
+        task = self._building.get(user_id)
+        if task is not None:
+            task.cancel()
+            await asyncio.wait([task])
+        self._built.discard(user_id)
+        self._stale.discard(user_id)
+        for key in [k for k in self._upserts if k[0] == user_id]:
+            del self._upserts[key]
+        self._deletes = {k for k in self._deletes if k[0] != user_id}
+        await self.db.clear_dialogs(user_id)
+
+    def stats(self):
+        return {"built": len(self._built), "pending": len(self._upserts) + len(self._deletes), "updates": self.updates}
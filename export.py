@@ -0,0 +1,167 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+import zlib
+
+from ratelimit import BULK
+from scheduler import normalize_chat
+
+logger = logging.getLogger(__name__)
+
+PAGE = 100  # максимум messages.getHistory за запрос
+_UNSAFE = re.compile(r"[^\w@-]")
+
+
+async def _history_page(client, peer, offset_id, limit):
+    """Сообщения старше offset_id (0 — с самого нового), от новых к старым."""
+    from pyrogram import raw
+
+    r = await client.invoke(
+        raw.functions.messages.GetHistory(
+            peer=peer,
+            offset_id=offset_id,
+            offset_date=0,
+            add_offset=0,
+            limit=limit,
+            max_id=0,
+            min_id=0,
+            hash=0
+        )
+    )
+    return r.messages
+
+
+def _name(obj, prefix):
+    # MessageMediaPhoto → Photo, MessageEntityBold → Bold
+    return type(obj).__name__.removeprefix(prefix)
+
+
+def record(message):
+    """Строка архива из сырого сообщения; для MessageEmpty — None.
+
+    Сообщения не разбираются в pyrogram.types.Message: на миллионах
+    строк это основная стоимость выгрузки, а архиву нужны только поля.
+    """
+    from pyrogram import raw, utils
+
+    if isinstance(message, raw.types.MessageEmpty):
+        return None
+    rec = {"id": message.id, "date": message.date}
+    if message.from_id is not None:
+        rec["from"] = utils.get_peer_id(message.from_id)
+    reply_to = getattr(message.reply_to, "reply_to_msg_id", None)
+    if reply_to:
+        rec["reply_to"] = reply_to
+    if isinstance(message, raw.types.MessageService):
+        rec["action"] = _name(message.action, "MessageAction")
+        return rec
+    if message.message:
+        rec["text"] = message.message
+    if message.entities:
+        rec["entities"] = [[_name(e, "MessageEntity"), e.offset, e.length] + ([e.url] if getattr(e, "url", None) else [])
+                           for e in message.entities]
+    if message.media is not None:
+        rec["media"] = _name(message.media, "MessageMedia")
+    fwd = message.fwd_from
+    if fwd is not None:
+        rec["fwd_from"] = utils.get_peer_id(fwd.from_id) if fwd.from_id is not None else fwd.from_name
+    if message.grouped_id:
+        rec["grouped_id"] = message.grouped_id
+    if message.edit_date:
+        rec["edit_date"] = message.edit_date
+    if message.views is not None:
+        rec["views"] = message.views
+    return rec
+
+
+def _write_member(path, size, lines, level):
+    """Дописывает строки отдельным gzip-членом с позиции size; возвращает новый размер архива.
+
+    Хвост после size (член, не попавший в контрольную точку) отрезается.
+    Выполняется в потоке: сжатие и fsync не держат цикл событий.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 — формат gzip
+    data = compressor.compress("\n".join(lines).encode() + b"\n") + compressor.flush()
+    with open(path, "r+b" if size else "wb") as f:
+        f.truncate(size)
+        f.seek(size)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+
+async def export_history(client, user_id, chat, db, limiter, directory, on_progress=None,
+                         batch: int = 1000, level: int = 6):
+    """Выгружает всю историю чата в JSON Lines со сжатием gzip, от новых к старым.
+
+    Страницы messages.getHistory идут через лимитер с приоритетом BULK;
+    следующая страница загружается, пока пишется предыдущая. Каждые batch
+    сообщений дописываются в архив отдельным gzip-членом, после чего в
+    export_progress сохраняются id последнего записанного сообщения и
+    размер файла. В памяти не больше одной пачки, сколько бы сообщений
+    ни было в чате. Прерванная выгрузка продолжается с контрольной точки,
+    недописанный хвост архива отрезается. Архив читается gzip/zcat как
+    один файл. on_progress(выгружено, сообщений в секунду) вызывается
+    после каждой пачки. Возвращает (путь, выгружено всего, за этот запуск,
+    секунды).
+    """
+    chat = normalize_chat(chat)
+    key = str(chat)
+    checkpoint = await db.get_export_progress(user_id, key)
+    if checkpoint:
+        path, offset_id, exported, size = checkpoint
+        if not os.path.exists(path) or os.path.getsize(path) < size:
+            logger.warning("[User %s] Архив выгрузки %s пропал или обрезан, выгрузка начнётся заново", user_id, key)
+            checkpoint = None
+        else:
+            logger.info("[User %s] Выгрузка %s: продолжение с id %s, уже выгружено %s", user_id, key, offset_id, exported)
+    if not checkpoint:
+        path = os.path.join(directory, str(user_id), _UNSAFE.sub("_", key) + ".jsonl.gz")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        offset_id = exported = size = 0
+    peer = await limiter.call(user_id, client.resolve_peer, chat, priority=BULK)
+
+    def fetch(offset):
+        return asyncio.ensure_future(
+            limiter.call(user_id, _history_page, client, peer, offset, PAGE, priority=BULK))
+
+    started = time.perf_counter()
+    session = 0
+    lines = []
+    pending = fetch(offset_id)
+    try:
+        while True:
+            messages = await pending
+            pending = None
+            if messages:
+                offset_id = messages[-1].id
+                pending = fetch(offset_id)
+            for message in messages:
+                rec = record(message)
+                if rec is not None:
+                    lines.append(json.dumps(rec, ensure_ascii=False, separators=(",", ":")))
+            if lines and (len(lines) >= batch or not messages):
+                write = asyncio.ensure_future(asyncio.to_thread(_write_member, path, size, lines, level))
+                try:
+                    size = await asyncio.shield(write)
+                except asyncio.CancelledError:
+                    # Поток допишет член и так; без контрольной точки продолжение его отрежет
+                    await asyncio.wait([write])
+                    raise
+                exported += len(lines)
+                session += len(lines)
+                lines = []
+                await db.save_export_progress(user_id, key, path, offset_id, exported, size)
+                if on_progress:
+                    await on_progress(exported, session / (time.perf_counter() - started))
+            if not messages:
+                break
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+    await db.delete_export_progress(user_id, key)
+    return path, exported, session, time.perf_counter() - started
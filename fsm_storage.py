@@ -0,0 +1,163 @@
+import asyncio
+import json
+import logging
+import time
+from copy import copy
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.exceptions import DataNotDictLikeError
+
+logger = logging.getLogger(__name__)
+
+
+class _Record:
+    __slots__ = ("state", "data", "touched")
+
+    def __init__(self, state=None, data=None, touched=0.0):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.touched = touched
+
+
+def _key(key: StorageKey) -> str:
+    return ":".join(str(part) for part in (
+        key.bot_id, key.chat_id, key.user_id, key.thread_id or "", key.business_connection_id or "", key.destiny))
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище: горячие состояния в памяти, копия в bot_data.db.
+
+    Чтение и запись работают со словарём в памяти, как MemoryStorage.
+    Изменённые ключи раз в flush_interval секунд пишутся в fsm_state одной
+    транзакцией. Состояния, не менявшиеся дольше ttl, удаляются, а из
+    памяти вытесняются давно не менявшиеся уже записанные записи.
+    """
+
+    def __init__(self, db, ttl: float = 86400, flush_interval: float = 1.0, max_hot: int = 10000):
+        self.db = db
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.max_hot = max_hot
+        self._hot = {}  # StorageKey -> _Record
+        self._dirty = set()
+        self._task = None
+        self.loads = 0
+        self.flushes = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.db.is_open:
+            await self.flush()
+
+    # --- Горячий уровень ---
+    async def _record(self, key: StorageKey) -> _Record:
+        # Горячий путь — один поиск в dict; await нужен только для чтения из БД
+        return self._hot.get(key) or await self._load(key)
+
+    async def _load(self, key: StorageKey) -> _Record:
+        row = await self.db.load_fsm(_key(key))
+        self.loads += 1
+        # Пока шло чтение, ключ мог быть записан — свежая запись важнее
+        record = self._hot.get(key)
+        if record is None:
+            if row and (not self.ttl or row[2] >= time.time() - self.ttl):
+                record = _Record(row[0], json.loads(row[1]) if row[1] else {}, row[2])
+            else:
+                record = _Record(touched=time.time())
+            self._hot[key] = record
+            self._evict()
+        return record
+
+    def _mark(self, key: StorageKey, record: _Record):
+        record.touched = time.time()
+        self._dirty.add(key)
+
+    def _evict(self):
+        if len(self._hot) <= self.max_hot:
+            return
+        # Вытесняются давно не менявшиеся и уже записанные в БД записи,
+        # сразу с запасом в 10%, чтобы сортировка шла редко
+        clean = sorted((k for k in self._hot if k not in self._dirty), key=lambda k: self._hot[k].touched)
+        excess = len(self._hot) - int(self.max_hot * 0.9)
+        for k in clean[:excess]:
+            del self._hot[k]
+
+    # --- BaseStorage ---
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._mark(key, record)
+
+    async def get_state(self, key: StorageKey):
+        return (await self._record(key)).state
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        record = await self._record(key)
+        record.data = data.copy()
+        self._mark(key, record)
+
+    async def get_data(self, key: StorageKey):
+        return (await self._record(key)).data.copy()
+
+    async def get_value(self, storage_key: StorageKey, dict_key: str, default=None):
+        return copy((await self._record(storage_key)).data.get(dict_key, default))
+
+    # --- Отложенная запись ---
+    async def flush(self):
+        if not self._dirty:
+            return 0
+        dirty, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for k in dirty:
+            record = self._hot.get(k)
+            if record is None or (record.state is None and not record.data):
+                deletes.append(_key(k))
+            else:
+                upserts.append((_key(k), record.state, json.dumps(record.data, ensure_ascii=False, default=str), record.touched))
+        try:
+            await self.db.flush_fsm(upserts, deletes)
+        except Exception:
+            self._dirty |= dirty
+            raise
+        self.flushes += 1
+        self._evict()
+        return len(dirty)
+
+    async def expire(self):
+        if not self.ttl:
+            return 0
+        before = time.time() - self.ttl
+        stale = [k for k, r in self._hot.items() if r.touched < before and k not in self._dirty]
+        for k in stale:
+            del self._hot[k]
+        return len(stale) + await self.db.expire_fsm(before)
+
+    async def _flush_loop(self):
+        last_expire = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - last_expire >= min(self.ttl, 3600):
+                    last_expire = time.monotonic()
+                    expired = await self.expire()
+                    if expired:
+                        logger.info("FSM: удалено %s заброшенных состояний", expired)
+            except Exception as e:
+                logger.error("FSM: ошибка записи состояний: %s: %s", type(e).__name__, e)
+
+    def stats(self):
+        return {"hot": len(self._hot), "dirty": len(self._dirty), "loads": self.loads, "flushes": self.flushes}
@@ -0,0 +1,178 @@
+import asyncio
+import heapq
+import logging
+import math
+import time
+from collections import deque
+
+from ratelimit import BULK
+
+logger = logging.getLogger(__name__)
+
+
+def _hidden():
+    """Запросы, которые выдают присутствие: отметки о прочтении и «печатает…»."""
+    from pyrogram import raw
+    return (
+        raw.functions.messages.ReadHistory,
+        raw.functions.channels.ReadHistory,
+        raw.functions.messages.ReadMessageContents,
+        raw.functions.channels.ReadMessageContents,
+        raw.functions.messages.ReadDiscussion,
+        raw.functions.messages.ReadMentions,
+        raw.functions.messages.ReadReactions,
+        raw.functions.messages.SetTyping,
+    )
+
+
+class GhostEngine:
+    """Призрачный режим всех аккаунтов одним таймером.
+
+    Для каждого живого клиента с включённым режимом в min-heap лежит срок
+    следующего account.updateStatus(offline=True). Сроки округляются до
+    tick секунд, поэтому тысячи аккаунтов будятся одними и теми же
+    пробуждениями: задача спит до ближайшего срока и обновляет пачкой всех,
+    чей срок наступил. Любой запрос клиента может показать аккаунт в сети,
+    поэтому после него статус повторяется через settle секунд, а не через
+    interval. Отметки о прочтении и «печатает…» в режиме не отправляются.
+    """
+
+    def __init__(self, db, peek, limiter=None, interval: float = 60, settle: float = 1.0, tick: float = 0.5,
+                 concurrency: int = 64):
+        self.db = db
+        self.peek = peek  # user_id -> живой клиент или None, без подъёма сессии
+        self.limiter = limiter
+        self.interval = interval
+        self.settle = settle
+        self.tick = tick
+        self.concurrency = concurrency
+        self._enabled = set()
+        self._heap = []
+        self._due = {}  # user_id -> актуальный срок; устаревшие записи heap пропускаются
+        self._wake = asyncio.Event()
+        self._task = None
+        self._updates = set()
+        self.wakeups = 0
+        self.refreshed = 0
+        self.suppressed = 0
+
+    def __contains__(self, user_id):
+        return user_id in self._enabled
+
+    # --- Клиенты ---
+    async def attach(self, user_id, client):
+        """Подключает новый клиент аккаунта: фильтр запросов и, если режим включён, срок."""
+        from pyrogram import raw
+
+        hidden = _hidden()
+        invoke = client.invoke
+
+        async def ghost_invoke(query, *args, **kwargs):
+            if user_id not in self._enabled:
+                return await invoke(query, *args, **kwargs)
+            if isinstance(query, hidden) or (isinstance(query, raw.functions.account.UpdateStatus)
+                                              and not query.offline):
+                self.suppressed += 1
+                return True
+            try:
+                return await invoke(query, *args, **kwargs)
+            finally:
+                if not isinstance(query, raw.functions.account.UpdateStatus):
+                    self._schedule(user_id, time.time() + self.settle)
+
+        client.invoke = ghost_invoke
+        if await self.db.get_ghost_mode(user_id):
+            self._enabled.add(user_id)
+            self._schedule(user_id, time.time())
+
+    async def set(self, user_id, enabled):
+        await self.db.set_ghost_mode(user_id, 1 if enabled else 0)
+        if not enabled:
+            self._enabled.discard(user_id)
+            self._due.pop(user_id, None)
+            return
+        self._enabled.add(user_id)
+        if self.peek(user_id) is not None:
+            self._schedule(user_id, time.time())
+
+    # --- Таймер ---
+    def _schedule(self, user_id, when):
+        """Ставит срок, если он раньше уже назначенного; округляется вверх до tick."""
+        when = math.ceil(when / self.tick) * self.tick
+        due = self._due.get(user_id)
+        if due is not None and due <= when:
+            return
+        self._due[user_id] = when
+        heapq.heappush(self._heap, (when, user_id))
+        if self._heap[0][1] == user_id:
+            self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is None or timeout > 0:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.wakeups += 1
+            now = time.time()
+            batch = []
+            while self._heap and self._heap[0][0] <= now:
+                due, user_id = heapq.heappop(self._heap)
+                if self._due.get(user_id) != due:
+                    continue
+                del self._due[user_id]
+                client = self.peek(user_id)
+                if client is None or user_id not in self._enabled:
+                    continue  # клиент отключен: срок появится при следующем подъёме
+                batch.append((user_id, client))
+                self._schedule(user_id, now + self.interval)
+            if batch:
+                task = asyncio.create_task(self._refresh(batch))
+                self._updates.add(task)
+                task.add_done_callback(self._updates.discard)
+
+    async def _refresh(self, batch):
+        # Пачку разбирают concurrency воркеров, а не задача на каждый аккаунт
+        pending = deque(batch)
+
+        async def worker():
+            while pending:
+                await self._offline(*pending.popleft())
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(pending)))))
+
+    async def _offline(self, user_id, client):
+        from pyrogram import raw
+
+        query = raw.functions.account.UpdateStatus(offline=True)
+        try:
+            if self.limiter is not None:
+                await self.limiter.call(user_id, client.invoke, query, priority=BULK)
+            else:
+                await client.invoke(query)
+            self.refreshed += 1
+        except Exception as e:
+            logger.warning("[User %s] Призрак: статус не обновлён: %s: %s", user_id, type(e).__name__, e)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._updates:
+            await asyncio.gather(*self._updates, return_exceptions=True)
+
+    def stats(self):
+        return {"enabled": len(self._enabled), "scheduled": len(self._due), "wakeups": self.wakeups,
+                "refreshed": self.refreshed, "suppressed": self.suppressed}
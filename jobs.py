@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """У пользователя уже max_queued задач в очереди."""
+
+
+class _Job:
+    __slots__ = ("name", "factory", "task")
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory  # () -> корутина задачи
+        self.task = None
+
+
+class JobQueue:
+    """Тяжёлые операции аккаунтов (очистка, рассылка, пересылка файлов) в фоне.
+
+    Обработчик апдейта только ставит задачу и сразу возвращается, поэтому
+    слоты webhook и ожидание апдейтов при перезапуске не заняты минутами.
+    Задачи одного пользователя выполняются строго по очереди, всего по
+    всем пользователям одновременно идёт не больше concurrency задач.
+    cancel() прерывает текущую задачу пользователя (CancelledError внутри
+    неё) и снимает ожидающие.
+    """
+
+    def __init__(self, concurrency: int = 8, max_queued: int = 5, metrics=None):
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self.metrics = metrics
+        self._slots = asyncio.Semaphore(concurrency)
+        self._queues = {}  # user_id -> deque ожидающих _Job
+        self._running = {}  # user_id -> выполняемая _Job
+        self._workers = {}  # user_id -> задача, разбирающая очередь пользователя
+        self.done = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def __len__(self):
+        return len(self._running)
+
+    def submit(self, user_id, name, factory):
+        """Ставит задачу в очередь пользователя; возвращает число задач перед ней.
+
+        0 — задача начнётся сразу, если свободен общий слот (см. busy()).
+        """
+        queue = self._queues.setdefault(user_id, deque())
+        ahead = len(queue) + (user_id in self._running)
+        if len(queue) >= self.max_queued:
+            raise QueueFull(f"в очереди уже {len(queue)} задач")
+        queue.append(_Job(name, factory))
+        if user_id not in self._workers:
+            self._workers[user_id] = asyncio.create_task(self._work(user_id))
+        return ahead
+
+    def busy(self):
+        """Все общие слоты заняты: новая задача подождёт чужие."""
+        return self._slots.locked()
+
+    async def _work(self, user_id):
+        queue = self._queues[user_id]
+        try:
+            while queue:
+                async with self._slots:
+                    # Пока ждали слот, очередь могли отменить: задача остаётся в ней до старта
+                    if not queue:
+                        break
+                    job = queue.popleft()
+                    self._running[user_id] = job
+                    job.task = asyncio.create_task(job.factory())
+                    started = time.perf_counter()
+                    try:
+                        await asyncio.shield(job.task)
+                        self.done += 1
+                    except asyncio.CancelledError:
+                        if not job.task.cancelled():
+                            raise  # отменили сам разбор очереди (остановка)
+                        self.cancelled += 1
+                        logger.info("[User %s] Задача «%s» отменена", user_id, job.name)
+                    except Exception as e:
+                        self.failed += 1
+                        logger.error("[User %s] Задача «%s» завершилась с ошибкой: %s: %s",
+                                     user_id, job.name, type(e).__name__, e)
+                    finally:
+                        self._running.pop(user_id, None)
+                    if self.metrics is not None:
+                        self.metrics.observe("job", job.name, time.perf_counter() - started)
+        finally:
+            # Синхронно с выходом из цикла: следующий submit запустит новый разбор
+            del self._queues[user_id]
+            del self._workers[user_id]
+
+    async def cancel(self, user_id):
+        """Отменяет текущую задачу и очередь пользователя; (название текущей или None, снято из очереди)."""
+        queue = self._queues.get(user_id)
+        dropped = len(queue) if queue else 0
+        if queue:
+            queue.clear()
+            self.cancelled += dropped
+        job = self._running.get(user_id)
+        if job is None or job.task is None:
+            return None, dropped
+        job.task.cancel()
+        # Ждём, пока задача доделает свои finally: после ответа пользователю она уже не работает
+        await asyncio.wait([job.task])
+        return job.name, dropped
+
+    async def join(self):
+        """Ждёт, пока очереди всех пользователей опустеют."""
+        while self._workers:
+            await asyncio.gather(*list(self._workers.values()), return_exceptions=True)
+
+    async def close(self):
+        """Отменяет все задачи при остановке бота."""
+        for queue in self._queues.values():
+            queue.clear()
+        tasks = [job.task for job in self._running.values() if job.task is not None]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
+        workers = list(self._workers.values())
+        if workers:
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "running": len(self._running),
+            "queued": sum(len(q) for q in self._queues.values()),
+            "max": self.concurrency,
+            "done": self.done,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+        }
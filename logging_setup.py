@@ -0,0 +1,96 @@
+import atexit
+import logging
+import queue
+import re
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Значения секретов маскируются в готовой строке: остаются первые 4 символа
+_SECRET_RE = re.compile(r"(?i)\b(phone_code_hash|api_hash|hash)(\s*[=:]\s*['\"]?)([A-Za-z0-9_\-]{4})[A-Za-z0-9_\-]*")
+
+
+def mask(value, keep: int = 4):
+    """'abcdef123456' → 'abcd***' для вывода секрета в лог."""
+    if not value:
+        return value
+    value = str(value)
+    return value[:keep] + "***"
+
+
+class RedactingFormatter(logging.Formatter):
+    def format(self, record):
+        text = _SECRET_RE.sub(r"\1\2\3***", super().format(record))
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" (ещё {suppressed} таких же сообщений подавлено)"
+        return text
+
+
+class RepeatFilter(logging.Filter):
+    """Ограничивает повторы предупреждений и ошибок.
+
+    Ключ — логгер и шаблон сообщения (до подстановки аргументов): за interval
+    секунд проходит не больше burst записей, остальные считаются и
+    упоминаются в первой записи следующего окна.
+    """
+
+    def __init__(self, interval: float = 60, burst: int = 5, max_keys: int = 10000):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.max_keys = max_keys
+        self._windows = {}  # ключ -> [начало окна, пропущено, подавлено]
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+        key = (record.name, record.msg if isinstance(record.msg, str) else type(record.msg))
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.interval:
+            if window is not None and window[2]:
+                record.suppressed = window[2]
+            if len(self._windows) >= self.max_keys:
+                self._windows.clear()
+            self._windows[key] = [now, 1, 0]
+            return True
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+
+class _LazyQueueHandler(QueueHandler):
+    # Стандартный prepare() форматирует запись в вызывающем потоке;
+    # здесь запись уходит как есть и форматируется в потоке QueueListener.
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level=logging.INFO):
+    """Логи пишутся в фоновом потоке; event loop только кладёт запись в очередь."""
+    records = queue.SimpleQueue()
+    output = logging.StreamHandler()
+    output.setFormatter(RedactingFormatter(LOG_FORMAT))
+    listener = QueueListener(records, output, respect_handler_level=True)
+
+    handler = _LazyQueueHandler(records)
+    handler.addFilter(RepeatFilter())
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener.start()
+
+    def stop():
+        # Повторный stop() у QueueListener падает, а остановить его могут и раньше
+        if listener._thread is not None:
+            listener.stop()
+
+    atexit.register(stop)
+    return listener
@@ -1,72 +1,95 @@
 import asyncio
 import logging
 import os
-import sqlite3
+import secrets
+import signal
 import sys
-from datetime import datetime
-from typing import Dict
+import time
+from datetime import datetime, timedelta
+
+STARTED = time.perf_counter()  # отсчёт для отчёта о холодном старте
 
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 
-from pyrogram import Client, errors, types as pyro_types
+from auth import LoginLimit, PendingLogins
+from broadcast import broadcast, format_report, parse_targets
+from cleanup import clear_history, recent_own
+from clients import ClientManager
+from db import Database
+from dialogs import KINDS, DialogIndex
+from export import export_history
+from fsm_storage import SQLiteStorage
+from ghost import GhostEngine
+from jobs import JobQueue, QueueFull
+from peers import PeerCache
+from ratelimit import AccountRateLimiter, BULK
+from relay import format_throughput, relay
+from scheduler import MessageScheduler
+from shards import ShardLink, ShardRouter
+from logging_setup import mask, setup_logging
+from metrics import HandlerTimingMiddleware, Metrics, MetricsServer
+from restart import UpdateTracker, load_snapshot, reexec, save_snapshot, since
+from webhook import WebhookServer
 
 # Настройка логирования
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+log_listener = setup_logging(os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 # --- Конфигурация ---
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 WORK_DIR = os.getenv("WORK_DIR", "/workspaces/telegram-management-bot/.bot_data/")
 DEVELOPERS = "YTSmailDog, SmailLabs"
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "4096"))
+CLIENT_IDLE_TIMEOUT = float(os.getenv("CLIENT_IDLE_TIMEOUT", "900"))
+MAX_LIVE_CLIENTS = int(os.getenv("MAX_LIVE_CLIENTS", "100"))
+AUTH_TIMEOUT = float(os.getenv("AUTH_TIMEOUT", "600"))
+AUTH_PENDING_MAX = int(os.getenv("AUTH_PENDING_MAX", "50"))
+ACCOUNT_RATE = float(os.getenv("ACCOUNT_RATE", "2"))
+ACCOUNT_BURST = int(os.getenv("ACCOUNT_BURST", "5"))
+ACCOUNT_CONCURRENCY = int(os.getenv("ACCOUNT_CONCURRENCY", "4"))
+BOT_MODE = os.getenv("BOT_MODE", "polling")  # polling | webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "100"))
+FSM_TTL = float(os.getenv("FSM_TTL", "86400"))
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(",", " ").split()}
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 — эндпоинт /metrics выключен
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "8"))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "5"))
+GHOST_INTERVAL = float(os.getenv("GHOST_INTERVAL", "60"))
+SCHEDULED_KEEP = float(os.getenv("SCHEDULED_KEEP", "604800"))
+PEER_TTL = float(os.getenv("PEER_TTL", "86400"))
+NOTES_PAGE = int(os.getenv("NOTES_PAGE", "8"))
+BOT_API_SERVER = os.getenv("BOT_API_SERVER")  # локальный Bot API: файлы больше 20 МБ
+BOT_API_LOCAL = os.getenv("BOT_API_LOCAL", "0") == "1"  # сервер запущен с --local и делит диск с ботом
+RELAY_TIMEOUT = float(os.getenv("RELAY_TIMEOUT", "3600"))
+EXPORT_DIR = os.path.join(WORK_DIR, "exports")
+EXPORT_SEND_MAX = (2000 if BOT_API_SERVER else 50) * 1024 * 1024  # больше — архив остаётся только в EXPORT_DIR
+SHARDS = int(os.getenv("SHARDS", "0"))  # больше 1 — фронт и столько процессов с аккаунтами
+RESTART_DRAIN_TIMEOUT = float(os.getenv("RESTART_DRAIN_TIMEOUT", "30"))
+RESTART_SNAPSHOT = os.path.join(WORK_DIR, "restart.json")
 
 # --- База данных ---
+metrics = Metrics()
+db = Database(os.path.join(WORK_DIR, 'bot_data.db'), cache_size=DB_CACHE_SIZE, metrics=metrics)
+
 def init_db():
-    if not os.path.exists(WORK_DIR): os.makedirs(WORK_DIR)
-    conn = sqlite3.connect(os.path.join(WORK_DIR, 'bot_data.db'))
-    cursor = conn.cursor()
-    cursor.execute('CREATE TABLE IF NOT EXISTS notes (id INTEGER PRIMARY KEY, user_id INTEGER, text TEXT)')
-    cursor.execute('CREATE TABLE IF NOT EXISTS scheduled_messages (id INTEGER PRIMARY KEY, user_id INTEGER, chat_id TEXT, text TEXT, send_at DATETIME)')
-    cursor.execute('CREATE TABLE IF NOT EXISTS ghost_mode (user_id INTEGER PRIMARY KEY, enabled INTEGER DEFAULT 0)')
-    cursor.execute('CREATE TABLE IF NOT EXISTS user_api (user_id INTEGER PRIMARY KEY, api_id INTEGER, api_hash TEXT)')
-    conn.commit()
-    conn.close()
-
-init_db()
-
-def get_user_api(user_id):
-    conn = sqlite3.connect(os.path.join(WORK_DIR, 'bot_data.db'))
-    cursor = conn.cursor()
-    cursor.execute("SELECT api_id, api_hash FROM user_api WHERE user_id = ?", (user_id,))
-    res = cursor.fetchone()
-    conn.close()
-    return res if res else (None, None)
-
-def save_user_api(user_id, api_id, api_hash):
-    conn = sqlite3.connect(os.path.join(WORK_DIR, 'bot_data.db'))
-    cursor = conn.cursor()
-    cursor.execute("INSERT OR REPLACE INTO user_api (user_id, api_id, api_hash) VALUES (?, ?, ?)", (user_id, api_id, api_hash))
-    conn.commit()
-    conn.close()
-
-def get_ghost_mode(user_id):
-    conn = sqlite3.connect(os.path.join(WORK_DIR, 'bot_data.db'))
-    cursor = conn.cursor()
-    cursor.execute("SELECT enabled FROM ghost_mode WHERE user_id = ?", (user_id,))
-    res = cursor.fetchone()
-    conn.close()
-    return res[0] if res else 0
-
-def set_ghost_mode(user_id, enabled):
-    conn = sqlite3.connect(os.path.join(WORK_DIR, 'bot_data.db'))
-    cursor = conn.cursor()
-    cursor.execute("INSERT OR REPLACE INTO ghost_mode (user_id, enabled) VALUES (?, ?)", (user_id, enabled))
-    conn.commit()
-    conn.close()
+    """Схема и соединение SQLite; вызывается один раз в main(), а не при импорте."""
+    started = time.perf_counter()
+    db.open()
+    metrics.observe("startup", "init_db", time.perf_counter() - started)
 
 # --- Состояния FSM ---
 class AuthStates(StatesGroup):
@@ -80,42 +103,86 @@ class ActionStates(StatesGroup):
     waiting_for_msg_target = State()
     waiting_for_msg_text = State()
     waiting_for_sticker_target = State()
+    waiting_for_media_target = State()
+    waiting_for_media = State()
     waiting_for_emoji_target = State()
     waiting_for_clear_target = State()
+    waiting_for_export_target = State()
     waiting_for_scheduled_target = State()
     waiting_for_scheduled_text = State()
     waiting_for_scheduled_time = State()
+    waiting_for_note_text = State()
+    waiting_for_note_query = State()
 
 # --- Глобальные объекты ---
-bot = Bot(token=BOT_TOKEN) if BOT_TOKEN else None
-dp = Dispatcher(storage=MemoryStorage())
-user_clients: Dict[int, Client] = {}
+shard = ShardLink.from_env()  # не None в процессе-шарде, запущенном фронтом
+bot_session = AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_SERVER, is_local=BOT_API_LOCAL)) if BOT_API_SERVER else None
+bot = Bot(token=BOT_TOKEN, session=bot_session) if BOT_TOKEN else None
+fsm_storage = SQLiteStorage(db, ttl=FSM_TTL)
+dp = Dispatcher(storage=fsm_storage)
+updates = UpdateTracker()
+dp.update.outer_middleware(updates)
+dp.message.middleware(HandlerTimingMiddleware(metrics))
+dp.callback_query.middleware(HandlerTimingMiddleware(metrics))
+user_clients = ClientManager(WORK_DIR, db, idle_timeout=CLIENT_IDLE_TIMEOUT, max_clients=MAX_LIVE_CLIENTS)
+limiter = AccountRateLimiter(rate=ACCOUNT_RATE, burst=ACCOUNT_BURST, metrics=metrics, concurrency=ACCOUNT_CONCURRENCY)
+peer_cache = PeerCache(db, limiter, ttl=PEER_TTL)
+dialog_index = DialogIndex(db, limiter, peers=peer_cache)
+ghost = GhostEngine(db, user_clients.peek, limiter=limiter, interval=GHOST_INTERVAL)
+jobs = JobQueue(concurrency=JOB_CONCURRENCY, max_queued=JOB_QUEUE_MAX, metrics=metrics)
+
+async def on_new_client(user_id, client):
+    await ghost.attach(user_id, client)
+    await dialog_index.attach(user_id, client)
+
+user_clients.on_client = on_new_client
+
+async def new_login_client(user_id, api_id, api_hash, phone):
+    # Новый вход заменяет старую сессию аккаунта
+    await user_clients.drop(user_id)
+    session_path = user_clients.session_path(user_id)
+    if os.path.exists(session_path): os.remove(session_path)
+    # Первый клиент процесса импортирует Pyrogram
+    return user_clients.create(
+        user_id,
+        api_id,
+        api_hash,
+        phone_number=phone,
+        in_memory=False,
+        test_mode=False  # Убедимся что не в тестовом режиме
+    )
+
+auth_logins = PendingLogins(new_login_client, session_path=user_clients.session_path,
+                            timeout=AUTH_TIMEOUT, max_pending=AUTH_PENDING_MAX)
+user_clients.pending = auth_logins
+scheduler = MessageScheduler(db, user_clients.get, limiter=limiter, peers=peer_cache,
+                             shard=(shard.index, shard.count) if shard else None, keep=SCHEDULED_KEEP)
+webhook_stop = asyncio.Event()
+restart_request = None  # {"chat_id", "requested_at"} после нажатия «🔄 Перезапуск»
 
 # --- Клавиатуры ---
-def get_main_kb():
-    buttons = [
-        [KeyboardButton(text="📱 Аккаунт"), KeyboardButton(text="📝 Заметки")],
-        [KeyboardButton(text="✉️ Сообщение"), KeyboardButton(text="🕒 Отложенное")],
-        [KeyboardButton(text="📸 История"), KeyboardButton(text="📢 Каналы")],
-        [KeyboardButton(text="👻 Призрак"), KeyboardButton(text="🎭 Стикеров")],
-        [KeyboardButton(text="😀 Эмодзи"), KeyboardButton(text="🧹 Очистка")],
-        [KeyboardButton(text="🔄 Перезапуск")]
-    ]
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
-
-def get_auth_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔐 Начать авторизацию", callback_data="start_auth")],
-        [InlineKeyboardButton(text="Получить токен (my.telegram.org)", url="http://my.telegram.org")]
-    ])
+# Неизменные клавиатуры строятся один раз при импорте
+MAIN_KB = ReplyKeyboardMarkup(keyboard=[
+    [KeyboardButton(text="📱 Аккаунт"), KeyboardButton(text="📝 Заметки")],
+    [KeyboardButton(text="✉️ Сообщение"), KeyboardButton(text="🕒 Отложенное")],
+    [KeyboardButton(text="📸 История"), KeyboardButton(text="📢 Каналы")],
+    [KeyboardButton(text="👻 Призрак"), KeyboardButton(text="🎭 Стикеров")],
+    [KeyboardButton(text="😀 Эмодзи"), KeyboardButton(text="🧹 Очистка")],
+    [KeyboardButton(text="📦 Экспорт"), KeyboardButton(text="🔄 Перезапуск")]
+], resize_keyboard=True)
 
-def get_code_type_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_auth")]
-    ])
+AUTH_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🔐 Начать авторизацию", callback_data="start_auth")],
+    [InlineKeyboardButton(text="Получить токен (my.telegram.org)", url="http://my.telegram.org")]
+])
 
-def get_ghost_kb(user_id):
-    enabled = get_ghost_mode(user_id)
+CODE_TYPE_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="↻ Повторная отправка", callback_data="resend_code")],
+    [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_auth")]
+])
+
+async def get_ghost_kb(user_id):
+    enabled = await db.get_ghost_mode(user_id)
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="✅ Включить" if not enabled else "🟢 Включено", callback_data="ghost_on")],
         [InlineKeyboardButton(text="❌ Выключить" if enabled else "🔴 Выключено", callback_data="ghost_off")]
@@ -129,15 +196,72 @@ async def cmd_start(message: types.Message, state: FSMContext):
     user_name = message.from_user.first_name or "Друже"
     await message.answer(
         f"👋 Добро пожаловать, {user_name}!\nВыберите функцию из меню ниже.\n\nЕсли нужен токен или доступ к API — используйте команду /token или кнопку 'Получить токен (my.telegram.org)'.",
-        reply_markup=get_main_kb()
+        reply_markup=MAIN_KB
     )
-    logger.info(f"Пользователь {message.from_user.id} ({user_name}) запустил бота")
+    logger.info("Пользователь %s (%s) запустил бота", message.from_user.id, user_name)
+
+@dp.message(Command("cancel"))
+async def cmd_cancel(message: types.Message, state: FSMContext):
+    # Регистрируется раньше обработчиков состояний: иначе /cancel примут за ввод
+    await state.clear()
+    name, dropped = await jobs.cancel(message.from_user.id)
+    if name is None and not dropped:
+        return await message.answer("Нечего отменять.", reply_markup=MAIN_KB)
+    text = f"⛔ Отменено: {name}" if name else "⛔ Очередь задач очищена"
+    if dropped: text += f"\nСнято из очереди: {dropped}"
+    await message.answer(text, reply_markup=MAIN_KB)
+
+async def edit_quietly(progress: types.Message, text):
+    """Правит сообщение о ходе задачи; ошибка правки (не изменилось, удалено) не мешает задаче."""
+    try: await progress.edit_text(text)
+    except Exception: pass
+
+def throttled_editor(progress: types.Message, interval: float = 2):
+    """edit(text) для сообщения о ходе задачи: одно сообщение правится на месте.
+
+    Правки чаще раза в interval секунд пропускаются, чтобы не упереться в
+    лимиты Bot API; ошибка правки задачу не прерывает.
+    """
+    last_edit = float("-inf")
+
+    async def edit(text):
+        nonlocal last_edit
+        now = asyncio.get_running_loop().time()
+        if now - last_edit < interval: return
+        last_edit = now
+        await edit_quietly(progress, text)
+
+    return edit
+
+async def start_job(message: types.Message, name, job, *args, user_id=None):
+    """Ставит тяжёлую операцию в очередь пользователя; обработчик сразу освобождается.
+
+    job(message, client, *args) получает клиента при старте, а не при
+    постановке: пока задача ждала в очереди, прежний клиент могли отключить.
+    До конца задачи клиент закреплён и не отключается по простою.
+    """
+    user_id = user_id or message.from_user.id
+
+    async def run():
+        async with user_clients.use(user_id) as client:
+            if client is None:
+                return await message.answer("Авторизуйтесь!")
+            await job(message, client, *args)
+
+    try:
+        ahead = jobs.submit(user_id, name, run)
+    except QueueFull:
+        return await message.answer(f"⏳ У вас уже {JOB_QUEUE_MAX} задач в очереди. Дождитесь их или отмените: /cancel")
+    if ahead:
+        await message.answer(f"⏳ {name}: в очереди, перед ней {ahead}. Отмена: /cancel")
+    elif jobs.busy():
+        await message.answer(f"⏳ {name}: начнётся, когда освободится место. Отмена: /cancel")
 
 @dp.callback_query(F.data == "start_auth")
 async def start_auth(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
     user_id = callback.from_user.id
-    api_id, api_hash = get_user_api(user_id)
+    api_id, api_hash = await db.get_user_api(user_id)
     
     if api_id and api_hash:
         # Используем сохраненные значения
@@ -155,6 +279,27 @@ async def start_auth(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
+@dp.message(Command("stats"))
+async def cmd_stats(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS: return
+    scheduled = (f"в очереди {len(scheduler)}, отправлено {scheduler.sent}, ошибок {scheduler.failed}, "
+                 f"удалено завершённых {scheduler.purged}")
+    text = (
+        f"📊 Статистика\n\n{metrics.render_text() or 'Пока нет данных'}\n\n"
+        f"[limiter] {limiter.stats()}\n"
+        f"[clients] {user_clients.stats()}\n"
+        f"[auth] {auth_logins.stats()}\n"
+        f"[fsm] {fsm_storage.stats()}\n"
+        f"[cache] {db.cache_stats()}\n"
+        f"[peers] {peer_cache.stats()}\n"
+        f"[dialogs] {dialog_index.stats()}\n"
+        f"[ghost] {ghost.stats()}\n"
+        f"[jobs] {jobs.stats()}\n"
+        f"[scheduled] {scheduled}"
+        + (f"\n[shard] {shard.index + 1} из {shard.count}" if shard else "")
+    )
+    await message.answer(text[:4000])
+
 @dp.message(Command("token"))
 async def cmd_token(message: types.Message):
     kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -182,8 +327,8 @@ async def process_api_id(message: types.Message, state: FSMContext):
     
     user_id = message.from_user.id
     api_id = int(api_id_str)
-    save_user_api(user_id, api_id, api_hash)
-    logger.info(f"[User {user_id}] Сохранены API ID: {api_id}, API Hash: {api_hash[:10]}...")
+    await db.save_user_api(user_id, api_id, api_hash)
+    logger.info("[User %s] Сохранены API ID: %s, API Hash: %s", user_id, api_id, mask(api_hash))
     
     await state.update_data(api_id=api_id_str, api_hash=api_hash)
     await message.answer("Введите номер телефона (+7...):")
@@ -196,10 +341,6 @@ async def process_phone(message: types.Message, state: FSMContext):
     if not phone.startswith('+'): phone = '+' + phone
     user_id = message.from_user.id
     
-    # Очистка старой сессии
-    session_path = os.path.join(WORK_DIR, f"session_{user_id}.session")
-    if os.path.exists(session_path): os.remove(session_path)
-    
     try:
         api_id = int(data['api_id'])
     except (ValueError, KeyError):
@@ -207,74 +348,46 @@ async def process_phone(message: types.Message, state: FSMContext):
         await state.clear()
         return
     
-    client = Client(
-        name=f"session_{user_id}",
-        api_id=api_id,
-        api_hash=data['api_hash'],
-        phone_number=phone,
-        workdir=WORK_DIR,
-        in_memory=False,
-        test_mode=False  # Убедимся что не в тестовом режиме
-    )
-    
     try:
-        logger.info(f"[{phone}] Подключение к Telegram...")
-        await client.connect()
-        logger.info(f"[{phone}] ✅ Подключено. Отправляю код...")
+        # Повторный запрос кода на тот же номер идёт через уже открытое соединение
+        logger.info("[%s] Подключение к Telegram...", user_id)
+        with metrics.timer("rpc", "connect"):
+            client = await auth_logins.begin(user_id, api_id, data['api_hash'], phone)
         await message.answer(f"⏳ Подключено. Отправляю код на {phone}...")
         
         # send_code отправляет код на номер телефона
-        logger.info(f"[{phone}] Вызов send_code()...")
-        sent_code = await client.send_code(phone)
+        with metrics.timer("rpc", "send_code"):
+            sent_code = await client.send_code(phone)
         
-        logger.info(f"[{phone}] ✅ send_code() успешен!")
-        logger.info(f"[{phone}] sent_code тип: {type(sent_code).__name__}")
-        logger.info(f"[{phone}] sent_code атрибуты: {dir(sent_code)}")
-        logger.info(f"[{phone}] sent_code.__dict__: {sent_code.__dict__ if hasattr(sent_code, '__dict__') else 'NO DICT'}")
+        # Подробная трассировка авторизации — только при LOG_LEVEL=DEBUG
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[%s] send_code(): %s %s", user_id, type(sent_code).__name__,
+                         {k: v for k, v in getattr(sent_code, '__dict__', {}).items() if k != 'phone_code_hash'})
         
         # Получаем hash - может быть в разных местах
-        if hasattr(sent_code, 'phone_code_hash'):
-            phone_code_hash = sent_code.phone_code_hash
-            logger.info(f"[{phone}] 📦 Hash тип: {type(phone_code_hash).__name__}")
-            logger.info(f"[{phone}] 📦 Hash значение: {phone_code_hash}")
-            logger.info(f"[{phone}] 📦 Hash len: {len(phone_code_hash)}")
-            logger.info(f"[{phone}] 📦 Hash repr: {repr(phone_code_hash)}")
-            
-            # Проверяем есть ли это hex
-            if isinstance(phone_code_hash, str):
-                logger.info(f"[{phone}] 📦 Hash is string - декодируем...")
-                # Пробуем декодировать как hex/bytes
-                try:
-                    decoded = bytes.fromhex(phone_code_hash)
-                    logger.info(f"[{phone}] 📦 Decoded bytes len: {len(decoded)}")
-                except:
-                    logger.info(f"[{phone}] 📦 Не hex - это просто строка")
+        phone_code_hash = getattr(sent_code, 'phone_code_hash', None)
+        if phone_code_hash:
+            logger.debug("[%s] phone_code_hash=%s (len=%s)", user_id, mask(phone_code_hash), len(phone_code_hash))
         else:
-            logger.error(f"[{phone}] ❌ НЕТ .phone_code_hash в sent_code!")
-            phone_code_hash = None
+            logger.error("[%s] ❌ НЕТ .phone_code_hash в sent_code!", user_id)
         
         # Получаем тип кода
         code_type = getattr(sent_code, 'type', None)
         type_name = getattr(code_type, 'name', str(code_type)) if code_type else 'UNKNOWN'
-        logger.info(f"[{phone}] Тип кода: {type_name}")
+        logger.info("[%s] ✅ Код отправлен, тип: %s", user_id, type_name)
 
         if not phone_code_hash:
             await message.answer("❌ Ошибка: не получен hash кода. Попробуйте заново: /start")
             await state.clear()
-            try:
-                await client.disconnect()
-            except:
-                pass
+            await auth_logins.cancel(user_id)
             return
 
-        # Сохраняем данные
-        user_clients[user_id] = client
-        logger.info(f"[{user_id}] Сохранены данные: phone={phone}, hash_len={len(phone_code_hash)}")
-        
+        # Сохраняем данные; клиент остаётся во входах до sign_in
         await state.update_data(
             phone=phone,
             phone_code_hash=phone_code_hash,
-            code_type=type_name
+            code_type=type_name,
+            attempts=0
         )
 
         dest_text = "SMS" if type_name and "SMS" in type_name.upper() else "в приложении Telegram" if type_name and "APP" in type_name.upper() else "по номеру телефона"
@@ -286,18 +399,18 @@ async def process_phone(message: types.Message, state: FSMContext):
             f"• Проверьте входящие уведомления\n"
             f"• Код будет выглядеть как: XXXX\n\n"
             f"📝 Введите полученный код:",
-            reply_markup=get_code_type_kb()
+            reply_markup=CODE_TYPE_KB
         )
         await state.set_state(AuthStates.waiting_for_code)
+    except LoginLimit as e:
+        logger.warning("[%s] Вход отклонён: %s", user_id, e)
+        await message.answer("⏳ Сейчас слишком много незавершённых входов. Попробуйте через пару минут: /start")
+        await state.clear()
     except Exception as e:
         err_name = type(e).__name__
         err_msg = str(e)
-        logger.error(f"[{phone}] ❌ {err_name}: {err_msg}")
-        logger.error(f"[{phone}] Полная ошибка: {repr(e)}")
-        try:
-            await client.disconnect()
-        except:
-            pass
+        logger.error("[%s] ❌ Ошибка отправки кода: %s: %s", user_id, err_name, err_msg)
+        await auth_logins.cancel(user_id)
         
         # Определяем помощь в зависимости от ошибки
         help_text = ""
@@ -321,20 +434,22 @@ async def process_phone(message: types.Message, state: FSMContext):
 
 @dp.message(AuthStates.waiting_for_code)
 async def process_code(message: types.Message, state: FSMContext):
+    from pyrogram import errors
+
     data = await state.get_data()
-    client = user_clients.get(message.from_user.id)
-    if not client or not client.is_connected: 
-        logger.error(f"[User {message.from_user.id}] Клиент не подключен при вводе кода")
+    client = auth_logins.get(message.from_user.id)
+    if not client: 
+        logger.error("[User %s] Клиент не подключен при вводе кода", message.from_user.id)
         return await message.answer("❌ Ошибка: сессия потеряна. Начните заново: /start")
     
     import re
     raw_input = message.text.strip()
     code = raw_input.replace(" ", "").replace("-", "").replace("(", "").replace(")", "").replace("/", "")
-    logger.info(f"[{message.from_user.id}] Ввод кода: raw='{raw_input}' → cleaned='{code}'")
+    logger.debug("[%s] Ввод кода: %s символов", message.from_user.id, len(code))
     
     # Код может быть 4-10 символов (цифры/буквы)
     if not re.match(r'^[A-Za-z0-9]{4,10}$', code):
-        logger.warning(f"[{message.from_user.id}] ❌ Код не прошел валидацию: '{code}' (4-10 буквенно-цифровых)")
+        logger.warning("[%s] ❌ Код не прошел валидацию (%s символов)", message.from_user.id, len(code))
         return await message.answer(
             "❌ Неверный формат кода.\n"
             "Код должен содержать 4–10 букв и/или цифр.\n\n"
@@ -347,71 +462,56 @@ async def process_code(message: types.Message, state: FSMContext):
         phone_code_hash = data.get('phone_code_hash', '')
         
         if not phone or not phone_code_hash:
-            logger.error(f"[{message.from_user.id}] ❌ Критические данные не сохранены!")
-            logger.error(f"[{message.from_user.id}] phone={phone}, phone_code_hash={'SET' if phone_code_hash else 'NOT_SET'}")
+            logger.error("[%s] ❌ Критические данные не сохранены: phone=%s, phone_code_hash=%s",
+                         message.from_user.id, 'SET' if phone else 'NOT_SET', 'SET' if phone_code_hash else 'NOT_SET')
             return await message.answer("❌ Ошибка сессии: потеряны данные авторизации. /start")
         
-        logger.info(f"[{message.from_user.id}] ========== ПОПЫТКА ВХОДА ==========")
-        logger.info(f"[{message.from_user.id}] Телефон: {phone}")
-        logger.info(f"[{message.from_user.id}] Hash: {phone_code_hash} (len={len(phone_code_hash)})")
-        logger.info(f"[{message.from_user.id}] Код: {code} (len={len(code)})")
-        logger.info(f"[{message.from_user.id}] Клиент подключен: {client.is_connected}")
-        logger.info(f"[{message.from_user.id}] ======================================")
+        logger.debug("[%s] Попытка входа: phone_code_hash=%s, код %s символов, клиент подключен: %s",
+                     message.from_user.id, mask(phone_code_hash), len(code), client.is_connected)
         
         # Переподключаемся если клиент отключился
         if not client.is_connected:
-            logger.warning(f"[{message.from_user.id}] ⚠️  Клиент отключился, переподключаем...")
+            logger.warning("[%s] ⚠️  Клиент отключился, переподключаем...", message.from_user.id)
             await client.connect()
-            logger.info(f"[{message.from_user.id}] ✅ Переподключили клиент")
         
-        logger.info(f"[{message.from_user.id}] 📤 Отправляем sign_in с параметрами...")
-        result = await client.sign_in(
-            phone_number=phone,
-            phone_code_hash=phone_code_hash,
-            phone_code=code
-        )
-        logger.info(f"[{message.from_user.id}] ✅ sign_in() вернул результат: {type(result).__name__}")
-        logger.info(f"[{message.from_user.id}] ✅✅✅ ВХОД УСПЕШЕН! ✅✅✅")
-        logger.info(f"[{message.from_user.id}] Тип результата: {type(result).__name__}")
-        logger.info(f"[{message.from_user.id}] Пользователь: {result.first_name} {result.last_name or ''}")
+        with metrics.timer("rpc", "sign_in"):
+            result = await client.sign_in(
+                phone_number=phone,
+                phone_code_hash=phone_code_hash,
+                phone_code=code
+            )
+        logger.info("[%s] ✅ Вход успешен (%s)", message.from_user.id, type(result).__name__)
+        await complete_login(message.from_user.id)
 
         await message.answer(
             "✅ Вы успешно авторизованы!\n"
             "Теперь можете использовать все функции бота.",
-            reply_markup=get_main_kb()
+            reply_markup=MAIN_KB
         )
         await state.clear()
     except errors.SessionPasswordNeeded:
-        logger.info(f"[User {message.from_user.id}] Требуется 2FA пароль")
+        logger.info("[User %s] Требуется 2FA пароль", message.from_user.id)
         await message.answer(
             "🔐 На аккаунте включена двухфакторная аутентификация.\n"
             "Введите ваш пароль:"
         )
         await state.set_state(AuthStates.waiting_for_password)
     except errors.PhoneNumberInvalid:
-        logger.error(f"Неверный номер телефона: {data.get('phone')}")
+        logger.error("[User %s] Неверный номер телефона", message.from_user.id)
         await message.answer("❌ Неверный номер телефона. Начните заново: /start")
         await state.clear()
     except errors.PhoneCodeInvalid as e:
-        logger.warning(f"[{message.from_user.id}] ======================================")
-        logger.warning(f"[{message.from_user.id}] ❌ ОШИБКА: PhoneCodeInvalid")
-        logger.warning(f"[{message.from_user.id}] ======================================")
-        logger.warning(f"[{message.from_user.id}] Введенный код: '{code}'")
-        logger.warning(f"[{message.from_user.id}] Длина кода: {len(code)}")
-        logger.warning(f"[{message.from_user.id}] Телефон из state: {data.get('phone')}")
-        logger.warning(f"[{message.from_user.id}] Hash из state: {data.get('phone_code_hash', 'NOT_SET')[:15]}...")
-        logger.warning(f"[{message.from_user.id}] Клиент подключен: {client.is_connected if client else 'NO CLIENT'}")
-        logger.warning(f"[{message.from_user.id}] Исходная ошибка Pyrogram: {str(e)[:200]}")
-        logger.warning(f"[{message.from_user.id}] Полный traceback: {repr(e)}")
-        logger.warning(f"[{message.from_user.id}] ======================================")
+        logger.warning("[%s] ❌ PhoneCodeInvalid: %s", message.from_user.id, e)
         attempts = (await state.get_data()).get('attempts', 0) + 1
         await state.update_data(attempts=attempts)
         if attempts >= 3:
+            # Соединение остаётся: новый код на тот же номер придёт без переподключения
             await message.answer(
                 "❌ 3 неверных кода подряд.\n"
-                "Попросите новый код: /start"
+                "Попросите новый код кнопкой '↻ Повторная отправка' или /start",
+                reply_markup=CODE_TYPE_KB
             )
-            await state.clear()
+            await state.set_state(AuthStates.waiting_for_code_type)
         else:
             remaining = 3 - attempts
             await message.answer(
@@ -422,13 +522,14 @@ async def process_code(message: types.Message, state: FSMContext):
                 f"Переотправьте код или попробуйте еще раз:"
             )
     except errors.CodeExpired as e:
-        logger.warning(f"[{message.from_user.id}] ⏰ Код истёк: {e}")
+        logger.warning("[%s] ⏰ Код истёк: %s", message.from_user.id, e)
         await message.answer(
             "⏰ Код истёк\n\n"
-            "Нажмите '↻ Повторная отправка' для получения нового кода."
+            "Нажмите '↻ Повторная отправка' для получения нового кода.",
+            reply_markup=CODE_TYPE_KB
         )
     except errors.BadRequest as e:
-        logger.error(f"[{message.from_user.id}] BadRequest при sign_in: {e}")
+        logger.error("[%s] BadRequest при sign_in: %s", message.from_user.id, e)
         await message.answer(
             f"❌ Ошибка запроса: {str(e)[:80]}\n\n"
             "Начните заново: /start"
@@ -438,13 +539,7 @@ async def process_code(message: types.Message, state: FSMContext):
         err_name = type(e).__name__
         err_msg = str(e)
         err_module = type(e).__module__
-        logger.error(f"[{message.from_user.id}] ⚠️  EXCEPTION: {err_module}.{err_name}")
-        logger.error(f"[{message.from_user.id}] Сообщение: {err_msg}")
-        logger.error(f"[{message.from_user.id}] Тип ошибки: {type(e)}")
-        logger.error(f"[{message.from_user.id}] repr: {repr(e)}")
-        logger.error(f"[{message.from_user.id}] args: {e.args if hasattr(e, 'args') else 'NO ARGS'}")
-        import traceback
-        logger.error(f"[{message.from_user.id}] Traceback:\n{traceback.format_exc()}")
+        logger.error("[%s] ⚠️  %s.%s при sign_in: %s", message.from_user.id, err_module, err_name, err_msg, exc_info=True)
         
         await message.answer(
             f"❌ Ошибка система: {err_name}\n\n"
@@ -453,27 +548,56 @@ async def process_code(message: types.Message, state: FSMContext):
             f"Попробуйте: /start"
         )
 
+@dp.message(AuthStates.waiting_for_code_type)
+async def code_attempts_spent(message: types.Message):
+    # После 3 неверных кодов этот код больше не проверяется: нужен новый
+    await message.answer(
+        "❌ Попытки ввода этого кода исчерпаны.\n"
+        "Попросите новый код кнопкой '↻ Повторная отправка' или начните заново: /start",
+        reply_markup=CODE_TYPE_KB
+    )
+
+async def start_updates(client):
+    """Диспетчер апдейтов Pyrogram запускает только initialize(): без него
+    обработчики клиента (индекс диалогов) молчат до следующего подъёма сессии."""
+    if not client.is_initialized:
+        await client.initialize()
+
+async def complete_login(user_id):
+    """Переносит клиента вошедшего аккаунта из незавершённых входов в пул."""
+    client = auth_logins.finish(user_id)
+    # Вход может быть в другой аккаунт: его access hash и диалоги не совпадут с сохранёнными
+    await peer_cache.forget(user_id)
+    await dialog_index.forget(user_id)
+    await user_clients.set(user_id, client)
+    await start_updates(client)
+
 @dp.message(AuthStates.waiting_for_password)
 async def process_password(message: types.Message, state: FSMContext):
-    client = user_clients.get(message.from_user.id)
+    from pyrogram import errors
+
+    client = auth_logins.get(message.from_user.id)
     if not client or not client.is_connected:
         logger.error("Клиент не подключен при проверке пароля")
         return await message.answer("❌ Ошибка сессии. /start")
     
     try:
-        result = await client.check_password(message.text.strip())
-        logger.info(f"Пользователь {message.from_user.id} прошел 2FA. Результат: {type(result).__name__}")
-        await message.answer("✅ Авторизовано успешно! 2FA пройдена.", reply_markup=get_main_kb())
+        with metrics.timer("rpc", "check_password"):
+            result = await client.check_password(message.text.strip())
+        logger.info("Пользователь %s прошел 2FA. Результат: %s", message.from_user.id, type(result).__name__)
+        await complete_login(message.from_user.id)
+        await message.answer("✅ Авторизовано успешно! 2FA пройдена.", reply_markup=MAIN_KB)
         await state.clear()
     except errors.PasswordHashInvalid:
-        logger.warning(f"Неверный пароль для {message.from_user.id}")
+        logger.warning("Неверный пароль для %s", message.from_user.id)
         await message.answer("❌ Неверный пароль 2FA. Попробуйте еще раз:")
     except errors.PasswordEmpty:
-        logger.warning(f"Пароль не установлен для {message.from_user.id}")
+        logger.warning("Пароль не установлен для %s", message.from_user.id)
         await message.answer("❌ На аккаунте не установлен пароль 2FA, но требуется. Попробуйте с начала.")
         await state.clear()
+        await auth_logins.cancel(message.from_user.id)
     except Exception as e: 
-        logger.error(f"Ошибка 2FA: {type(e).__name__}: {e}")
+        logger.error("Ошибка 2FA: %s: %s", type(e).__name__, e)
         await message.answer(f"❌ Ошибка: {str(e)[:100]}")
         await state.clear()
 
@@ -481,94 +605,587 @@ async def process_password(message: types.Message, state: FSMContext):
 
 @dp.message(F.text == "📱 Аккаунт")
 async def account_info(message: types.Message):
-    client = user_clients.get(message.from_user.id)
-    if not client or not client.is_connected: return await message.answer("Вы не авторизованы.", reply_markup=get_auth_kb())
-    me = await client.get_me()
+    client = await user_clients.get(message.from_user.id)
+    if not client or not client.is_connected: return await message.answer("Вы не авторизованы.", reply_markup=AUTH_KB)
+    me = await limiter.call(message.from_user.id, client.get_me)
     await message.answer(f"👤 Аккаунт: {me.first_name}\nID: `{me.id}`\nРазработчики: {DEVELOPERS}", parse_mode="Markdown", 
                          reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🚪 Выход", callback_data="logout")]]))
 
 @dp.callback_query(F.data == "logout")
 async def logout(callback: types.CallbackQuery):
     uid = callback.from_user.id
-    if uid in user_clients:
-        try: await user_clients[uid].log_out()
+    client = await user_clients.get(uid)
+    if client:
+        user_clients.pop(uid)
+        try: await client.log_out()
         except: pass
-        del user_clients[uid]
-    await callback.message.answer("Вышли.", reply_markup=get_auth_kb())
+    await peer_cache.forget(uid)
+    await dialog_index.forget(uid)
+    await callback.message.answer("Вышли.", reply_markup=AUTH_KB)
     await callback.answer()
 
 @dp.message(F.text == "👻 Призрак")
 async def ghost_menu(message: types.Message):
-    await message.answer("Управление призрачным режимом:", reply_markup=get_ghost_kb(message.from_user.id))
+    await message.answer("Управление призрачным режимом:", reply_markup=await get_ghost_kb(message.from_user.id))
 
 @dp.callback_query(F.data.startswith("ghost_"))
 async def ghost_toggle(callback: types.CallbackQuery):
-    enabled = 1 if callback.data == "ghost_on" else 0
-    set_ghost_mode(callback.from_user.id, enabled)
-    await callback.message.edit_reply_markup(reply_markup=get_ghost_kb(callback.from_user.id))
+    await ghost.set(callback.from_user.id, callback.data == "ghost_on")
+    await callback.message.edit_reply_markup(reply_markup=await get_ghost_kb(callback.from_user.id))
     await callback.answer("Статус изменен")
 
 
 @dp.callback_query(F.data == "cancel_auth")
 async def cancel_auth(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
-    await callback.message.answer("❌ Авторизация отменена.", reply_markup=get_auth_kb())
+    await auth_logins.cancel(callback.from_user.id)
+    await callback.message.answer("❌ Авторизация отменена.", reply_markup=AUTH_KB)
     await callback.answer()
 
 
 @dp.callback_query(F.data == "resend_code")
 async def handle_resend_code(callback: types.CallbackQuery, state: FSMContext):
-    await callback.answer("Повторная отправка кода временно отключена.\nПопробуйте /start заново.", show_alert=True)
+    user_id = callback.from_user.id
+    data = await state.get_data()
+    client = auth_logins.get(user_id)
+    if not client or not data.get('phone_code_hash'):
+        return await callback.answer("Вход не найден или истёк. Начните заново: /start", show_alert=True)
+    try:
+        with metrics.timer("rpc", "resend_code"):
+            sent_code = await client.resend_code(data['phone'], data['phone_code_hash'])
+    except Exception as e:
+        logger.warning("[%s] Повторная отправка кода не удалась: %s: %s", user_id, type(e).__name__, e)
+        return await callback.answer(f"❌ Не удалось отправить код: {str(e)[:100]}\nПопробуйте /start", show_alert=True)
+    code_type = getattr(sent_code, 'type', None)
+    type_name = getattr(code_type, 'name', str(code_type)) if code_type else 'UNKNOWN'
+    logger.info("[%s] ✅ Код отправлен повторно, тип: %s", user_id, type_name)
+    await state.update_data(phone_code_hash=sent_code.phone_code_hash, code_type=type_name, attempts=0)
+    await state.set_state(AuthStates.waiting_for_code)
+    await callback.message.answer("✅ Новый код отправлен. 📝 Введите его:", reply_markup=CODE_TYPE_KB)
+    await callback.answer()
 
 
 @dp.callback_query(F.data.in_(["code_sms", "code_call", "code_app"]))
 async def handle_code_type_selection(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer("Просто введите код из Telegram App", show_alert=False)
 
+def get_clear_mode_kb():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Последние 100", callback_data="clear_recent")],
+        [InlineKeyboardButton(text="Вся история", callback_data="clear_all")]
+    ])
+
 @dp.message(F.text == "🧹 Очистка")
 async def clear_start(message: types.Message, state: FSMContext):
-    await message.answer("Введите ID/username чата для очистки (удалит последние 100 ваших сообщений):")
+    await message.answer("Что удалить?", reply_markup=get_clear_mode_kb())
+
+@dp.callback_query(F.data.in_(["clear_recent", "clear_all"]))
+async def clear_mode(callback: types.CallbackQuery, state: FSMContext):
+    full = callback.data == "clear_all"
+    await state.update_data(clear_full=full)
+    if full:
+        await callback.message.answer("Введите ID/username чата для очистки (удалит все ваши сообщения; прерванная очистка продолжится с места остановки):")
+    else:
+        await callback.message.answer("Введите ID/username чата для очистки (удалит последние 100 ваших сообщений):")
     await state.set_state(ActionStates.waiting_for_clear_target)
+    await callback.answer()
 
 @dp.message(ActionStates.waiting_for_clear_target)
 async def clear_process(message: types.Message, state: FSMContext):
-    client = user_clients.get(message.from_user.id)
+    client = await user_clients.get(message.from_user.id)
     if not client: return await message.answer("Авторизуйтесь!")
+    full = (await state.get_data()).get('clear_full')
+    await state.clear()
+    if full:
+        try: chat = await peer_cache.resolve(client, message.from_user.id, message.text.strip())
+        except Exception as e: return await message.answer(f"Ошибка: {e}")
+        return await start_job(message, "Очистка", clear_full_history, chat)
+    await start_job(message, "Очистка", clear_recent)
+
+async def clear_recent(message: types.Message, client):
     try:
-        chat = message.text.strip()
-        messages = []
-        async for msg in client.get_chat_history(chat, limit=100):
-            if msg.from_user and msg.from_user.is_self: messages.append(msg.id)
+        chat = await peer_cache.resolve(client, message.from_user.id, message.text.strip())
+        messages = await limiter.call(message.from_user.id, recent_own, client, chat, priority=BULK)
         if messages:
-            await client.delete_messages(chat, messages)
+            await limiter.call(message.from_user.id, client.delete_messages, chat, messages, priority=BULK)
             await message.answer(f"✅ Удалено {len(messages)} сообщений.")
         else: await message.answer("Ваших сообщений не найдено.")
     except Exception as e: await message.answer(f"Ошибка: {e}")
+
+async def clear_full_history(message: types.Message, client, chat):
+    label = message.text.strip()
+    progress = await message.answer(f"🧹 Очистка {label}: поиск сообщений...")
+    edit = throttled_editor(progress)
+
+    async def on_progress(deleted):
+        await edit(f"🧹 Очистка {label}: удалено {deleted}...")
+
+    try:
+        deleted = await clear_history(client, message.from_user.id, chat, db, limiter, on_progress=on_progress)
+    except asyncio.CancelledError:
+        await edit_quietly(progress, f"⛔ Очистка {label} отменена.\nПовторите — она продолжится с места остановки.")
+        raise
+    except Exception as e:
+        logger.error("[User %s] Очистка %s прервана: %s: %s", message.from_user.id, label, type(e).__name__, e)
+        return await progress.edit_text(f"❌ Очистка {label} прервана: {e}\nПовторите — она продолжится с места остановки.")
+    if deleted:
+        await progress.edit_text(f"✅ Очистка {label} завершена. Удалено {deleted} сообщений.")
+    else:
+        await progress.edit_text("Ваших сообщений не найдено.")
+
+@dp.message(Command("export"))
+@dp.message(F.text == "📦 Экспорт")
+async def export_start(message: types.Message, state: FSMContext):
+    await state.clear()
+    await message.answer("Введите ID/username чата для выгрузки истории (прерванная выгрузка продолжится с места остановки):")
+    await state.set_state(ActionStates.waiting_for_export_target)
+
+@dp.message(ActionStates.waiting_for_export_target)
+async def export_process(message: types.Message, state: FSMContext):
+    client = await user_clients.get(message.from_user.id)
+    if not client: return await message.answer("Авторизуйтесь!")
+    await state.clear()
+    try: chat = await peer_cache.resolve(client, message.from_user.id, message.text.strip())
+    except Exception as e: return await message.answer(f"Ошибка: {e}")
+    await start_job(message, "Экспорт", export_chat, chat)
+
+async def export_chat(message: types.Message, client, chat):
+    user_id = message.from_user.id
+    label = message.text.strip()
+    progress = await message.answer(f"📦 Экспорт {label}: загрузка истории...")
+    edit = throttled_editor(progress)
+
+    async def on_progress(exported, rate):
+        await edit(f"📦 Экспорт {label}: {exported} сообщений ({rate:.0f} сообщ./с)...")
+
+    try:
+        path, exported, session, elapsed = await export_history(client, user_id, chat, db, limiter, EXPORT_DIR,
+                                                                on_progress=on_progress)
+    except asyncio.CancelledError:
+        await edit_quietly(progress, f"⛔ Экспорт {label} остановлен.\nПовторите — он продолжится с места остановки.")
+        raise
+    except Exception as e:
+        logger.error("[User %s] Экспорт %s прерван: %s: %s", user_id, label, type(e).__name__, e)
+        return await progress.edit_text(f"❌ Экспорт {label} прерван: {e}\nПовторите — он продолжится с места остановки.")
+    if not exported:
+        return await progress.edit_text("В чате нет сообщений.")
+    rate = session / elapsed if elapsed else 0
+    # Гистограммы метрик — в секундах: время на 1000 сообщений, скорость — 1000 / оно
+    if session: metrics.observe("export", "per_1000_msgs", elapsed / session * 1000)
+    size = os.path.getsize(path)
+    await progress.edit_text(f"✅ Экспорт {label}: {exported} сообщений, {size / 1024 / 1024:.1f} МБ "
+                             f"({session} за {elapsed:.1f} с, {rate:.0f} сообщ./с)")
+    if size > EXPORT_SEND_MAX:
+        return await message.answer(f"Архив больше лимита отправки ботом и сохранён на сервере: {path}")
+    try:
+        await bot.send_document(message.chat.id, FSInputFile(path, filename=os.path.basename(path)))
+    except Exception as e:
+        logger.error("[User %s] Архив %s не отправлен: %s: %s", user_id, path, type(e).__name__, e)
+        await message.answer(f"❌ Архив не отправлен: {e}\nОн сохранён на сервере: {path}")
+
+def parse_send_time(text):
+    """ЧЧ:ММ, ДД.ММ ЧЧ:ММ, ДД.ММ.ГГГГ ЧЧ:ММ или +N (минут) → datetime."""
+    text = text.strip()
+    now = datetime.now()
+    if text.startswith('+') and text[1:].isdigit():
+        return now + timedelta(minutes=int(text[1:]))
+    for fmt in ("%d.%m.%Y %H:%M", "%d.%m %H:%M", "%H:%M"):
+        try:
+            parsed = datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+        if fmt == "%H:%M":
+            parsed = now.replace(hour=parsed.hour, minute=parsed.minute, second=0, microsecond=0)
+            if parsed <= now: parsed += timedelta(days=1)
+        elif fmt == "%d.%m %H:%M":
+            parsed = parsed.replace(year=now.year)
+            if parsed <= now: parsed = parsed.replace(year=now.year + 1)
+        return parsed
+    return None
+
+@dp.message(F.text == "🕒 Отложенное")
+async def scheduled_start(message: types.Message, state: FSMContext):
+    if not await user_clients.get(message.from_user.id): return await message.answer("Авторизуйтесь!")
+    await message.answer("Введите ID/username получателя:")
+    await state.set_state(ActionStates.waiting_for_scheduled_target)
+
+@dp.message(ActionStates.waiting_for_scheduled_target)
+async def scheduled_target(message: types.Message, state: FSMContext):
+    await state.update_data(target=message.text.strip())
+    await message.answer("Введите текст сообщения:")
+    await state.set_state(ActionStates.waiting_for_scheduled_text)
+
+@dp.message(ActionStates.waiting_for_scheduled_text)
+async def scheduled_text(message: types.Message, state: FSMContext):
+    await state.update_data(text=message.text)
+    await message.answer("Когда отправить? Формат: ЧЧ:ММ, ДД.ММ ЧЧ:ММ, ДД.ММ.ГГГГ ЧЧ:ММ или +N (через N минут)")
+    await state.set_state(ActionStates.waiting_for_scheduled_time)
+
+@dp.message(ActionStates.waiting_for_scheduled_time)
+async def scheduled_time(message: types.Message, state: FSMContext):
+    send_at = parse_send_time(message.text or "")
+    if not send_at or send_at <= datetime.now():
+        return await message.answer("❌ Не удалось разобрать время (или оно в прошлом). Попробуйте еще раз:")
+    data = await state.get_data()
+    await scheduler.add(message.from_user.id, data['target'], data['text'], send_at.timestamp())
+    logger.info("[User %s] Запланировано сообщение в %s на %s", message.from_user.id, data['target'], send_at)
+    await message.answer(f"✅ Запланировано на {send_at:%d.%m.%Y %H:%M}")
+    await state.clear()
+
+# --- Заметки ---
+def note_label(text):
+    line = (text or "").strip().split("\n", 1)[0]
+    return line[:40] + "…" if len(line) > 40 else line or "(пусто)"
+
+def get_notes_kb(rows, older=None, newer=None, search=False):
+    """Кнопки заметок страницы; older/newer — callback_data соседних страниц."""
+    buttons = [[InlineKeyboardButton(text=note_label(text), callback_data=f"note:{note_id}")] for note_id, text in rows]
+    nav = []
+    if newer: nav.append(InlineKeyboardButton(text="◀️ Новее", callback_data=newer))
+    if older: nav.append(InlineKeyboardButton(text="Старше ▶️", callback_data=older))
+    if nav: buttons.append(nav)
+    if search:
+        buttons.append([InlineKeyboardButton(text="⬅️ Все заметки", callback_data="notes")])
+    else:
+        buttons.append([InlineKeyboardButton(text="➕ Добавить", callback_data="note_add"),
+                        InlineKeyboardButton(text="🔍 Поиск", callback_data="note_search")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+async def notes_page(user_id, before=None, after=None):
+    """Текст и клавиатура страницы заметок; страницы листаются по id, без OFFSET."""
+    rows = await db.list_notes(user_id, before=before, after=after, limit=NOTES_PAGE + 1)
+    if after is not None:
+        if not rows: return await notes_page(user_id)
+        has_newer, has_older = len(rows) > NOTES_PAGE, True
+        rows = rows[-NOTES_PAGE:]
+    else:
+        has_newer, has_older = before is not None, len(rows) > NOTES_PAGE
+        rows = rows[:NOTES_PAGE]
+    if not rows:
+        return "📝 Заметок пока нет.", get_notes_kb([])
+    kb = get_notes_kb(rows, older=has_older and f"notes:<{rows[-1][0]}", newer=has_newer and f"notes:>{rows[0][0]}")
+    return "📝 Заметки:", kb
+
+async def notes_search_page(user_id, query, before=None, prefix=False):
+    rows = await db.search_notes(user_id, query, before=before, limit=NOTES_PAGE + 1, prefix=prefix)
+    if not rows:
+        return f"🔍 По запросу «{query}» ничего не найдено.", get_notes_kb([], search=True)
+    older = len(rows) > NOTES_PAGE and f"nsearch:{rows[NOTES_PAGE - 1][0]}"
+    return f"🔍 Найдено по запросу «{query}»:", get_notes_kb(rows[:NOTES_PAGE], older=older, search=True)
+
+@dp.message(F.text == "📝 Заметки")
+async def notes_start(message: types.Message, state: FSMContext):
+    await state.clear()
+    text, kb = await notes_page(message.from_user.id)
+    await message.answer(text, reply_markup=kb)
+
+@dp.callback_query((F.data == "notes") | F.data.startswith("notes:"))
+async def notes_browse(callback: types.CallbackQuery, state: FSMContext):
+    key = callback.data[6:]
+    before = int(key[1:]) if key.startswith("<") else None
+    after = int(key[1:]) if key.startswith(">") else None
+    text, kb = await notes_page(callback.from_user.id, before=before, after=after)
+    await callback.message.edit_text(text, reply_markup=kb)
+    await callback.answer()
+
+@dp.callback_query(F.data.startswith("note:"))
+async def note_view(callback: types.CallbackQuery):
+    note_id = int(callback.data[5:])
+    text = await db.get_note(callback.from_user.id, note_id)
+    if text is None:
+        return await callback.answer("Заметка не найдена", show_alert=True)
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🗑 Удалить", callback_data=f"note_del:{note_id}"),
+         InlineKeyboardButton(text="⬅️ К списку", callback_data="notes")]
+    ])
+    await callback.message.edit_text(text[:4096], reply_markup=kb)
+    await callback.answer()
+
+@dp.callback_query(F.data.startswith("note_del:"))
+async def note_delete(callback: types.CallbackQuery):
+    await db.delete_note(callback.from_user.id, int(callback.data[9:]))
+    text, kb = await notes_page(callback.from_user.id)
+    await callback.message.edit_text(text, reply_markup=kb)
+    await callback.answer("🗑 Удалено")
+
+@dp.callback_query(F.data == "note_add")
+async def note_add(callback: types.CallbackQuery, state: FSMContext):
+    await callback.message.answer("Введите текст заметки:")
+    await state.set_state(ActionStates.waiting_for_note_text)
+    await callback.answer()
+
+@dp.message(ActionStates.waiting_for_note_text)
+async def note_save(message: types.Message, state: FSMContext):
+    if not message.text: return await message.answer("Заметка должна быть текстом. Введите текст:")
+    await db.add_note(message.from_user.id, message.text)
     await state.clear()
+    text, kb = await notes_page(message.from_user.id)
+    await message.answer(f"✅ Заметка сохранена\n\n{text}", reply_markup=kb)
+
+@dp.callback_query(F.data == "note_search")
+async def note_search_start(callback: types.CallbackQuery, state: FSMContext):
+    await callback.message.answer("Введите слова для поиска:")
+    await state.set_state(ActionStates.waiting_for_note_query)
+    await callback.answer()
+
+@dp.message(ActionStates.waiting_for_note_query)
+async def note_search(message: types.Message, state: FSMContext):
+    query = (message.text or "").strip()
+    if not query: return await message.answer("Введите слова для поиска:")
+    # Сначала целые слова (быстро); если ничего нет — по началу слов
+    prefix = not await db.search_notes(message.from_user.id, query, limit=1)
+    # Запрос нужен для следующих страниц: в callback_data он может не поместиться
+    await state.set_state(None)
+    await state.update_data(note_query=query, note_prefix=prefix)
+    text, kb = await notes_search_page(message.from_user.id, query, prefix=prefix)
+    await message.answer(text, reply_markup=kb)
+
+@dp.callback_query(F.data.startswith("nsearch:"))
+async def note_search_more(callback: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    query = data.get("note_query")
+    if not query: return await callback.answer("Повторите поиск", show_alert=True)
+    text, kb = await notes_search_page(callback.from_user.id, query, before=int(callback.data[8:]),
+                                       prefix=data.get("note_prefix", False))
+    await callback.message.edit_text(text, reply_markup=kb)
+    await callback.answer()
 
 @dp.message(F.text == "🔄 Перезапуск")
 async def restart(message: types.Message):
-    logger.warning(f"Запрос перезапуска от пользователя {message.from_user.id}")
+    if restart_request:
+        return await message.answer("⏳ Перезапуск уже выполняется")
+    logger.warning("Запрос перезапуска от пользователя %s", message.from_user.id)
     await message.answer("🔄 Бот перезапускается...")
-    await asyncio.sleep(0.5)
-    logger.info("🔄 БОТ ПЕРЕЗАПУЩЕН")
-    os.execv(sys.executable, ['python3'] + sys.argv)
+    if shard:
+        # Все процессы перезапускает фронт
+        return await shard.send({"op": "restart", "chat_id": message.chat.id, "requested_at": time.time()})
+    await request_restart(message.chat.id, time.time())
+
+async def request_restart(chat_id, requested_at):
+    global restart_request
+    if restart_request: return
+    restart_request = {"chat_id": chat_id, "requested_at": requested_at}
+    # Приём апдейтов останавливается, а остановка и exec выполняются в main()
+    if BOT_MODE == "webhook":
+        webhook_stop.set()
+    else:
+        await dp.stop_polling()
+
+# --- Рассылка ---
+async def msg_target_prompt(user_id):
+    groups = await db.list_target_groups(user_id)
+    text = ("Введите ID/username получателя — или нескольких через пробел, запятую или с новой строки.\n"
+            "Сохранить группу: #имя @a @b ...; отправить группе: #имя")
+    if groups: text += "\nГруппы: " + ", ".join(f"#{g}" for g in groups)
+    return text
+
+async def read_targets(message: types.Message):
+    """Получатели из ввода или сохранённой группы; None, если ввод не подошёл (ответ уже отправлен)."""
+    text = (message.text or "").strip()
+    if text.startswith("#"):
+        name, _, rest = text[1:].partition(" ")
+        targets = parse_targets(rest)
+        if targets:
+            await db.save_target_group(message.from_user.id, name, targets)
+            await message.answer(f"💾 Группа #{name} сохранена: {len(targets)} получателей")
+            return targets
+        targets = await db.get_target_group(message.from_user.id, name)
+        if not targets:
+            await message.answer(f"❌ Группа #{name} не найдена. Введите получателей:")
+        return targets
+    targets = parse_targets(text)
+    if not targets:
+        await message.answer("❌ Получатели не распознаны. Введите ID/username:")
+        return None
+    return targets
+
+async def run_broadcast(message: types.Message, client, targets):
+    user_id = message.from_user.id
+    total = len(targets)
+    progress = await message.answer(f"📤 Рассылка: 0 из {total}...")
+    edit = throttled_editor(progress)
+    sent = 0
+
+    async def on_progress(done, failed):
+        nonlocal sent
+        sent = done
+        if done < total:
+            await edit(f"📤 Рассылка: {done} из {total}, ошибок {failed}...")
+
+    started = time.perf_counter()
+    try:
+        # Одна страница диалогов на 100 чатов вместо resolve на каждого получателя
+        await peer_cache.warm(client, user_id)
+    except Exception as e:
+        logger.warning("[User %s] Не удалось прогреть кэш целей: %s", user_id, e)
+    try:
+        results = await broadcast(client, user_id, targets, message.text, limiter,
+                                  concurrency=BROADCAST_CONCURRENCY, on_progress=on_progress, peers=peer_cache)
+    except asyncio.CancelledError:
+        await edit_quietly(progress, f"⛔ Рассылка отменена: обработано {sent} из {total}")
+        raise
+    elapsed = time.perf_counter() - started
+    logger.info("[User %s] Рассылка: %s получателей за %.1f с", user_id, total, elapsed)
+    await progress.edit_text(format_report(results, elapsed))
+
+# --- Диалоги ---
+DIALOGS_PAGE = 10
+
+def get_dialogs_kb(rows, kind, counts, more, first):
+    label = lambda k, text: ("• " if k == kind else "") + f"{text} ({counts.get(k, 0) if k != 'all' else sum(counts.values())})"
+    filters = [InlineKeyboardButton(text=label(k, text), callback_data=f"dlg:{k}") for k, text in (("all", "Все"), *KINDS.items())]
+    buttons = [filters[:2], filters[2:]]
+    for chat_id, chat_kind, title, username, _ in rows:
+        text = f"{KINDS[chat_kind].split()[0]} {title}"[:60]
+        if username:
+            buttons.append([InlineKeyboardButton(text=text, url=f"https://t.me/{username}")])
+        else:
+            buttons.append([InlineKeyboardButton(text=text, callback_data=f"dlg_id:{chat_id}")])
+    nav = []
+    if not first: nav.append(InlineKeyboardButton(text="⏮ В начало", callback_data=f"dlg:{kind}"))
+    if more: nav.append(InlineKeyboardButton(text="Далее ▶️", callback_data=f"dlg:{kind}:{rows[-1][4]}:{rows[-1][0]}"))
+    if nav: buttons.append(nav)
+    buttons.append([InlineKeyboardButton(text="🔄 Обновить список", callback_data="dlg_rebuild")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+async def dialogs_page(user_id, kind="channel", before=None):
+    """Страница индекса диалогов; листается по ключу (дата, id), без OFFSET."""
+    rows = await dialog_index.page(user_id, None if kind == "all" else kind, before, DIALOGS_PAGE + 1)
+    counts = await dialog_index.counts(user_id)
+    text = "📢 Диалоги аккаунта:" if rows else "Здесь пока пусто."
+    return text, get_dialogs_kb(rows[:DIALOGS_PAGE], kind, counts, len(rows) > DIALOGS_PAGE, before is None)
+
+async def build_dialogs(message: types.Message, client, user_id):
+    progress = await message.answer("⏳ Собираю список диалогов...")
+    edit = throttled_editor(progress)
+
+    async def on_progress(seen):
+        await edit(f"⏳ Собираю список диалогов: {seen}...")
+
+    try:
+        await dialog_index.build(client, user_id, on_progress=on_progress)
+    except asyncio.CancelledError:
+        dialog_index.cancel(user_id)
+        await edit_quietly(progress, "⛔ Сбор списка диалогов отменён")
+        raise
+    except Exception as e:
+        logger.error("[User %s] Индекс диалогов не построен: %s: %s", user_id, type(e).__name__, e)
+        return await progress.edit_text(f"❌ Не удалось получить диалоги: {e}")
+    text, kb = await dialogs_page(user_id)
+    await progress.edit_text(text, reply_markup=kb)
+
+@dp.message(F.text == "📢 Каналы")
+async def dialogs_start(message: types.Message, state: FSMContext):
+    await state.clear()
+    user_id = message.from_user.id
+    client = await user_clients.get(user_id)
+    if not client: return await message.answer("Авторизуйтесь!")
+    if not await dialog_index.is_built(user_id):
+        return await start_job(message, "Список диалогов", build_dialogs, user_id)
+    try:
+        await dialog_index.refresh(client, user_id)
+    except Exception as e:
+        logger.warning("[User %s] Индекс диалогов не обновлён: %s", user_id, e)
+    text, kb = await dialogs_page(user_id)
+    await message.answer(text, reply_markup=kb)
+
+@dp.callback_query(F.data.startswith("dlg:"))
+async def dialogs_browse(callback: types.CallbackQuery):
+    parts = callback.data.split(":")
+    kind = parts[1] if parts[1] in KINDS else "all"
+    before = (int(parts[2]), int(parts[3])) if len(parts) == 4 else None
+    text, kb = await dialogs_page(callback.from_user.id, kind, before)
+    await callback.message.edit_text(text, reply_markup=kb)
+    await callback.answer()
+
+@dp.callback_query(F.data.startswith("dlg_id:"))
+async def dialogs_chat_id(callback: types.CallbackQuery):
+    await callback.answer(f"ID чата: {callback.data[7:]}", show_alert=True)
+
+@dp.callback_query(F.data == "dlg_rebuild")
+async def dialogs_rebuild(callback: types.CallbackQuery):
+    client = await user_clients.get(callback.from_user.id)
+    if not client: return await callback.answer("Авторизуйтесь!", show_alert=True)
+    await callback.answer()
+    uid = callback.from_user.id
+    # Автор callback.message — бот: очередь выбирается по пользователю из callback
+    await start_job(callback.message, "Список диалогов", build_dialogs, uid, user_id=uid)
+
+# --- Пересылка медиа от имени аккаунта ---
+async def relay_media(message: types.Message, client, target):
+    user_id = message.from_user.id
+    progress = await message.answer("📤 Загрузка...")
+    edit = throttled_editor(progress)
+
+    async def on_progress(sent, total):
+        if sent < total:
+            await edit(f"📤 Загрузка: {sent * 100 // total}% ({sent >> 20} из {total >> 20} МБ)...")
+
+    try:
+        chat = await peer_cache.resolve(client, user_id, target)
+        size, elapsed = await relay(bot, client, user_id, message, chat, limiter,
+                                    on_progress=on_progress, timeout=RELAY_TIMEOUT)
+    except asyncio.CancelledError:
+        await edit_quietly(progress, "⛔ Пересылка отменена")
+        raise
+    except TelegramBadRequest as e:
+        # Публичный Bot API не отдаёт файлы больше 20 МБ
+        logger.warning("[User %s] Файл не получен из Bot API: %s", user_id, e.message)
+        return await progress.edit_text(f"❌ Бот не может скачать файл: {e.message}")
+    except Exception as e:
+        logger.error("[User %s] Ошибка пересылки файла: %s: %s", user_id, type(e).__name__, e)
+        return await progress.edit_text(f"❌ Ошибка: {e}")
+    metrics.observe("relay", "mb_per_s", size / 1024 / 1024 / elapsed if elapsed else 0)
+    await progress.edit_text(f"✅ Отправлено: {format_throughput(size, elapsed)}")
+
+@dp.message(F.text == "📸 История")
+async def media_start(message: types.Message, state: FSMContext):
+    await state.clear()
+    await message.answer("Введите ID получателя (me — Избранное):")
+    await state.set_state(ActionStates.waiting_for_media_target)
+
+@dp.message(ActionStates.waiting_for_media_target, F.text)
+async def media_target(message: types.Message, state: FSMContext):
+    await state.update_data(target=message.text.strip())
+    await message.answer("Отправьте фото, видео или файл (подпись тоже будет отправлена):")
+    await state.set_state(ActionStates.waiting_for_media)
+
+@dp.message(ActionStates.waiting_for_media, F.photo | F.video | F.document)
+async def media_send(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    await state.clear()
+    await start_job(message, "Пересылка файла", relay_media, data['target'])
 
 # --- Универсальный обработчик для текста и эмодзи ---
 @dp.message(F.text | F.sticker)
 async def handle_all(message: types.Message, state: FSMContext):
     curr = await state.get_state()
-    client = user_clients.get(message.from_user.id)
     
     if curr == ActionStates.waiting_for_msg_target:
-        await state.update_data(target=message.text.strip())
-        await message.answer("Введите текст:")
+        targets = await read_targets(message)
+        if not targets: return
+        await state.update_data(targets=targets)
+        await message.answer("Введите текст:" if len(targets) == 1 else f"Получателей: {len(targets)}. Введите текст:")
         await state.set_state(ActionStates.waiting_for_msg_text)
     elif curr == ActionStates.waiting_for_msg_text:
+        client = await user_clients.get(message.from_user.id)
         if not client: return
-        await client.send_message((await state.get_data())['target'], message.text)
-        await message.answer("✅ Отправлено")
+        data = await state.get_data()
+        # 'target' — диалоги, начатые до появления рассылки
+        targets = data.get('targets') or [data['target']]
+        if len(targets) > 1:
+            await state.clear()
+            return await start_job(message, "Рассылка", run_broadcast, targets)
         await state.clear()
+        try:
+            chat = await peer_cache.resolve(client, message.from_user.id, targets[0])
+            await limiter.call(message.from_user.id, client.send_message, chat, message.text)
+        except Exception as e:
+            # Как в рассылке: неверный получатель или FloodWait сверх лимита — ответом, а не тишиной
+            logger.warning("[User %s] Сообщение в %s не отправлено: %s: %s", message.from_user.id, targets[0],
+                           type(e).__name__, e)
+            return await message.answer(f"❌ {targets[0]}: {type(e).__name__}: {e}", reply_markup=MAIN_KB)
+        await message.answer("✅ Отправлено")
     elif curr == ActionStates.waiting_for_sticker_target:
         await state.update_data(target=message.text.strip())
         await message.answer("Отправьте стикер:")
@@ -576,15 +1193,15 @@ async def handle_all(message: types.Message, state: FSMContext):
         pass 
     elif message.sticker: # Если ждали стикер
         data = await state.get_data()
-        if 'target' in data and client:
-            await client.send_sticker(data['target'], message.sticker.file_id)
-            await message.answer("✅ Стикер отправлен")
+        if 'target' in data:
+            # file_id бота аккаунту не подходит: стикер пересылается файлом
             await state.clear()
+            await start_job(message, "Пересылка файла", relay_media, data['target'])
     
     # Обработка кнопок меню если нет активного состояния
     if curr is None:
         if message.text == "✉️ Сообщение":
-            await message.answer("Введите ID получателя:")
+            await message.answer(await msg_target_prompt(message.from_user.id))
             await state.set_state(ActionStates.waiting_for_msg_target)
         elif message.text == "🎭 Стикеров":
             await message.answer("Введите ID получателя:")
@@ -596,9 +1213,150 @@ async def handle_all(message: types.Message, state: FSMContext):
              # Логика эмодзи аналогична сообщению
              pass
 
+async def run_webhook():
+    # Без WEBHOOK_SECRET секрет свой на каждый запуск: set_webhook ниже передаёт его Telegram
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    server = WebhookServer(dp, bot, path=WEBHOOK_PATH, secret=secret, host=WEBHOOK_HOST,
+                           port=WEBHOOK_PORT, max_concurrency=WEBHOOK_CONCURRENCY)
+    await server.start()
+    await bot.set_webhook(WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, secret_token=secret)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, webhook_stop.set)
+    try:
+        await webhook_stop.wait()
+    finally:
+        logger.info("Webhook: остановка, ожидание обрабатываемых апдейтов...")
+        await server.stop()
+
+async def notify_restarted(snapshot):
+    logger.info("Перезапуск: новый процесс поднят через %.2f с после запроса", since(snapshot))
+    try:
+        await bot.send_message(snapshot["chat_id"], f"✅ Бот перезапущен за {since(snapshot):.1f} с")
+    except Exception as e:
+        logger.warning("Перезапуск: не удалось отправить уведомление: %s", e)
+
+async def restore(snapshot):
+    """Вторая половина перезапуска: отчёт о готовности и прогрев сессий из снимка."""
+    await notify_restarted(snapshot)
+    started = time.perf_counter()
+    warmed = await user_clients.warm(snapshot.get("clients", []))
+    logger.info("Перезапуск: поднято %s сессий за %.2f с", warmed, time.perf_counter() - started)
+
+def first_update_handled(snapshot):
+    elapsed = time.perf_counter() - STARTED
+    metrics.observe("startup", "first_update", elapsed)
+    logger.info("Старт: первый апдейт обработан через %.2f с после запуска процесса", elapsed)
+    if snapshot:
+        elapsed = since(snapshot)
+        metrics.observe("restart", "first_update", elapsed)
+        logger.info("Перезапуск: первый апдейт обработан через %.2f с после запроса", elapsed)
+
+def report_import():
+    metrics.observe("startup", "import", IMPORTED - STARTED)
+    logger.info("Старт: импорт модулей %.2f с (Pyrogram %s)", IMPORTED - STARTED,
+                "загружен" if "pyrogram" in sys.modules else "отложен до первого аккаунта")
+
+async def shutdown():
+    """Останавливает всё после прекращения приёма апдейтов; возвращает живые сессии."""
+    if not await updates.drain(RESTART_DRAIN_TIMEOUT):
+        logger.warning("Остановка: %s апдейтов не дождались за %s с", updates.inflight, RESTART_DRAIN_TIMEOUT)
+    if not shard:
+        await confirm_updates()
+    live = user_clients.live_ids()
+    # Очистка продолжится с места остановки, остальные задачи повторяет пользователь
+    await jobs.close()
+    await scheduler.stop()
+    await ghost.stop()
+    await limiter.close()
+    await auth_logins.close()
+    await user_clients.close()
+    await fsm_storage.close()
+    await dialog_index.close()
+    db.close()
+    await bot.session.close()
+    return live
+
+async def confirm_updates():
+    if BOT_MODE != "webhook" and updates.last_update_id is not None:
+        # Подтверждаем обработанные апдейты, иначе getUpdates в новом процессе вернёт их снова
+        try:
+            await bot.get_updates(offset=updates.last_update_id + 1, limit=1, timeout=0)
+        except Exception as e:
+            logger.warning("Остановка: не удалось подтвердить апдейты: %s", e)
+
+async def receive_updates():
+    if BOT_MODE == "webhook":
+        await run_webhook()
+    else:
+        await bot.delete_webhook()
+        await dp.start_polling(bot, close_bot_session=False)
+
+async def run_front():
+    """SHARDS > 1: процесс только принимает апдейты, аккаунты живут в процессах-шардах."""
+    report_import()
+    # Миграции и разовый VACUUM — до запуска шардов, а не в каждом из них одновременно
+    init_db()
+    # Состояния FSM ведут шарды; фронт обработчиков не вызывает и fsm_state не читает
+    dp.fsm.storage = MemoryStorage()
+    snapshot = load_snapshot(RESTART_SNAPSHOT)
+    updates.on_first = lambda: first_update_handled(snapshot)
+    router = ShardRouter(SHARDS, on_restart=request_restart)
+    dp.update.outer_middleware(router)
+    await router.start()
+    if snapshot:
+        await notify_restarted(snapshot)
+        await router.warm(snapshot.get("clients", []))
+    try:
+        await receive_updates()
+    finally:
+        if not await router.drain(RESTART_DRAIN_TIMEOUT):
+            logger.warning("Остановка: шарды не ответили на все апдейты за %s с", RESTART_DRAIN_TIMEOUT)
+        await confirm_updates()
+        live = await router.stop(RESTART_DRAIN_TIMEOUT)
+        db.close()
+        await bot.session.close()
+    if restart_request:
+        save_snapshot(RESTART_SNAPSHOT, {**restart_request, "clients": live})
+        logger.info("Перезапуск: остановка заняла %.2f с, сессий в снимке: %s", since(restart_request), len(live))
+        reexec(log_listener)
+
 async def main():
     if not bot: return
-    await dp.start_polling(bot)
+    if SHARDS > 1 and not shard:
+        return await run_front()
+    report_import()
+    init_db()
+    # Снимок перезапуска шардов читает фронт
+    snapshot = load_snapshot(RESTART_SNAPSHOT) if not shard else None
+    updates.on_first = lambda: first_update_handled(snapshot)
+    metrics_port = METRICS_PORT + 1 + shard.index if shard and METRICS_PORT else METRICS_PORT
+    metrics_server = MetricsServer(metrics, metrics_port) if metrics_port else None
+    if metrics_server: await metrics_server.start()
+    user_clients.start()
+    auth_logins.start()
+    fsm_storage.start()
+    dialog_index.start()
+    ghost.start()
+    await scheduler.start()
+    restoring = asyncio.create_task(restore(snapshot)) if snapshot else None
+    try:
+        if shard:
+            await shard.serve(dp, bot, warm=user_clients.warm)
+        else:
+            await receive_updates()
+    finally:
+        if restoring: restoring.cancel()
+        live = await shutdown()
+        if metrics_server: await metrics_server.stop()
+    if shard:
+        return await shard.close(live)
+    if restart_request:
+        save_snapshot(RESTART_SNAPSHOT, {**restart_request, "clients": live})
+        logger.info("Перезапуск: остановка заняла %.2f с, сессий в снимке: %s", since(restart_request), len(live))
+        reexec(log_listener)
+
+IMPORTED = time.perf_counter()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,133 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+
+# Границы корзин в секундах: от 0.5 мс до 60 с
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: запись — один bisect и два сложения."""
+
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, p):
+        """Верхняя граница корзины, в которую попадает p-й перцентиль."""
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else float("inf")
+        return float("inf")
+
+
+class Metrics:
+    """Гистограммы задержек по семействам: handler, rpc, db."""
+
+    def __init__(self):
+        self._families = {}
+
+    def observe(self, family, name, seconds):
+        hists = self._families.get(family)
+        if hists is None:
+            hists = self._families[family] = {}
+        hist = hists.get(name)
+        if hist is None:
+            hist = hists[name] = Histogram()
+        hist.observe(seconds)
+
+    @contextmanager
+    def timer(self, family, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(family, name, time.perf_counter() - start)
+
+    def render_text(self):
+        """Сводка для команды /stats."""
+        lines = []
+        for family, hists in sorted(self._families.items()):
+            lines.append(f"[{family}]")
+            for name, h in sorted(hists.items(), key=lambda item: -item[1].count):
+                lines.append(f"{name}: n={h.count} avg={h.sum / h.count * 1000:.1f}ms "
+                             f"p50≤{_ms(h.percentile(50))} p99≤{_ms(h.percentile(99))}")
+        return "\n".join(lines)
+
+    def render_prometheus(self):
+        """Текстовый формат экспозиции Prometheus."""
+        out = []
+        for family, hists in sorted(self._families.items()):
+            metric = f"bot_{family}_seconds"
+            out.append(f"# TYPE {metric} histogram")
+            for name, h in sorted(hists.items()):
+                label = name.replace("\\", "\\\\").replace('"', '\\"')
+                cumulative = 0
+                for bound, c in zip(BUCKETS, h.counts):
+                    cumulative += c
+                    out.append(f'{metric}_bucket{{name="{label}",le="{bound}"}} {cumulative}')
+                out.append(f'{metric}_bucket{{name="{label}",le="+Inf"}} {h.count}')
+                out.append(f'{metric}_sum{{name="{label}"}} {h.sum}')
+                out.append(f'{metric}_count{{name="{label}"}} {h.count}')
+        return "\n".join(out) + "\n"
+
+
+def _ms(seconds):
+    return "∞" if seconds == float("inf") else f"{seconds * 1000:g}ms"
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Внутренний middleware: время каждого сработавшего обработчика."""
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(self, handler, event, data):
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            handler_obj = data.get("handler")
+            name = getattr(getattr(handler_obj, "callback", None), "__name__", "unknown")
+            self.metrics.observe("handler", name, time.perf_counter() - start)
+
+
+class MetricsServer:
+    """Эндпоинт /metrics для Prometheus; слушает только localhost."""
+
+    def __init__(self, metrics: Metrics, port: int, host: str = "127.0.0.1"):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def _handle(self, request):
+        return web.Response(text=self.metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
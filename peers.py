@@ -0,0 +1,160 @@
+import logging
+import time
+
+from cache import LRUCache
+from dialogs import dialog_pages
+from scheduler import normalize_chat
+
+logger = logging.getLogger(__name__)
+
+# Ошибки pyrogram.errors, после которых цель запоминается как несуществующая
+_NOT_FOUND = ("UsernameNotOccupied", "UsernameInvalid", "PeerIdInvalid", "ChannelInvalid", "ChannelPrivate")
+
+
+def _not_found():
+    from pyrogram import errors
+    return tuple(getattr(errors, name) for name in _NOT_FOUND) + (KeyError, ValueError)
+
+
+class PeerNotFound(LookupError):
+    """Цель недавно не нашлась; повторная попытка отложена до истечения negative_ttl."""
+
+
+def _key(chat):
+    """'@Name' → 'name', -100123 → '-100123'; None — цель не кэшируется (телефон, me)."""
+    if isinstance(chat, int):
+        return str(chat)
+    name = chat.lstrip("@").lower()
+    if not name or name in ("me", "self") or name.startswith("+"):
+        return None
+    return name
+
+
+def _unpack(peer):
+    """InputPeer → (peer_id, access_hash, type) в формате хранилища Pyrogram."""
+    from pyrogram import raw, utils
+
+    if isinstance(peer, raw.types.InputPeerUser):
+        return peer.user_id, peer.access_hash, "user"
+    if isinstance(peer, raw.types.InputPeerChannel):
+        return utils.MAX_CHANNEL_ID - peer.channel_id, peer.access_hash, "channel"
+    if isinstance(peer, raw.types.InputPeerChat):
+        return -peer.chat_id, 0, "group"
+    return None
+
+
+class PeerCache:
+    """Постоянный кэш целей аккаунтов: username или id → (peer id, access hash).
+
+    Записи живут в peer_cache (bot_data.db) ttl секунд, неудачные поиски —
+    negative_ttl секунд; перед ними стоит LRU в памяти. Найденная цель
+    переносится в хранилище сессии Pyrogram, поэтому send_message и
+    get_chat_history по возвращённому id не делают resolve-запросов, даже
+    если файл сессии новый.
+    """
+
+    def __init__(self, db, limiter, ttl: float = 86400, negative_ttl: float = 600, cache_size: int = 65536):
+        self.db = db
+        self.limiter = limiter
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._mem = LRUCache(cache_size)
+        self._warmed = {}  # user_id -> время последнего прогрева
+        self.resolves = 0
+
+    async def resolve(self, client, user_id, chat):
+        """Числовой id цели для методов Pyrogram; телефоны и 'me' возвращаются как есть."""
+        chat = normalize_chat(chat)
+        key = _key(chat)
+        if key is None:
+            return chat
+        now = time.time()
+        entry = self._mem.get((user_id, key))
+        if entry is None or entry[3] < now:
+            row = await self.db.get_peer(user_id, key)
+            entry = self._entry(row) if row else None
+            if entry is None or entry[3] < now:
+                entry = await self._lookup(client, user_id, chat, key)
+                if entry is None:
+                    return chat
+            self._mem.set((user_id, key), entry)
+        peer_id, access_hash, peer_type, _ = entry
+        if peer_id is None:
+            raise PeerNotFound(f"{chat} не найден")
+        await self._prime(client, peer_id, access_hash, peer_type, key if not isinstance(chat, int) else None)
+        return peer_id
+
+    def _entry(self, row):
+        peer_id, access_hash, peer_type, updated_at = row
+        ttl = self.ttl if peer_id is not None else self.negative_ttl
+        return peer_id, access_hash, peer_type, updated_at + ttl
+
+    async def _lookup(self, client, user_id, chat, key):
+        self.resolves += 1
+        try:
+            peer = await self.limiter.call(user_id, client.resolve_peer, chat)
+        except _not_found() as e:
+            logger.info("[User %s] Цель %s не найдена: %s", user_id, chat, type(e).__name__)
+            row = (None, None, None, time.time())
+        else:
+            unpacked = _unpack(peer)
+            if unpacked is None:
+                # Собственный аккаунт (InputPeerSelf) не кэшируется
+                return None
+            row = (*unpacked, time.time())
+        await self.db.save_peers(user_id, [(key, *row)])
+        return self._entry(row)
+
+    @staticmethod
+    async def _prime(client, peer_id, access_hash, peer_type, username):
+        storage = client.storage
+        try:
+            await storage.get_peer_by_id(peer_id)
+        except KeyError:
+            await storage.update_peers([(peer_id, access_hash, peer_type, username, None)])
+
+    @staticmethod
+    async def dialog_peers(client, chat):
+        """Записи кэша для чата из списка диалогов: invoke уже сложил peers в хранилище сессии."""
+        try:
+            peer = _unpack(await client.storage.get_peer_by_id(chat.id))
+        except KeyError:
+            return []
+        if peer is None:
+            return []
+        rows = [(str(chat.id), *peer)]
+        if chat.username:
+            rows.append((chat.username.lower(), *peer))
+        return rows
+
+    async def remember(self, user_id, rows):
+        """Сохраняет записи (key, peer_id, access_hash, type), собранные из диалогов."""
+        now = time.time()
+        await self.db.save_peers(user_id, [(*row, now) for row in rows])
+        for key, peer_id, access_hash, peer_type in rows:
+            self._mem.set((user_id, key), (peer_id, access_hash, peer_type, now + self.ttl))
+        self._warmed[user_id] = now
+
+    async def warm(self, client, user_id, limit: int = 1000):
+        """Заполняет кэш из списка диалогов: по вызову лимитера на страницу из 100 чатов."""
+        last = self._warmed.get(user_id)
+        if last is not None and time.time() - last < self.ttl:
+            return 0
+        rows = []
+        async for page in dialog_pages(client, user_id, self.limiter, limit=limit):
+            for chat, _, _ in page:
+                rows.extend(await self.dialog_peers(client, chat))
+        await self.remember(user_id, rows)
+        logger.info("[User %s] Кэш целей прогрет: %s записей", user_id, len(rows))
+        return len(rows)
+
+    async def forget(self, user_id):
+        """Забывает цели аккаунта: после выхода access hash другого аккаунта не подойдут."""
+        self._warmed.pop(user_id, None)
+        for mem_key in self._mem.keys():
+            if mem_key[0] == user_id:
+                self._mem.invalidate(mem_key)
+        await self.db.delete_peers(user_id)
+
+    def stats(self):
+        return {"memory": self._mem.stats(), "resolves": self.resolves, "warmed": len(self._warmed)}
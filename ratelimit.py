@@ -0,0 +1,187 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше — раньше
+INTERACTIVE = 0
+BULK = 1
+
+
+def _percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] if ordered else 0.0
+
+
+class _AccountQueue:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.heap = []
+        self.wake = asyncio.Event()
+        self.worker = None
+        self.running = set()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+
+class AccountRateLimiter:
+    """Очередь исходящих вызовов Pyrogram для каждого аккаунта.
+
+    Вызовы выпускаются через token bucket (rate в секунду, запас burst),
+    интерактивные раньше массовых; одновременно выполняется не больше
+    concurrency вызовов аккаунта. FloodWait не пробрасывается:
+    вызов возвращается в очередь, а аккаунт ставится на паузу на указанное
+    сервером время (если оно не длиннее max_flood_wait).
+    """
+
+    def __init__(self, rate: float = 2.0, burst: int = 5, max_flood_wait: float = 600, window: int = 1000,
+                 metrics=None, concurrency: int = 1):
+        self.rate = rate
+        self.metrics = metrics
+        self.burst = burst
+        self.concurrency = concurrency
+        self.max_flood_wait = max_flood_wait
+        self._queues = {}
+        self._seq = itertools.count()
+        self._waits = deque(maxlen=window)
+        self.calls = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0.0
+
+    async def call(self, user_id, fn, *args, priority: int = INTERACTIVE, **kwargs):
+        """Ставит fn(*args, **kwargs) в очередь аккаунта и ждёт результата."""
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = self._queues[user_id] = _AccountQueue(self.rate, self.burst)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(queue.heap, (priority, next(self._seq), time.monotonic(), future, fn, args, kwargs))
+        queue.wake.set()
+        self._ensure_worker(user_id, queue)
+        return await future
+
+    def _ensure_worker(self, user_id, queue):
+        if queue.worker is None:
+            queue.worker = asyncio.create_task(self._work(user_id, queue))
+
+    async def _work(self, user_id, queue):
+        try:
+            while queue.heap:
+                now = time.monotonic()
+                if queue.blocked_until > now:
+                    await self._sleep(queue, queue.blocked_until - now)
+                    continue
+                if len(queue.running) >= self.concurrency:
+                    await self._sleep(queue, None)
+                    continue
+                queue.refill(now)
+                if queue.tokens < 1:
+                    await self._sleep(queue, (1 - queue.tokens) / queue.rate)
+                    continue
+
+                item = heapq.heappop(queue.heap)
+                if item[3].done():  # ожидающий обработчик уже отменён
+                    continue
+                queue.tokens -= 1
+                self._waits.append(time.monotonic() - item[2])
+                self.calls += 1
+                task = asyncio.create_task(self._execute(user_id, queue, item))
+                queue.running.add(task)
+        finally:
+            queue.worker = None
+            self._release(user_id, queue)
+
+    async def _execute(self, user_id, queue, item):
+        from pyrogram import errors  # уже загружен клиентом, чьи вызовы проходят через очередь
+
+        priority, seq, enqueued, future, fn, args, kwargs = item
+        # Ожидающий отменён (например, /cancel): долгий вызов вроде прохода по диалогам прерывается тоже
+        task = asyncio.current_task()
+        future.add_done_callback(lambda f: task.cancel() if f.cancelled() else None)
+        started = time.perf_counter()
+        retried = False
+        try:
+            result = await fn(*args, **kwargs)
+        except errors.FloodWait as e:
+            wait = float(e.value or 0)
+            self.flood_waits += 1
+            self.flood_wait_seconds += wait
+            if wait > self.max_flood_wait:
+                logger.error("[User %s] FloodWait %.0fс больше лимита, вызов отменён", user_id, wait)
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                logger.warning("[User %s] FloodWait %.0fс, вызов перенесён", user_id, wait)
+                queue.blocked_until = max(queue.blocked_until, time.monotonic() + wait)
+                heapq.heappush(queue.heap, item)
+                retried = True
+                self._ensure_worker(user_id, queue)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+        finally:
+            # Вызов прерван отменой (close() или CancelledError внутри fn): ожидающий не должен висеть
+            if not retried and not future.done():
+                future.cancel()
+            if self.metrics is not None:
+                self.metrics.observe("rpc", getattr(fn, "__name__", "call"), time.perf_counter() - started)
+            queue.running.discard(asyncio.current_task())
+            queue.wake.set()
+            if queue.worker is None:
+                self._release(user_id, queue)
+
+    def _release(self, user_id, queue):
+        # Простаивающий аккаунт не держит состояние; пауза FloodWait сохраняется
+        if not queue.heap and not queue.running and queue.blocked_until <= time.monotonic():
+            if self._queues.get(user_id) is queue:
+                del self._queues[user_id]
+
+    async def close(self):
+        tasks = [t for q in self._queues.values() for t in (q.worker, *q.running) if t]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for queue in self._queues.values():
+            for item in queue.heap:
+                item[3].cancel()
+            queue.heap.clear()
+        self._queues.clear()
+
+    @staticmethod
+    async def _sleep(queue, delay):
+        # Интерактивный вызов может прийти во время ожидания токена — просыпаемся и пересчитываем
+        queue.wake.clear()
+        try:
+            await asyncio.wait_for(queue.wake.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    def depth(self, user_id=None):
+        if user_id is not None:
+            queue = self._queues.get(user_id)
+            return len(queue.heap) if queue else 0
+        return sum(len(q.heap) for q in self._queues.values())
+
+    def stats(self):
+        waits = sorted(self._waits)
+        return {
+            "accounts": len(self._queues),
+            "queued": self.depth(),
+            "calls": self.calls,
+            "wait_p50": _percentile(waits, 50),
+            "wait_p99": _percentile(waits, 99),
+            "flood_waits": self.flood_waits,
+            "flood_wait_seconds": self.flood_wait_seconds,
+        }
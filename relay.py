@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import logging
+import math
+import time
+
+import aiofiles
+
+logger = logging.getLogger(__name__)
+
+PART_SIZE = 512 * 1024  # максимальная часть upload.saveFilePart
+BIG_FILE = 10 * 1024 * 1024  # крупнее — saveBigFilePart без md5 и в несколько потоков
+_STICKER_MIME = {".webp": "image/webp", ".tgs": "application/x-tgsticker", ".webm": "video/webm"}
+
+
+class RelayError(Exception):
+    """Файл из чата с ботом не удалось переслать целиком."""
+
+
+def source(message):
+    """(file_id, размер, имя файла) вложения сообщения боту; None — пересылать нечего."""
+    if message.photo:
+        photo = message.photo[-1]
+        return photo.file_id, photo.file_size, "photo.jpg"
+    if message.video:
+        return message.video.file_id, message.video.file_size, message.video.file_name or "video.mp4"
+    if message.document:
+        return message.document.file_id, message.document.file_size, message.document.file_name or "file"
+    if message.sticker:
+        sticker = message.sticker
+        ext = ".tgs" if sticker.is_animated else ".webm" if sticker.is_video else ".webp"
+        return sticker.file_id, sticker.file_size, "sticker" + ext
+    return None
+
+
+def input_media(message, file, name):
+    """InputMedia для messages.sendMedia из загруженного файла и исходного сообщения."""
+    from pyrogram import raw
+
+    if message.photo:
+        return raw.types.InputMediaUploadedPhoto(file=file)
+    attributes = [raw.types.DocumentAttributeFilename(file_name=name)]
+    if message.video:
+        video = message.video
+        mime_type = video.mime_type or "video/mp4"
+        attributes.append(raw.types.DocumentAttributeVideo(
+            duration=video.duration, w=video.width, h=video.height, supports_streaming=True))
+    elif message.sticker:
+        mime_type = _STICKER_MIME[name[name.rindex("."):]]
+        attributes.append(raw.types.DocumentAttributeSticker(
+            alt=message.sticker.emoji or "", stickerset=raw.types.InputStickerSetEmpty()))
+    else:
+        mime_type = message.document.mime_type or "application/octet-stream"
+    return raw.types.InputMediaUploadedDocument(file=file, mime_type=mime_type, attributes=attributes)
+
+
+async def open_bot_file(bot, file_id, timeout: float = 3600, chunk_size: int = 65536):
+    """(размер, асинхронный поток байт) файла из Bot API без записи на диск.
+
+    Публичный Bot API отдаёт файлы до 20 МБ; с локальным сервером
+    (is_local) файл читается прямо из его каталога.
+    """
+    file = await bot.get_file(file_id)
+    api = bot.session.api
+
+    async def stream():
+        if api.is_local:
+            async with aiofiles.open(api.wrap_local_file.to_local(file.file_path), "rb") as f:
+                while chunk := await f.read(chunk_size):
+                    yield chunk
+            return
+        url = api.file_url(bot.token, file.file_path)
+        async for chunk in bot.session.stream_content(url, timeout=timeout, chunk_size=chunk_size):
+            yield chunk
+
+    return file.file_size, stream()
+
+
+async def _parts(chunks, part_size):
+    """Перекладывает поток кусков произвольной длины в части ровно по part_size (последняя — остаток)."""
+    buf = bytearray()
+    async for chunk in chunks:
+        buf += chunk
+        while len(buf) >= part_size:
+            yield bytes(buf[:part_size])
+            del buf[:part_size]
+    if buf:
+        yield bytes(buf)
+
+
+async def upload(client, chunks, size, name, session=None, workers: int = None, on_progress=None):
+    """Загружает поток байт в Telegram по частям, как Client.save_file, но без файла.
+
+    Части уходят по мере поступления; очередь на workers частей держит в
+    памяти не больше 2 * workers + 1 частей по 512 КБ, сколько бы весил
+    файл. Возвращает InputFile для messages.sendMedia. session — готовая
+    медиасессия; без неё открывается своя в DC аккаунта.
+    """
+    from pyrogram import raw
+    from pyrogram.session import Session
+
+    if not size:
+        raise RelayError("размер файла неизвестен")
+    is_big = size > BIG_FILE
+    workers = workers or (4 if is_big else 1)
+    total = math.ceil(size / PART_SIZE)
+    file_id = client.rnd_id()
+    md5 = None if is_big else hashlib.md5()
+    own_session = session is None
+    if own_session:
+        storage = client.storage
+        session = Session(client, await storage.dc_id(), await storage.auth_key(), await storage.test_mode(),
+                          is_media=True)
+        await session.start()
+
+    queue = asyncio.Queue(workers)
+    failures = []
+
+    async def worker():
+        while (rpc := await queue.get()) is not None:
+            if failures:
+                continue  # загрузка уже провалена: дочитываем очередь без запросов
+            try:
+                await session.invoke(rpc)
+            except Exception as e:
+                failures.append(e)
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    part = sent = 0
+    try:
+        async for data in _parts(chunks, PART_SIZE):
+            if failures:
+                break
+            if is_big:
+                rpc = raw.functions.upload.SaveBigFilePart(
+                    file_id=file_id, file_part=part, file_total_parts=total, bytes=data)
+            else:
+                rpc = raw.functions.upload.SaveFilePart(file_id=file_id, file_part=part, bytes=data)
+                md5.update(data)
+            await queue.put(rpc)
+            part += 1
+            sent += len(data)
+            if on_progress is not None:
+                await on_progress(sent, size)
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        if own_session:
+            await session.stop()
+
+    if failures:
+        raise failures[0]
+    if part != total:
+        raise RelayError(f"получено {sent} байт из {size}")
+    if is_big:
+        return raw.types.InputFileBig(id=file_id, parts=total, name=name)
+    return raw.types.InputFile(id=file_id, parts=total, name=name, md5_checksum=md5.hexdigest())
+
+
+async def relay(bot, client, user_id, message, chat, limiter, on_progress=None, timeout: float = 3600):
+    """Пересылает вложение сообщения боту в chat от имени аккаунта; возвращает (байт, секунд).
+
+    Скачивание из Bot API сразу идёт в загрузку Pyrogram; одновременно у
+    клиента не больше max_concurrent_transmissions загрузок, как у
+    save_file. Отправка готового файла идёт через очередь аккаунта.
+    """
+    from pyrogram import raw
+
+    file_id, _, name = source(message)
+    size, chunks = await open_bot_file(bot, file_id, timeout=timeout)
+    started = time.perf_counter()
+    try:
+        async with client.save_file_semaphore:
+            file = await upload(client, chunks, size, name, on_progress=on_progress)
+    finally:
+        await chunks.aclose()
+
+    async def send():
+        await client.invoke(raw.functions.messages.SendMedia(
+            peer=await client.resolve_peer(chat), media=input_media(message, file, name),
+            message=message.caption or "", random_id=client.rnd_id()))
+
+    await limiter.call(user_id, send)
+    elapsed = time.perf_counter() - started
+    logger.info("[User %s] Файл %s (%s байт) переслан за %.1f с", user_id, name, size, elapsed)
+    return size, elapsed
+
+
+def format_throughput(size, elapsed):
+    mb = size / 1024 / 1024
+    return f"{mb:.1f} МБ за {elapsed:.1f} с ({mb / elapsed if elapsed else 0:.1f} МБ/с)"
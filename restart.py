@@ -0,0 +1,87 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateTracker(BaseMiddleware):
+    """Внешний middleware апдейтов: сколько обрабатывается сейчас и последний update_id.
+
+    on_first вызывается один раз, когда завершится первый апдейт процесса.
+    """
+
+    def __init__(self, on_first=None):
+        self.on_first = on_first
+        self.inflight = 0
+        self.last_update_id = None
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, handler, event, data):
+        self.inflight += 1
+        self._idle.clear()
+        if self.last_update_id is None or event.update_id > self.last_update_id:
+            self.last_update_id = event.update_id
+        try:
+            return await handler(event, data)
+        finally:
+            self.inflight -= 1
+            if not self.inflight:
+                self._idle.set()
+            if self.on_first is not None:
+                callback, self.on_first = self.on_first, None
+                callback()
+
+    async def drain(self, timeout: float = 30):
+        """Ждёт завершения обрабатываемых апдейтов; False, если не дождались."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+def save_snapshot(path, state):
+    """Атомарно записывает снимок состояния для следующего процесса."""
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def load_snapshot(path):
+    """Читает и удаляет снимок; None, если перезапуска не было."""
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("Перезапуск: снимок %s не прочитан: %s", path, e)
+        state = None
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    return state
+
+
+def since(snapshot):
+    """Секунд прошло с момента запроса перезапуска."""
+    return time.time() - snapshot["requested_at"]
+
+
+def reexec(log_listener=None):
+    """Заменяет процесс новым экземпляром бота с теми же аргументами.
+
+    atexit при execv не срабатывает, поэтому очередь логов дописывается здесь.
+    """
+    if log_listener is not None:
+        log_listener.stop()
+    os.execv(sys.executable, [sys.executable] + sys.argv)
@@ -0,0 +1,197 @@
+import asyncio
+import heapq
+import inspect
+import logging
+import time
+from collections import defaultdict
+
+from db import SCHEDULED_FAILED, SCHEDULED_SENT
+from ratelimit import BULK
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_chat(chat_id):
+    """'-100123' → -100123, '@name' и 'name' остаются строками."""
+    if isinstance(chat_id, str):
+        stripped = chat_id.strip()
+        if stripped.lstrip('-').isdigit():
+            return int(stripped)
+        return stripped
+    return chat_id
+
+
+class MessageScheduler:
+    """Единый диспетчер отложенных сообщений.
+
+    В памяти держится min-heap ближайших строк scheduled_messages (не более
+    load_limit), задача спит до ближайшего дедлайна и отправляет одной пачкой
+    все сообщения, срок которых наступил. Строка помечается «отправляется»
+    до вызова Pyrogram, поэтому после перезапуска она не уйдёт второй раз.
+    В процессе-шарде (shard=(index, count)) загружаются только его аккаунты.
+    Завершённые строки старше keep секунд раз в purge_interval секунд
+    удаляются, а освободившееся место возвращается из файла базы.
+    """
+
+    def __init__(self, db, get_client, limiter=None, load_limit: int = 50000, coalesce: float = 0.05, peers=None,
+                 shard=None, keep: float = 7 * 86400, purge_interval: float = 3600):
+        self.db = db
+        self.get_client = get_client
+        self.limiter = limiter
+        self.peers = peers
+        self.shard = shard
+        self.load_limit = load_limit
+        self.coalesce = coalesce
+        self.keep = keep
+        self.purge_interval = purge_interval
+        self._heap = []
+        # send_at последней загруженной строки; None — в heap лежит всё ожидающее
+        self._horizon = None
+        self._wake = asyncio.Event()
+        self._task = None
+        self._purger = None
+        self._deliveries = set()
+        self.wakeups = 0
+        self.batches = 0
+        self.sent = 0
+        self.failed = 0
+        self.purged = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    async def start(self):
+        recovered = await self.db.recover_scheduled(self.shard)
+        if recovered:
+            logger.warning("Отложенные: %s сообщений были в отправке при остановке, повторно не отправляются", recovered)
+        await self._refill()
+        self._task = asyncio.create_task(self._run())
+        # Таблица общая: в шардах её чистит только первый
+        if self.shard is None or self.shard[0] == 0:
+            self._purger = asyncio.create_task(self._purge_loop())
+
+    async def stop(self):
+        for task in (self._task, self._purger):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._purger = None
+        if self._deliveries:
+            await asyncio.gather(*self._deliveries, return_exceptions=True)
+
+    async def add(self, user_id, chat_id, text, send_at: float):
+        row_id = await self.db.add_scheduled(user_id, chat_id, text, send_at)
+        # Строки за горизонтом остаются только в БД и подгрузятся позже
+        if self._horizon is None or send_at < self._horizon:
+            heapq.heappush(self._heap, (send_at, row_id, user_id, chat_id, text))
+            if self._heap[0][1] == row_id:
+                self._wake.set()
+        return row_id
+
+    async def purge(self):
+        """Удаляет завершённые строки старше keep секунд; возвращает их число."""
+        purged = await self.db.purge_scheduled(time.time() - self.keep)
+        if purged:
+            self.purged += purged
+            pages = await self.db.reclaim()
+            logger.info("Отложенные: удалено %s завершённых строк, освобождено %s страниц", purged, pages)
+        return purged
+
+    async def _purge_loop(self):
+        while True:
+            try:
+                await self.purge()
+            except Exception as e:
+                logger.error("Отложенные: ошибка очистки: %s: %s", type(e).__name__, e)
+            await asyncio.sleep(self.purge_interval)
+
+    async def _refill(self):
+        rows = await self.db.load_scheduled(self.load_limit, self.shard)
+        self._heap = [tuple(r) for r in rows]
+        heapq.heapify(self._heap)
+        self._horizon = rows[-1][0] if len(rows) >= self.load_limit else None
+
+    async def _run(self):
+        while True:
+            if not self._heap and self._horizon is not None:
+                await self._refill()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is None or timeout > 0:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeups += 1
+                continue
+
+            # Все сообщения с наступившим (или почти наступившим) сроком — одной пачкой
+            deadline = time.time() + self.coalesce
+            batch = []
+            while self._heap and self._heap[0][0] <= deadline:
+                batch.append(heapq.heappop(self._heap))
+            try:
+                claimed = await self.db.claim_scheduled([item[1] for item in batch])
+            except Exception as e:
+                logger.error("Отложенные: не удалось захватить пачку из %s: %s", len(batch), e)
+                for item in batch:
+                    heapq.heappush(self._heap, item)
+                await asyncio.sleep(1)
+                continue
+            batch = [item for item in batch if item[1] in claimed]
+            if not batch:
+                continue
+            self.batches += 1
+            task = asyncio.create_task(self._deliver(batch))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+    async def _deliver(self, batch):
+        by_user = defaultdict(list)
+        for send_at, row_id, user_id, chat_id, text in batch:
+            by_user[user_id].append((row_id, chat_id, text))
+        results = await asyncio.gather(*(self._deliver_guarded(uid, items) for uid, items in by_user.items()))
+        flat = [r for user_results in results for r in user_results]
+        try:
+            await self.db.finish_scheduled(flat)
+        except Exception as e:
+            # Строки остаются «отправляется»; при перезапуске recover_scheduled пометит их ошибкой
+            logger.error("Отложенные: не удалось записать итог %s сообщений: %s: %s", len(flat), type(e).__name__, e)
+
+    async def _deliver_guarded(self, user_id, items):
+        """_deliver_user, при сбое которого (например, подъёма клиента) все строки аккаунта — ошибка."""
+        try:
+            return await self._deliver_user(user_id, items)
+        except Exception as e:
+            logger.error("Отложенные: [User %s] %s сообщений не отправлено: %s: %s", user_id, len(items), type(e).__name__, e)
+            self.failed += len(items)
+            return [(row_id, SCHEDULED_FAILED) for row_id, _, _ in items]
+
+    async def _deliver_user(self, user_id, items):
+        client = self.get_client(user_id)
+        if inspect.isawaitable(client):
+            client = await client
+        if client is None:
+            logger.warning("Отложенные: аккаунт %s не авторизован, %s сообщений не отправлено", user_id, len(items))
+            self.failed += len(items)
+            return [(row_id, SCHEDULED_FAILED) for row_id, _, _ in items]
+        results = []
+        for row_id, chat_id, text in items:
+            try:
+                chat = normalize_chat(chat_id)
+                if self.peers is not None:
+                    chat = await self.peers.resolve(client, user_id, chat)
+                if self.limiter is not None:
+                    await self.limiter.call(user_id, client.send_message, chat, text, priority=BULK)
+                else:
+                    await client.send_message(chat, text)
+                results.append((row_id, SCHEDULED_SENT))
+                self.sent += 1
+            except Exception as e:
+                logger.error("Отложенные: [User %s] не отправлено в %s: %s: %s", user_id, chat_id, type(e).__name__, e)
+                results.append((row_id, SCHEDULED_FAILED))
+                self.failed += 1
+        return results
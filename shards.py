@@ -0,0 +1,220 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+# Апдейт с вложенным сообщением может занимать сотни килобайт
+LINE_LIMIT = 16 * 1024 * 1024
+
+
+def shard_of(user_id, count):
+    return user_id % count
+
+
+def _encode(message):
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+
+
+class _Worker:
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.writer = None
+        self.reader_task = None
+        self.inflight = 0
+        self.routed = 0
+        self.stopped = None  # Future со списком живых сессий после остановки
+
+
+class ShardRouter(BaseMiddleware):
+    """Фронт: внешний middleware апдейтов, который отдаёт их процессам-шардам.
+
+    Каждый из count процессов — тот же бот с переменной SHARD="k/count":
+    он владеет клиентами Pyrogram аккаунтов с user_id % count == k, сам
+    обрабатывает их апдейты и отвечает через Bot API. Фронт только
+    принимает апдейты (polling или webhook) и пишет их JSON-строкой в
+    socketpair нужного шарда; обработчики фронта не вызываются. Шард в
+    ответ присылает done на каждый апдейт и служебные сообщения (restart).
+    Упавший шард поднимается заново.
+    """
+
+    def __init__(self, count, argv=None, on_restart=None):
+        self.count = count
+        self.argv = argv or [sys.executable] + sys.argv
+        self.on_restart = on_restart  # async (chat_id, requested_at)
+        self._workers = [_Worker(k) for k in range(count)]
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._stopping = False
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        worker = self._workers[shard_of(user.id, self.count) if user else 0]
+        # Счётчик растёт до отправки: done может прийти раньше, чем вернётся drain()
+        worker.inflight += 1
+        worker.routed += 1
+        self._idle.clear()
+        await self._send(worker, {"op": "update", "update": event.model_dump(mode="json", exclude_unset=True)})
+
+    async def _send(self, worker, message):
+        worker.writer.write(_encode(message))
+        await worker.writer.drain()
+
+    # --- Процессы ---
+    async def start(self):
+        await asyncio.gather(*(self._spawn(worker) for worker in self._workers))
+
+    async def _spawn(self, worker):
+        parent, child = socket.socketpair()
+        env = {**os.environ, "SHARD": f"{worker.index}/{self.count}", "SHARD_FD": str(child.fileno())}
+        worker.process = await asyncio.create_subprocess_exec(*self.argv, env=env, pass_fds=(child.fileno(),))
+        child.close()
+        reader, worker.writer = await asyncio.open_unix_connection(sock=parent, limit=LINE_LIMIT)
+        worker.inflight = 0
+        worker.reader_task = asyncio.create_task(self._read(worker, reader))
+        logger.info("Шард %s/%s запущен, pid %s", worker.index, self.count, worker.process.pid)
+
+    async def _read(self, worker, reader):
+        while line := await reader.readline():
+            message = json.loads(line)
+            op = message["op"]
+            if op == "done":
+                worker.inflight -= 1
+                if not any(w.inflight for w in self._workers):
+                    self._idle.set()
+            elif op == "restart" and self.on_restart is not None:
+                await self.on_restart(message["chat_id"], message["requested_at"])
+            elif op == "stopped" and worker.stopped is not None and not worker.stopped.done():
+                worker.stopped.set_result(message["clients"])
+        if self._stopping:
+            return
+        # Процесс завершился сам: его апдейты потеряны, шард поднимается заново
+        code = await worker.process.wait()
+        logger.error("Шард %s завершился с кодом %s (%s апдейтов не обработано), перезапуск",
+                     worker.index, code, worker.inflight)
+        worker.writer.close()
+        await self._spawn(worker)
+        if not any(w.inflight for w in self._workers):
+            self._idle.set()
+
+    async def warm(self, user_ids):
+        """Раздаёт шардам сессии из снимка перезапуска для заблаговременного подъёма."""
+        for worker in self._workers:
+            own = [uid for uid in user_ids if shard_of(uid, self.count) == worker.index]
+            if own:
+                await self._send(worker, {"op": "warm", "clients": own})
+
+    async def drain(self, timeout: float = 30):
+        """Ждёт ответов шардов на все отданные апдейты; False, если не дождались."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def stop(self, timeout: float = 30):
+        """Останавливает шарды; возвращает живые сессии всех шардов для снимка."""
+        self._stopping = True
+        loop = asyncio.get_running_loop()
+        for worker in self._workers:
+            worker.stopped = loop.create_future()
+            try:
+                await self._send(worker, {"op": "stop"})
+            except (ConnectionError, RuntimeError):
+                worker.stopped.set_result([])
+        live = []
+        for worker in self._workers:
+            try:
+                live += await asyncio.wait_for(worker.stopped, timeout + 10)
+                await asyncio.wait_for(worker.process.wait(), 10)
+            except asyncio.TimeoutError:
+                logger.warning("Шард %s не остановился вовремя, завершается принудительно", worker.index)
+                worker.process.kill()
+                await worker.process.wait()
+            worker.writer.close()
+            worker.reader_task.cancel()
+        return live
+
+    def stats(self):
+        return [{"shard": w.index, "pid": w.process.pid if w.process else None, "routed": w.routed,
+                 "inflight": w.inflight} for w in self._workers]
+
+
+class ShardLink:
+    """Шард: канал к фронту, через который приходят апдейты своих аккаунтов."""
+
+    def __init__(self, index, count, fd):
+        self.index = index
+        self.count = count
+        self.fd = fd
+        self._writer = None
+        self._tasks = set()
+
+    @classmethod
+    def from_env(cls):
+        """ShardLink процесса-шарда или None, если процесс запущен как обычный бот или фронт."""
+        spec = os.getenv("SHARD")
+        if not spec:
+            return None
+        index, count = (int(x) for x in spec.split("/"))
+        return cls(index, count, int(os.environ["SHARD_FD"]))
+
+    def owns(self, user_id):
+        return shard_of(user_id, self.count) == self.index
+
+    async def send(self, message):
+        self._writer.write(_encode(message))
+        await self._writer.drain()
+
+    async def serve(self, dp, bot, warm=None):
+        """Обрабатывает апдейты от фронта, пока тот не пришлёт stop или не закроет канал.
+
+        Сигналы остановки приходят всей группе процессов; шард их
+        игнорирует и останавливается по команде фронта.
+        """
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, lambda: None)
+        reader, self._writer = await asyncio.open_unix_connection(
+            sock=socket.socket(fileno=self.fd), limit=LINE_LIMIT)
+        while line := await reader.readline():
+            message = json.loads(line)
+            op = message["op"]
+            if op == "update":
+                update = Update.model_validate(message["update"], context={"bot": bot})
+                self._spawn(self._handle(dp, bot, update))
+            elif op == "warm" and warm is not None:
+                self._spawn(warm(message["clients"]))
+            elif op == "stop":
+                break
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, dp, bot, update):
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            logger.exception("Шард %s: ошибка обработки апдейта %s: %s", self.index, update.update_id, e)
+        finally:
+            await self.send({"op": "done"})
+
+    async def close(self, live):
+        """Сообщает фронту об остановке и передаёт живые сессии для снимка перезапуска."""
+        try:
+            await self.send({"op": "stopped", "clients": live})
+            self._writer.close()
+        except (ConnectionError, RuntimeError):
+            pass
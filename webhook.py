@@ -0,0 +1,93 @@
+import asyncio
+import hmac
+import logging
+
+from aiohttp import web
+from aiogram import types
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """Локальный aiohttp-сервер, который передаёт апдейты в dp.feed_update.
+
+    Telegram получает 200 сразу после постановки апдейта в обработку.
+    Одновременно обрабатывается не больше max_concurrency апдейтов: сверх
+    этого запрос ждёт свободного места, и Telegram сам придерживает поток.
+    Запросы без верного заголовка с секретом отклоняются; сервер без
+    секрета не создаётся.
+    """
+
+    def __init__(self, dp, bot, path="/webhook", secret=None, host="127.0.0.1", port=8080, max_concurrency=100):
+        if not secret:
+            raise ValueError("Webhook без секрета принимал бы апдейты от кого угодно")
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._inflight = set()
+        self._runner = None
+        self._accepting = False
+        self.received = 0
+        self.rejected = 0
+
+    @property
+    def inflight(self):
+        return len(self._inflight)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self._accepting = True
+        logger.info("Webhook: слушаю http://%s:%s%s", self.host, self.port, self.path)
+
+    async def handle(self, request: web.Request):
+        if not self._accepting:
+            return web.Response(status=503)
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            self.rejected += 1
+            return web.Response(status=401)
+        try:
+            update = types.Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logger.warning("Webhook: некорректный апдейт: %s", e)
+            return web.Response(status=400)
+        await self._slots.acquire()
+        self.received += 1
+        task = asyncio.create_task(self._process(update))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+        return web.Response()
+
+    async def _process(self, update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            logger.error("Webhook: ошибка обработки апдейта %s: %s: %s", update.update_id, type(e).__name__, e)
+        finally:
+            self._slots.release()
+
+    async def stop(self, timeout: float = 30):
+        """Перестаёт принимать апдейты и дожидается обрабатываемых."""
+        self._accepting = False
+        if self._inflight:
+            done, pending = await asyncio.wait(set(self._inflight), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning("Webhook: %s апдейтов не успели обработаться и отменены", len(pending))
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None